@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.admission import AdmissionController, AdmissionMiddleware
+from load_tester import latency_stats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Latency of accepted requests under overload, with and without admission control')
+parser.add_argument('--workers', type=int, default=4,
+                    help='Requests the service can work on at once (default: 4)')
+parser.add_argument('--service-time-ms', type=float, default=10.0,
+                    help='Time each request takes once it gets a worker (default: 10)')
+parser.add_argument('--overload', type=float, default=2.0,
+                    help='Offered load as a multiple of the service capacity (default: 2.0)')
+parser.add_argument('--duration', type=float, default=10.0,
+                    help='Seconds of offered load (default: 10)')
+parser.add_argument('--max-queue', type=int, default=16,
+                    help='Admission queue length (default: 16)')
+parser.add_argument('--max-queue-wait-ms', type=float, default=100.0,
+                    help='Admission queue wait limit (default: 100)')
+args = parser.parse_args()
+
+def make_app(admission):
+    """A service whose handler needs one of --workers workers for --service-time-ms"""
+    app = FastAPI()
+    workers = asyncio.Semaphore(args.workers)
+
+    @app.post("/work")
+    async def work():
+        async with workers:
+            await asyncio.sleep(args.service_time_ms / 1000)
+        return {"status": "ok"}
+
+    if admission:
+        controller = AdmissionController(args.workers, args.max_queue, args.max_queue_wait_ms / 1000)
+        app.add_middleware(AdmissionMiddleware, controller=controller, service="benchmark",
+                           exempt_paths={"/health"}, priority_prefixes=())
+    return app
+
+async def drive(app):
+    """Sends requests at a fixed rate regardless of responses (open loop), in-process"""
+    scope = {"type": "http", "http_version": "1.1", "method": "POST", "path": "/work", "raw_path": b"/work",
+             "root_path": "", "scheme": "http", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+    rate = args.overload * args.workers / (args.service_time_ms / 1000)
+    results = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def request():
+        start = time.perf_counter()
+        status = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+
+        await app(dict(scope), receive, send)
+        results.append((status[0], (time.perf_counter() - start) * 1000))
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(rate * args.duration)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(request()))
+    await asyncio.gather(*tasks)
+    return rate, time.perf_counter() - start, results
+
+def main():
+    for admission in (False, True):
+        rate, elapsed, results = asyncio.run(drive(make_app(admission)))
+        accepted = [latency for status, latency in results if status == 200]
+        rejected = {}
+        for status, _ in results:
+            if status != 200:
+                rejected[status] = rejected.get(status, 0) + 1
+        stats = latency_stats(accepted)
+        logger.info(f"{'with' if admission else 'without'} admission control: {rate:.0f} req/s offered, "
+                    f"{len(accepted) / elapsed:.0f} req/s accepted, rejected {rejected or 0} | accepted latency "
+                    f"p50={stats['p50_ms']:.1f} ms p99={stats['p99_ms']:.1f} ms max={stats['max_ms']:.1f} ms "
+                    f"(all done after {elapsed:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Concurrent-request throughput benchmark for the ingestion service')
+parser.add_argument('--ingest-url', type=str, default='http://localhost:8000/ingest',
+                    help='URL for the data ingestion service (default: http://localhost:8000/ingest)')
+parser.add_argument('--num-requests', type=int, default=500,
+                    help='Total number of requests to send (default: 500)')
+parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                    help='Concurrency levels to measure (default: 1 8 32)')
+args = parser.parse_args()
+
+_local = threading.local()
+
+def timed_request(url):
+    """
+    Send one request on a per-thread session and return (latency, ok)
+    """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    data = {"features": [random.uniform(0, 1) for _ in range(4)]}
+    start = time.perf_counter()
+    try:
+        ok = _local.session.post(url, json=data, timeout=60).status_code == 200
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - start, ok
+
+def run(concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: timed_request(args.ingest_url), range(args.num_requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    errors = sum(1 for _, ok in results if not ok)
+    logger.info(f"concurrency={concurrency:<4} throughput={args.num_requests / elapsed:8.1f} req/s "
+                f"p50={np.percentile(latencies, 50):7.1f} ms p99={np.percentile(latencies, 99):7.1f} ms "
+                f"errors={errors}")
+
+def main():
+    # Warm up connections and code paths before measuring
+    for _ in range(10):
+        timed_request(args.ingest_url)
+
+    for concurrency in args.concurrency:
+        run(concurrency)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inference"))
+from forest_engine import ForestEngine
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Parity check and benchmark of the NumPy forest engine against sklearn')
+parser.add_argument('--model-path', type=str, default='model.pkl',
+                    help='Path of the pickled model (default: model.pkl)')
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000, 10000],
+                    help='Batch sizes to measure (default: 1 100 1000 10000)')
+parser.add_argument('--duration', type=float, default=2.0,
+                    help='Seconds to spend measuring each batch size and engine (default: 2.0)')
+args = parser.parse_args()
+
+def check_parity(model, engine):
+    """
+    Compares predictions on random, uniform and training-range inputs
+    """
+    rng = np.random.default_rng(42)
+    inputs = {
+        "normal": rng.normal(size=(100000, engine.n_features)),
+        "uniform": rng.random((100000, engine.n_features)),
+        "wide": rng.normal(scale=100.0, size=(100000, engine.n_features)),
+    }
+    for name, X in inputs.items():
+        difference = np.abs(engine.predict(X) - model.predict(X)).max()
+        logger.info(f"parity {name:<8} max abs difference={difference:.3e}")
+        assert difference < 1e-5, f"Engine disagrees with sklearn on {name} inputs"
+
+def measure(predict_fn, X):
+    """Returns (mean latency in ms, rows per second)"""
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        predict_fn(X)
+        calls += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / calls * 1000, calls * X.shape[0] / elapsed
+
+def main():
+    with warnings.catch_warnings():
+        # Models pickled with another sklearn version still load for benchmarking
+        warnings.simplefilter("ignore")
+        model = joblib.load(args.model_path)
+
+    engine = ForestEngine.from_sklearn(model)
+    logger.info(f"{engine.roots.shape[0]} trees, {engine.value.shape[0]} nodes, "
+                f"max depth {engine.max_depth}, {engine.nbytes / 1024:.1f} KiB")
+
+    check_parity(model, engine)
+
+    rng = np.random.default_rng(0)
+    for batch_size in args.batch_sizes:
+        X = rng.normal(size=(batch_size, engine.n_features))
+        sklearn_latency, sklearn_throughput = measure(model.predict, X)
+        engine_latency, engine_throughput = measure(engine.predict, X)
+        logger.info(f"batch={batch_size:<6} sklearn {sklearn_latency:8.3f} ms {sklearn_throughput:11.0f} rows/s | "
+                    f"numpy {engine_latency:8.3f} ms {engine_throughput:11.0f} rows/s | "
+                    f"speedup {sklearn_latency / engine_latency:5.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+import logging
+import random
+import time
+
+import numpy as np
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(
+    description='Compare per-request latency and results of the split and fused pipeline modes. '
+                'Start the split services as usual and a second ingestion service with '
+                'PIPELINE_MODE=fused, e.g. on port 8010.')
+parser.add_argument('--split-url', type=str, default='http://localhost:8000/ingest',
+                    help='Ingestion URL of the split deployment (default: http://localhost:8000/ingest)')
+parser.add_argument('--fused-url', type=str, default='http://localhost:8010/ingest',
+                    help='Ingestion URL of the fused deployment (default: http://localhost:8010/ingest)')
+parser.add_argument('--num-requests', type=int, default=500,
+                    help='Number of requests to send to each mode (default: 500)')
+args = parser.parse_args()
+
+def comparable(result):
+    """The response as canonical JSON, without the per-call timestamp"""
+    data = dict(result["data"])
+    data.pop("timestamp", None)
+    return json.dumps({**result, "data": data}, sort_keys=True)
+
+def main():
+    split_session = requests.Session()
+    fused_session = requests.Session()
+    latencies = {"split": [], "fused": []}
+    mismatches = 0
+
+    for i in range(args.num_requests):
+        data = {"features": [random.uniform(0, 1) for _ in range(4)], "metadata": {"request": i}}
+
+        # Alternate the order so neither mode benefits from running first
+        order = [("split", split_session, args.split_url), ("fused", fused_session, args.fused_url)]
+        if i % 2:
+            order.reverse()
+
+        results = {}
+        for mode, session, url in order:
+            start = time.perf_counter()
+            response = session.post(url, json=data, timeout=30)
+            latencies[mode].append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+            results[mode] = response.json()
+
+        if comparable(results["split"]) != comparable(results["fused"]):
+            mismatches += 1
+
+    # Discard the first requests as warm-up
+    warmup = min(20, args.num_requests // 10)
+    for mode, values in latencies.items():
+        values = np.array(values[warmup:])
+        logger.info(f"{mode:<6} mean={values.mean():6.2f} ms p50={np.percentile(values, 50):6.2f} ms "
+                    f"p99={np.percentile(values, 99):6.2f} ms")
+    logger.info(f"Identical results (ignoring timestamp): {args.num_requests - mismatches}/{args.num_requests}")
+
+if __name__ == "__main__":
+    main()
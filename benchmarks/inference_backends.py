@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "inference"))
+os.environ.setdefault("MODEL_PATH", os.path.join(ROOT_DIR, "model.pkl"))
+os.environ.setdefault("MODEL_REGISTRY_DIR", os.path.join(ROOT_DIR, "inference", "model_registry"))
+from model_executor import ModelExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Model call throughput and event loop responsiveness per inference backend')
+parser.add_argument('--backends', type=str, nargs='+', default=['inline', 'thread', 'process'],
+                    help='Backends to measure (default: inline thread process)')
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                    help='Worker counts to measure for the thread and process backends (default: 1 2 4 8)')
+parser.add_argument('--batch-size', type=int, default=1000,
+                    help='Rows per model call (default: 1000)')
+parser.add_argument('--concurrency', type=int, default=16,
+                    help='Model calls kept in flight (default: 16)')
+parser.add_argument('--duration', type=float, default=5.0,
+                    help='Seconds to measure each configuration (default: 5.0)')
+parser.add_argument('--probe-interval', type=float, default=0.01,
+                    help='Seconds between event loop probes standing in for /health (default: 0.01)')
+args = parser.parse_args()
+
+async def probe(stop, delays):
+    """
+    Records how late the event loop wakes up a sleeping task
+
+    A /health request waits at least this long before its handler runs.
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(args.probe_interval)
+        delays.append((time.perf_counter() - start - args.probe_interval) * 1000)
+
+async def measure(backend, workers):
+    """Returns (rows per second, probe delays in ms)"""
+    executor = ModelExecutor(backend, workers=workers, max_pending=args.concurrency)
+    await executor.start()
+    features = np.random.default_rng(0).normal(size=(args.batch_size, 4))
+    await executor.run(features)
+
+    stop = asyncio.Event()
+    delays = []
+    calls = 0
+    end_time = time.perf_counter() + args.duration
+
+    async def client():
+        nonlocal calls
+        while time.perf_counter() < end_time:
+            await executor.run(features)
+            calls += 1
+
+    probe_task = asyncio.create_task(probe(stop, delays))
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+    await executor.stop()
+    return calls * args.batch_size / elapsed, sorted(delays)
+
+def main():
+    logger.info(f"{os.cpu_count()} CPUs, {args.batch_size} rows per call, {args.concurrency} calls in flight")
+    for backend in args.backends:
+        for workers in ([1] if backend == "inline" else args.workers):
+            throughput, delays = asyncio.run(measure(backend, workers))
+            p50 = delays[len(delays) // 2] if delays else float("nan")
+            p99 = delays[int(len(delays) * 0.99)] if delays else float("nan")
+            worst = delays[-1] if delays else float("nan")
+            logger.info(f"{backend:<8} workers={workers:<3} {throughput:11.0f} rows/s | "
+                        f"health probe delay p50={p50:7.2f} ms p99={p99:7.2f} ms max={worst:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
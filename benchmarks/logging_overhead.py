@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Spans are not exported while benchmarking
+os.environ["TRACE_COLLECTOR_URL"] = ""
+from shared.logging_setup import TEXT_FORMAT, configure_logging
+from shared.tracing import install_tracing
+
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Measure the per-request cost of request logging')
+parser.add_argument('--num-requests', type=int, default=20000,
+                    help='Requests per configuration (default: 20000)')
+parser.add_argument('--num-features', type=int, default=100,
+                    help='Features in the logged request payload (default: 100)')
+parser.add_argument('--output', type=str, default=os.devnull,
+                    help='Where the log lines are written (default: discarded)')
+parser.add_argument('--write-latency-ms', type=float, default=0.0,
+                    help='Delay added to every write, standing in for a slow log pipe (default: 0)')
+args = parser.parse_args()
+
+class SlowStream:
+    """Wraps a stream so that every write takes at least --write-latency-ms"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        time.sleep(args.write_latency_ms / 1000)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def make_app(lazy):
+    """A service logging its request payload the way the ingestion service does"""
+    app = FastAPI()
+    install_tracing(app, "benchmark")
+    request_logger = logging.getLogger("benchmark.service")
+
+    @app.post("/ingest")
+    async def ingest(request: Request):
+        data = await request.json()
+        if lazy:
+            request_logger.info("Received data for ingestion: %s", data)
+        else:
+            request_logger.info(f"Received data for ingestion: {data}")
+        request_logger.info("Data successfully ingested and preprocessed")
+        return {"status": "ok"}
+
+    return app
+
+async def drive(app):
+    """Calls the ASGI app directly, leaving out the network and the server"""
+    body = json.dumps({"features": [i / args.num_features for i in range(args.num_features)],
+                       "metadata": {"source": "benchmark"}}).encode()
+    scope = {"type": "http", "http_version": "1.1", "method": "POST", "path": "/ingest", "raw_path": b"/ingest",
+             "root_path": "", "scheme": "http", "query_string": b"",
+             "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(args.num_requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / args.num_requests * 1e6
+
+def synchronous_logging(stream, level):
+    """The previous setup: a plain stream handler formatting and writing on the request path"""
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    logging.getLogger().handlers[:] = [handler]
+    logging.getLogger().setLevel(level)
+
+def main():
+    results = []
+    with open(args.output, "w") as output:
+        stream = SlowStream(output) if args.write_latency_ms > 0 else output
+        synchronous_logging(stream, logging.WARNING)
+        baseline = asyncio.run(drive(make_app(lazy=True)))
+        results.append(("logging off", baseline))
+
+        synchronous_logging(stream, logging.INFO)
+        results.append(("synchronous, eager payload", asyncio.run(drive(make_app(lazy=False)))))
+
+        for name, rates in (("queued JSON", {}), ("queued JSON, INFO=0.1", {logging.INFO: 0.1})):
+            handler = configure_logging("benchmark", stream=stream, sample_rates=rates)
+            micros = asyncio.run(drive(make_app(lazy=True)))
+            # Records dropped because the writer thread fell behind are reported
+            results.append((f"{name} ({handler.dropped} dropped)", micros))
+
+        # Waits for the queued records to be written, then reports on stderr
+        configure_logging("benchmark", stream=sys.stderr)
+
+    for name, micros in results:
+        logger.info(f"{name:<36} {micros:7.1f} us/request (+{micros - baseline:.1f} us)")
+
+if __name__ == "__main__":
+    main()
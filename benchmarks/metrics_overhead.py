@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.metrics import install_metrics, phase
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Measure the per-request cost of the metrics middleware and phase timers')
+parser.add_argument('--num-requests', type=int, default=20000,
+                    help='Requests per configuration (default: 20000)')
+args = parser.parse_args()
+
+def make_app(instrumented):
+    """A service with one endpoint timing a compute phase, as the pipeline services do"""
+    app = FastAPI()
+    if instrumented:
+        install_metrics(app, "benchmark")
+
+    @app.get("/work")
+    async def work():
+        with phase("compute"):
+            pass
+        return {"status": "ok"}
+
+    return app
+
+async def drive(app, headers):
+    """Calls the ASGI app directly, leaving out the network and the server"""
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "path": "/work", "raw_path": b"/work",
+             "root_path": "", "scheme": "http", "query_string": b"", "headers": headers,
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(args.num_requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / args.num_requests * 1e6
+
+def main():
+    baseline = asyncio.run(drive(make_app(False), []))
+    instrumented = asyncio.run(drive(make_app(True), []))
+    debug = asyncio.run(drive(make_app(True), [(b"x-debug-timings", b"1")]))
+
+    logger.info(f"without metrics      {baseline:7.1f} us/request")
+    logger.info(f"with metrics         {instrumented:7.1f} us/request (+{instrumented - baseline:.1f} us)")
+    logger.info(f"with debug timings   {debug:7.1f} us/request (+{debug - baseline:.1f} us)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INFERENCE_DIR = os.path.join(ROOT_DIR, "inference")
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Memory and startup time of inference workers with a private or shared model')
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16],
+                    help='Numbers of concurrent worker processes to measure (default: 1 4 16)')
+parser.add_argument('--model-path', type=str, default=None,
+                    help='Model to load; by default a RandomForest of --trees trees is trained on --samples rows')
+parser.add_argument('--trees', type=int, default=100,
+                    help='Trees of the generated model (default: 100)')
+parser.add_argument('--samples', type=int, default=10000,
+                    help='Training rows of the generated model (default: 10000)')
+args = parser.parse_args()
+
+def memory_kib():
+    """Resident, proportional and private memory of this process in KiB, from smaps_rollup"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Rss"], fields["Pss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+def worker(results, release):
+    """Loads the model the way the inference service does and reports its footprint"""
+    start = time.perf_counter()
+    sys.path.insert(0, INFERENCE_DIR)
+    import numpy as np
+    import predictor
+    predictor.initialize()
+    predictor.run_model(np.zeros((1, predictor.active.engine.n_features if predictor.active.engine is not None
+                                  else predictor.active.model.n_features_in_)))
+    startup = time.perf_counter() - start
+    # Measure once every worker is up, so shared pages are counted across all of them
+    results.put(("ready", startup))
+    release.wait()
+    results.put(("memory", memory_kib()))
+
+def run_workers(num_workers, shared):
+    os.environ["INFERENCE_SHARED_MODEL"] = "true" if shared else "false"
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    release = context.Event()
+    processes = [context.Process(target=worker, args=(results, release)) for _ in range(num_workers)]
+    for process in processes:
+        process.start()
+    startups = [results.get()[1] for _ in processes]
+    release.set()
+    memory = [results.get()[1] for _ in processes]
+    for process in processes:
+        process.join()
+    return startups, memory
+
+def generate_model(path):
+    import joblib
+    import numpy as np
+    from sklearn.ensemble import RandomForestRegressor
+
+    rng = np.random.default_rng(42)
+    X = rng.random((args.samples, 4))
+    y = 3 * X[:, 0] - 2 * X[:, 1] + 0.5 * X[:, 2] + rng.normal(0, 0.1, args.samples)
+    logger.info(f"Training a RandomForest with {args.trees} trees on {args.samples} rows")
+    joblib.dump(RandomForestRegressor(n_estimators=args.trees, random_state=42).fit(X, y), path)
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = args.model_path
+        if model_path is None:
+            model_path = os.path.join(directory, "model.pkl")
+            generate_model(model_path)
+        os.environ["MODEL_PATH"] = model_path
+        os.environ["MODEL_REGISTRY_DIR"] = os.path.join(directory, "model_registry")
+        os.environ["SHARED_MODEL_DIR"] = os.path.join(directory, "shared")
+        logger.info(f"Model file: {os.path.getsize(model_path) / 2**20:.1f} MiB")
+
+        # Export the shared arrays once so the shared runs measure attaching only
+        run_workers(1, shared=True)
+
+        for shared in (False, True):
+            for num_workers in args.workers:
+                startups, memory = run_workers(num_workers, shared)
+                rss, pss, private = (sum(values) / len(values) / 1024 for values in zip(*memory))
+                logger.info(f"{'shared' if shared else 'private':<7} workers={num_workers:<3} "
+                            f"startup mean={sum(startups) / len(startups):6.2f}s max={max(startups):6.2f}s | "
+                            f"per worker RSS={rss:7.1f} MiB PSS={pss:7.1f} MiB private={private:7.1f} MiB | "
+                            f"total PSS={pss * num_workers:8.1f} MiB")
+
+if __name__ == "__main__":
+    main()
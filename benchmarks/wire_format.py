@@ -0,0 +1,72 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared import wire
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Compare JSON and msgpack encoding of an inter-stage batch payload')
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 10000],
+                    help='Batch sizes to measure (default: 1 100 10000)')
+parser.add_argument('--num-features', type=int, default=4,
+                    help='Features per row (default: 4)')
+parser.add_argument('--duration', type=float, default=1.0,
+                    help='Seconds to spend measuring each format and direction (default: 1.0)')
+args = parser.parse_args()
+
+def make_batch(num_rows):
+    """A preprocessed batch as sent from preprocessing to inference"""
+    rng = np.random.default_rng(0)
+    return {
+        "features": rng.normal(size=(num_rows, args.num_features)),
+        "metadata": [{"row": i} for i in range(num_rows)],
+        "preprocessing_info": [{"mean": 0.5, "std": 1.2, "replaced_missing": False}] * num_rows,
+        "errors": [None] * num_rows
+    }
+
+def measure(fn):
+    """Mean milliseconds per call"""
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start) / calls * 1000
+
+def main():
+    if wire.msgpack is None:
+        logger.error("msgpack is not installed")
+        sys.exit(1)
+
+    print(f"{'rows':>6} {'format':<8} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}")
+    for num_rows in args.batch_sizes:
+        batch = make_batch(num_rows)
+
+        # JSON as sent by httpx: arrays become lists, the receiver validates into lists again
+        json_body = json.dumps(wire.to_json_compatible(batch)).encode()
+        json_encode = measure(lambda: json.dumps(wire.to_json_compatible(batch)).encode())
+        json_decode = measure(lambda: np.array(json.loads(json_body)["features"], dtype=float))
+
+        msgpack_body = wire.encode(batch)
+        msgpack_encode = measure(lambda: wire.encode(batch))
+        msgpack_decode = measure(lambda: wire.decode(msgpack_body))
+
+        assert np.array_equal(wire.decode(msgpack_body)["features"], batch["features"])
+        assert np.array_equal(np.array(json.loads(json_body)["features"]), batch["features"])
+
+        print(f"{num_rows:>6} {'json':<8} {len(json_body):>10} {json_encode:>10.3f} {json_decode:>10.3f}")
+        print(f"{num_rows:>6} {'msgpack':<8} {len(msgpack_body):>10} {msgpack_encode:>10.3f} {msgpack_decode:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Score an NDJSON file of FeatureData records through the pipeline')
+parser.add_argument('input', type=str,
+                    help='NDJSON file with one {"features": [...], "metadata": {...}} record per line, or - for stdin')
+parser.add_argument('--stream-url', type=str, default='http://localhost:8000/ingest/stream',
+                    help='URL of the ingestion stream endpoint (default: http://localhost:8000/ingest/stream)')
+parser.add_argument('--output', type=str, default='-',
+                    help='File receiving one result per line in input order, or - for stdout (default: -)')
+parser.add_argument('--errors', type=str, default=None,
+                    help='File receiving the failed rows with their input; by default they stay in the output')
+parser.add_argument('--chunk-size', type=int, default=500,
+                    help='Rows per request (default: 500)')
+parser.add_argument('--concurrency', type=int, default=2,
+                    help='Chunks in flight at once (default: 2)')
+parser.add_argument('--progress-interval', type=float, default=5.0,
+                    help='Seconds between progress reports (default: 5.0)')
+args = parser.parse_args()
+
+def read_chunks(f):
+    """
+    Yields (line_numbers, lines) for each chunk of non-blank input lines
+    """
+    numbered = ((number, line.strip()) for number, line in enumerate(f, start=1) if line.strip())
+    while True:
+        chunk = list(islice(numbered, args.chunk_size))
+        if not chunk:
+            return
+        yield [number for number, _ in chunk], [line for _, line in chunk]
+
+def score_chunk(session, lines):
+    """
+    Sends one chunk to the stream endpoint and returns its result objects
+
+    Each chunk is a single request, so the body is fully sent before the
+    streamed response is read and only ``chunk_size`` rows are held per chunk.
+    """
+    try:
+        response = session.post(args.stream_url, data="\n".join(lines).encode(),
+                                params={"chunk_size": args.chunk_size},
+                                headers={"Content-Type": "application/x-ndjson"}, stream=True)
+        if response.status_code != 200:
+            error = f"Request failed with status code {response.status_code}: {response.text}"
+            return [{"line": i + 1, "error": error} for i in range(len(lines))]
+        return [json.loads(line) for line in response.iter_lines() if line]
+    except Exception as e:
+        return [{"line": i + 1, "error": f"Error sending request: {str(e)}"} for i in range(len(lines))]
+
+def main():
+    input_file = sys.stdin if args.input == '-' else open(args.input)
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+    errors_file = open(args.errors, 'w') if args.errors else None
+
+    logger.info(f"Scoring {args.input} through {args.stream_url} in chunks of {args.chunk_size} rows")
+    start_time = last_report = time.perf_counter()
+    rows = failed = 0
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        # Chunks are submitted ahead up to the concurrency limit and written in input order
+        in_flight = deque()
+        chunks = read_chunks(input_file)
+        while True:
+            for line_numbers, lines in islice(chunks, args.concurrency - len(in_flight)):
+                in_flight.append((line_numbers, lines, executor.submit(score_chunk, session, lines)))
+            if not in_flight:
+                break
+
+            line_numbers, lines, future = in_flight.popleft()
+            for result in future.result():
+                # Line numbers from the server count the rows of the chunk
+                index = result["line"] - 1
+                result["line"] = line_numbers[index]
+                if "error" in result:
+                    failed += 1
+                    if errors_file:
+                        result["input"] = lines[index]
+                        errors_file.write(json.dumps(result) + "\n")
+                        continue
+                output_file.write(json.dumps(result) + "\n")
+            rows += len(lines)
+
+            now = time.perf_counter()
+            if now - last_report >= args.progress_interval:
+                logger.info(f"{rows} rows scored, {failed} failed ({rows / (now - start_time):.0f} rows/s)")
+                last_report = now
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Completed: {rows} rows scored, {failed} failed in {elapsed:.2f}s "
+                f"({rows / elapsed if elapsed > 0 else 0:.0f} rows/s)")
+
+    for f in (input_file, output_file, errors_file):
+        if f not in (None, sys.stdin, sys.stdout):
+            f.close()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -4,36 +4,68 @@ import random
 import time
 import logging
 import argparse
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, 
+logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Parse command line arguments
-parser = argparse.ArgumentParser(description='Client for ML Inference Microservices')
+parser = argparse.ArgumentParser(description='Client and load generator for ML Inference Microservices')
 parser.add_argument('--ingest-url', type=str, default='http://localhost:8000/ingest',
                     help='URL for the data ingestion service (default: http://localhost:8000/ingest)')
 parser.add_argument('--num-requests', type=int, default=5,
-                    help='Number of requests to send (default: 5)')
+                    help='Number of requests to send in demo mode (default: 5)')
 parser.add_argument('--delay', type=float, default=1.0,
-                    help='Delay between requests in seconds (default: 1.0)')
+                    help='Delay between requests in demo mode in seconds (default: 1.0)')
+parser.add_argument('--mode', type=str, choices=['demo', 'closed', 'open'], default='demo',
+                    help='demo sends --num-requests serially and logs every response, closed keeps '
+                         '--concurrency requests in flight, open sends at --rate requests/s (default: demo)')
+parser.add_argument('--concurrency', type=int, default=8,
+                    help='Concurrent workers in closed-loop mode (default: 8)')
+parser.add_argument('--rate', type=float, default=100.0,
+                    help='Target requests per second in open-loop mode (default: 100)')
+parser.add_argument('--max-in-flight', type=int, default=256,
+                    help='Upper bound on outstanding requests in open-loop mode (default: 256)')
+parser.add_argument('--duration', type=float, default=30.0,
+                    help='Seconds to measure in closed/open mode (default: 30)')
+parser.add_argument('--warmup', type=float, default=5.0,
+                    help='Seconds of load sent before measuring, excluded from the results (default: 5)')
+parser.add_argument('--payload', type=str, choices=['random', 'constant', 'replay'], default='random',
+                    help='random draws new features per request, constant repeats one payload, '
+                         'replay cycles through --replay-file (default: random)')
+parser.add_argument('--num-features', type=int, default=4,
+                    help='Features per generated row (default: 4)')
+parser.add_argument('--replay-file', type=str, default=None,
+                    help='jsonl file of {"features": [...], "metadata": {...}} records for --payload replay')
+parser.add_argument('--timeout', type=float, default=30.0,
+                    help='Per-request timeout in seconds (default: 30)')
+parser.add_argument('--output-json', type=str, default=None,
+                    help='Write the run summary to this JSON file')
+parser.add_argument('--output-csv', type=str, default=None,
+                    help='Append the run summary as a row to this CSV file, for comparing runs')
+parser.add_argument('--label', type=str, default=None,
+                    help='Name of the run in the exported summary (default: mode and load)')
 args = parser.parse_args()
 
 def generate_sample_data():
     """
     Generate random sample data for inference
     """
-    # Generate 4 random features
-    features = [random.uniform(0, 1) for _ in range(4)]
-    
+    # Generate random features
+    features = [random.uniform(0, 1) for _ in range(args.num_features)]
+
     # Add some metadata
     metadata = {
         "source": "client_demo",
         "client_timestamp": time.time(),
         "client_id": f"demo-client-{random.randint(1000, 9999)}"
     }
-    
+
     return {
         "features": features,
         "metadata": metadata
@@ -46,7 +78,7 @@ def send_inference_request(data, url=args.ingest_url):
     try:
         logger.info(f"Sending request to {url}")
         response = requests.post(url, json=data)
-        
+
         if response.status_code == 200:
             logger.info("Request successful")
             return response.json()
@@ -57,26 +89,201 @@ def send_inference_request(data, url=args.ingest_url):
         logger.error(f"Error sending request: {str(e)}")
         return None
 
+def make_payload_generator():
+    """
+    Returns a thread-safe function producing the next request payload
+    """
+    if args.payload == 'constant':
+        payload = generate_sample_data()
+        return lambda: payload
+
+    if args.payload == 'replay':
+        if not args.replay_file:
+            parser.error("--payload replay requires --replay-file")
+        with open(args.replay_file) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        if not records:
+            parser.error(f"No records in {args.replay_file}")
+        logger.info(f"Replaying {len(records)} records from {args.replay_file}")
+        lock = threading.Lock()
+        position = [0]
+
+        def next_record():
+            with lock:
+                record = records[position[0] % len(records)]
+                position[0] += 1
+            return record
+        return next_record
+
+    return generate_sample_data
+
+_local = threading.local()
+
+def timed_request(payload, scheduled_at=None):
+    """
+    Sends one request on a per-thread session
+
+    Latency is measured from ``scheduled_at`` when given, so that time spent
+    queued behind a saturated service counts in open-loop mode.
+
+    Returns:
+        tuple: (start time, latency in seconds, HTTP status or error name)
+    """
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    start = scheduled_at if scheduled_at is not None else time.perf_counter()
+    try:
+        status = _local.session.post(args.ingest_url, json=payload, timeout=args.timeout).status_code
+    except requests.RequestException as e:
+        status = type(e).__name__
+    return start, time.perf_counter() - start, status
+
+def run_closed_loop(next_payload, end_time):
+    """
+    Each of --concurrency workers sends its next request as soon as the previous one completes
+    """
+    def worker():
+        samples = []
+        while time.perf_counter() < end_time:
+            samples.append(timed_request(next_payload()))
+        return samples
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(worker) for _ in range(args.concurrency)]
+        return [sample for future in futures for sample in future.result()]
+
+def run_open_loop(next_payload, end_time):
+    """
+    Sends requests on a fixed --rate schedule, independently of how fast responses come back
+    """
+    interval = 1.0 / args.rate
+    futures = []
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as executor:
+        scheduled_at = time.perf_counter()
+        while scheduled_at < end_time:
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(executor.submit(timed_request, next_payload(), scheduled_at))
+            scheduled_at += interval
+        return [future.result() for future in futures]
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize(samples, measure_start, duration):
+    """
+    Aggregates the samples started during the measurement window
+
+    Throughput counts the requests that completed during the window. In
+    open-loop mode requests start on schedule whatever the service does, so
+    counting started requests would always report the target rate.
+    """
+    measured = [(latency, status) for start, latency, status in samples if start >= measure_start]
+    completed = sum(1 for start, latency, _ in samples if measure_start <= start + latency < measure_start + duration)
+    latencies = sorted(latency * 1000 for latency, _ in measured)
+    errors = sum(1 for _, status in measured if status != 200)
+    statuses = {}
+    for _, status in measured:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    load = f"c={args.concurrency}" if args.mode == 'closed' else f"rate={args.rate:g}"
+    summary = {
+        "label": args.label or f"{args.mode} {load}",
+        "mode": args.mode,
+        "concurrency": args.concurrency if args.mode == 'closed' else None,
+        "target_rate": args.rate if args.mode == 'open' else None,
+        "payload": args.payload,
+        "url": args.ingest_url,
+        "duration_s": duration,
+        "requests": len(measured),
+        "completed": completed,
+        "errors": errors,
+        "error_rate": errors / len(measured) if measured else 0.0,
+        "throughput_rps": completed / duration,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "p999_ms": percentile(latencies, 99.9),
+        "max_ms": latencies[-1] if latencies else None,
+        "status_codes": statuses
+    }
+    return summary
+
+def export_summary(summary):
+    if args.output_json:
+        with open(args.output_json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"Summary written to {args.output_json}")
+
+    if args.output_csv:
+        row = {key: value for key, value in summary.items() if key != "status_codes"}
+        row["status_codes"] = json.dumps(summary["status_codes"])
+        write_header = not os.path.exists(args.output_csv) or os.path.getsize(args.output_csv) == 0
+        with open(args.output_csv, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
+        logger.info(f"Summary appended to {args.output_csv}")
+
+def run_load():
+    next_payload = make_payload_generator()
+    load = f"{args.concurrency} workers" if args.mode == 'closed' else f"{args.rate:g} req/s"
+    logger.info(f"Starting {args.mode}-loop load against {args.ingest_url}: {load}, "
+                f"{args.warmup:g}s warmup + {args.duration:g}s measurement")
+
+    start_time = time.perf_counter()
+    measure_start = start_time + args.warmup
+    end_time = measure_start + args.duration
+    if args.mode == 'closed':
+        samples = run_closed_loop(next_payload, end_time)
+    else:
+        samples = run_open_loop(next_payload, end_time)
+
+    summary = summarize(samples, measure_start, args.duration)
+    def fmt(value):
+        return f"{value:.1f}" if value is not None else "-"
+    logger.info(f"{summary['label']}: {summary['requests']} requests, {summary['completed']} completed in the window, "
+                f"throughput={summary['throughput_rps']:.1f} req/s, "
+                f"errors={summary['errors']} ({summary['error_rate']:.2%})")
+    logger.info(f"latency ms: p50={fmt(summary['p50_ms'])} p90={fmt(summary['p90_ms'])} "
+                f"p99={fmt(summary['p99_ms'])} p999={fmt(summary['p999_ms'])} max={fmt(summary['max_ms'])}")
+    if args.mode == 'open' and summary['throughput_rps'] < 0.95 * args.rate:
+        logger.warning("Achieved throughput is below the target rate, the service or client is saturated")
+    export_summary(summary)
+    return summary
+
 def main():
+    if args.mode != 'demo':
+        run_load()
+        return
+
     logger.info(f"Starting client demo, sending {args.num_requests} requests to {args.ingest_url}")
-    
+    next_payload = make_payload_generator()
+
     for i in range(args.num_requests):
         logger.info(f"Request {i+1}/{args.num_requests}")
-        
+
         # Generate sample data
-        data = generate_sample_data()
+        data = next_payload()
         logger.info(f"Generated sample data: {json.dumps(data, indent=2)}")
-        
+
         # Send request
         result = send_inference_request(data)
-        
+
         if result:
             logger.info(f"Received result: {json.dumps(result, indent=2)}")
-        
+
         # Wait before sending the next request
         if i < args.num_requests - 1:
             time.sleep(args.delay)
-    
+
     logger.info("Client demo completed")
 
 if __name__ == "__main__":
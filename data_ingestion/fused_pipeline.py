@@ -0,0 +1,97 @@
+"""
+In-process pipeline used when the ingestion service runs in fused mode
+
+The preprocessing, inference and postprocessing stages are imported from
+their service directories and called as plain functions, so a prediction
+needs no HTTP hop, JSON round trip or re-validation between stages.
+"""
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGE_DIRS = [os.path.join(ROOT_DIR, stage) for stage in ("preprocessing", "inference", "postprocessing")]
+
+for stage_dir in STAGE_DIRS:
+    if stage_dir not in sys.path:
+        sys.path.append(stage_dir)
+
+# The inference service resolves model.pkl relative to its own directory
+os.environ.setdefault("MODEL_PATH", os.path.join(ROOT_DIR, "inference", "model.pkl"))
+
+import preprocessor
+import predictor
+import postprocessor
+import audit_log as audit
+from shared.tracing import span
+
+logger.info("Loaded preprocessing, inference and postprocessing stages in-process")
+
+
+# Prediction audit log of the postprocessing stage, started with the service (None when disabled)
+audit_log = None
+
+
+async def start_audit_log(registry):
+    global audit_log
+    audit_log = audit.AuditLog.from_env("data_ingestion", registry)
+    if audit_log is not None:
+        await audit_log.start()
+
+
+async def stop_audit_log():
+    if audit_log is not None:
+        await audit_log.stop()
+
+
+async def reserve_audit(rows):
+    """Waits for room in the audit log for ``rows`` predictions, see AuditLog.reserve"""
+    if audit_log is not None:
+        await audit_log.reserve(rows)
+
+
+def model_loaded():
+    return predictor.model_loaded()
+
+
+def initialize(phase):
+    """Loads and warms up the model of the inference stage, timing the phases with ``phase``"""
+    loaded = predictor.initialize(phase)
+    with phase("warm_up"):
+        preprocessor.warm_up()
+        postprocessor.warm_up()
+    return loaded
+
+
+def run(data):
+    """
+    Runs a single row through all stages and returns the postprocessed result
+
+    Each stage is recorded as a child span of the request's span.
+    """
+    with span("preprocess"):
+        preprocessed_data = preprocessor.preprocess(data)
+    with span("predict"):
+        prediction = predictor.predict(preprocessed_data)
+    with span("postprocess"):
+        result = postprocessor.postprocess(prediction).dict()
+    if audit_log is not None:
+        audit_log.record([audit.prediction_record(result, prediction.features)])
+    return result
+
+
+def run_batch(data):
+    """
+    Runs an N x F batch through all stages and returns the postprocessed batch
+    """
+    with span("preprocess", rows=len(data.features)):
+        preprocessed_batch = preprocessor.preprocess_batch(data)
+    with span("predict"):
+        prediction_batch = predictor.predict_batch(preprocessed_batch)
+    with span("postprocess"):
+        result = postprocessor.postprocess_batch(prediction_batch)
+    if audit_log is not None:
+        audit_log.record(audit.batch_records(result, prediction_batch.features))
+    return result
@@ -0,0 +1,412 @@
+"""
+Asynchronous scoring jobs for datasets too large for a single request
+
+A job is an NDJSON file of FeatureData records, either given by local path
+or written to JOBS_INPUT_DIR from an inline submission. Workers score jobs
+one chunk at a time through the pipeline and keep job state and results in
+an SQLite database, committing each chunk's results together with the
+position reached in the input. A restarted service carries on from the
+last committed chunk.
+
+Jobs share the workers round-robin, one chunk per turn, so a huge job
+cannot hold back the jobs submitted after it. At most JOBS_WORKERS chunks
+are scored at once, and workers hold back while interactive requests are
+being handled, for a bounded time so jobs still progress under steady
+interactive traffic.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(SERVICE_DIR, "jobs.db"))
+# Where the datasets of inline submissions are written
+JOBS_INPUT_DIR = os.getenv("JOBS_INPUT_DIR", os.path.join(SERVICE_DIR, "job_inputs"))
+# Directories local dataset paths may point into
+JOBS_ALLOWED_DIRS = os.getenv("JOBS_ALLOWED_DIRS", os.path.dirname(SERVICE_DIR))
+# Chunks scored at once across all jobs
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_CHUNK_SIZE = int(os.getenv("JOBS_CHUNK_SIZE", "200"))
+# A chunk the pipeline cannot take right now is retried after JOBS_RETRY_DELAY
+# seconds, at most JOBS_MAX_RETRIES times before its rows are marked as failed
+JOBS_MAX_RETRIES = int(os.getenv("JOBS_MAX_RETRIES", "5"))
+JOBS_RETRY_DELAY = float(os.getenv("JOBS_RETRY_DELAY", "1.0"))
+# Interactive requests in flight from which workers hold back before each chunk,
+# checking again every JOBS_YIELD_DELAY seconds for at most JOBS_MAX_YIELD seconds (0 never holds back)
+JOBS_YIELD_IN_FLIGHT = int(os.getenv("JOBS_YIELD_IN_FLIGHT", "1"))
+JOBS_YIELD_DELAY = float(os.getenv("JOBS_YIELD_DELAY", "0.01"))
+JOBS_MAX_YIELD = float(os.getenv("JOBS_MAX_YIELD", "1.0"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    inline INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    total_rows INTEGER NOT NULL,
+    done_rows INTEGER NOT NULL DEFAULT 0,
+    failed_rows INTEGER NOT NULL DEFAULT 0,
+    next_chunk INTEGER NOT NULL DEFAULT 0,
+    input_offset INTEGER NOT NULL DEFAULT 0,
+    lines_read INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    PRIMARY KEY (job_id, chunk)
+);
+"""
+
+_JOB_FIELDS = ("id", "status", "input_path", "inline", "chunk_size", "total_rows", "done_rows", "failed_rows",
+               "next_chunk", "input_offset", "lines_read", "error", "created_at", "started_at", "finished_at")
+
+
+class RetryChunk(Exception):
+    """Raised by the scoring function when the pipeline cannot take a chunk right now"""
+
+
+def count_records(path):
+    """Number of non-blank lines of an NDJSON file"""
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def read_chunk(path, offset, chunk_size):
+    """
+    Reads up to ``chunk_size`` non-blank lines from byte ``offset`` of a file
+
+    Returns:
+        tuple: The lines and the byte offset following the last one read
+    """
+    lines = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while len(lines) < chunk_size:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                lines.append(line)
+        return lines, f.tell()
+
+
+class JobStore:
+    """
+    SQLite store for job state and results
+
+    One connection is shared by the threads the runner calls it from,
+    serialized by a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def create(self, input_path, inline, chunk_size, total_rows):
+        job_id = uuid.uuid4().hex
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO jobs (id, status, input_path, inline, chunk_size, total_rows, created_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (job_id, QUEUED, input_path, int(inline), chunk_size, total_rows, time.time()))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(_JOB_FIELDS, row)) if row is not None else None
+
+    def list(self, limit=50, status=None):
+        query = f"SELECT {', '.join(_JOB_FIELDS)} FROM jobs"
+        params = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY created_at DESC LIMIT ?", params + (limit,)).fetchall()
+        return [dict(zip(_JOB_FIELDS, row)) for row in rows]
+
+    def unfinished(self):
+        """IDs of the queued and running jobs, oldest first"""
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                                    (QUEUED, RUNNING)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_status(self, job_id, status, error=None):
+        """Moves a job to ``status`` unless it is already finished, returning whether it did"""
+        if status == RUNNING:
+            update, params = "started_at = COALESCE(started_at, ?)", (time.time(),)
+        else:
+            update, params = "finished_at = ?, error = ?", (time.time(), error)
+        with self._lock, self._db:
+            cursor = self._db.execute(f"UPDATE jobs SET status = ?, {update} WHERE id = ? AND status NOT IN (?, ?, ?)",
+                                      (status, *params, job_id, *FINISHED))
+        return cursor.rowcount == 1
+
+    def add_chunk(self, job_id, chunk, results, input_offset, lines_read, failed):
+        """Stores one chunk's results and the input position after it, in one transaction"""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO job_results (job_id, chunk, results) VALUES (?, ?, ?)",
+                             (job_id, chunk, "".join(json.dumps(result) + "\n" for result in results)))
+            self._db.execute("UPDATE jobs SET next_chunk = ?, input_offset = ?, lines_read = ?, "
+                             "done_rows = done_rows + ?, failed_rows = failed_rows + ? WHERE id = ?",
+                             (chunk + 1, input_offset, lines_read, len(results), failed, job_id))
+
+    def results(self, job_id, from_chunk=0, limit=100):
+        """(chunk, NDJSON results) of up to ``limit`` stored chunks, from ``from_chunk`` on"""
+        with self._lock:
+            return self._db.execute("SELECT chunk, results FROM job_results WHERE job_id = ? AND chunk >= ? "
+                                    "ORDER BY chunk LIMIT ?", (job_id, from_chunk, limit)).fetchall()
+
+    def delete(self, job_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+def job_view(job):
+    """The fields of a job returned by the API"""
+    total = job["total_rows"]
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "total_rows": total,
+        "done_rows": job["done_rows"],
+        "failed_rows": job["failed_rows"],
+        "progress": job["done_rows"] / total if total else 1.0,
+        "chunks_done": job["next_chunk"],
+        "chunk_size": job["chunk_size"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+
+class JobRunner:
+    """
+    Worker pool scoring the chunks of the unfinished jobs
+
+    Runnable jobs wait in a round-robin queue. A worker takes the job at
+    its head, scores that job's next chunk and puts the job back at the
+    tail, so each job has at most one chunk in flight and concurrent jobs
+    progress at the same rate in chunks.
+
+    Args:
+        store (JobStore): Where jobs are kept
+        score (callable): Coroutine function scoring ``(line_numbers, lines)``
+            and returning one result object per line, raising RetryChunk when
+            the chunk should be tried again later
+        workers (int): Chunks scored at once
+        busy (callable): Returns True while interactive requests are being
+            handled, which makes the workers hold back
+    """
+
+    def __init__(self, store, score, workers=JOBS_WORKERS, busy=None):
+        self.store = store
+        self.score = score
+        self.workers = workers
+        self.busy = busy
+        self.chunks_scored = 0
+        self.chunks_retried = 0
+        self.yields = 0
+        self._runnable = deque()
+        self._wakeup = None
+        self._tasks = []
+        self._progress = {}
+
+    async def start(self):
+        """Resumes the jobs left unfinished by a previous run and starts the workers"""
+        self._wakeup = asyncio.Event()
+        for job_id in await asyncio.to_thread(self.store.unfinished):
+            self._runnable.append(job_id)
+        if self._runnable:
+            logger.info(f"Resuming {len(self._runnable)} unfinished jobs")
+            self._wakeup.set()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info(f"Job workers started (workers={self.workers}, store={self.store.path})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+
+    def submit(self, job_id):
+        self._runnable.append(job_id)
+        self._wakeup.set()
+        self._notify(job_id)
+
+    async def _finish(self, job, status, error=None):
+        if await asyncio.to_thread(self.store.set_status, job["id"], status, error) and job["inline"]:
+            # Inline datasets are only kept until their job is over
+            await asyncio.to_thread(_remove, job["input_path"])
+
+    async def cancel(self, job):
+        """Cancels a queued or running job; the results of a chunk in flight are discarded"""
+        if job["status"] in FINISHED:
+            return False
+        await self._finish(job, CANCELLED)
+        if job["id"] in self._runnable:
+            self._runnable.remove(job["id"])
+        self._notify(job["id"])
+        return True
+
+    def _notify(self, job_id):
+        event = self._progress.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_progress(self, job_id, timeout):
+        """Waits until the job stores a chunk or changes status, or ``timeout`` passes"""
+        event = self._progress.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _next_job(self):
+        while not self._runnable:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self._runnable.popleft()
+
+    async def _work(self):
+        while True:
+            job_id = await self._next_job()
+            try:
+                requeue = await self._run_chunk(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                job = await asyncio.to_thread(self.store.get, job_id)
+                if job is not None:
+                    await self._finish(job, FAILED, str(e))
+                requeue = False
+            if requeue:
+                self._runnable.append(job_id)
+                self._wakeup.set()
+            self._notify(job_id)
+
+    async def _run_chunk(self, job_id):
+        """Scores the next chunk of a job, returning whether it has more to do"""
+        if self.busy is not None and self.busy():
+            # Let interactive requests go first, but not forever
+            self.yields += 1
+            give_up_at = time.monotonic() + JOBS_MAX_YIELD
+            while self.busy() and time.monotonic() < give_up_at:
+                await asyncio.sleep(JOBS_YIELD_DELAY)
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None or job["status"] in FINISHED:
+            return False
+        if job["status"] == QUEUED:
+            await asyncio.to_thread(self.store.set_status, job_id, RUNNING)
+
+        lines, offset = await asyncio.to_thread(read_chunk, job["input_path"], job["input_offset"],
+                                                job["chunk_size"])
+        if not lines:
+            await self._finish(job, SUCCEEDED)
+            logger.info(f"Job {job_id} completed: {job['done_rows']} rows, {job['failed_rows']} failed")
+            return False
+
+        first_line = job["lines_read"] + 1
+        line_numbers = list(range(first_line, first_line + len(lines)))
+        for attempt in range(JOBS_MAX_RETRIES + 1):
+            try:
+                results = await self.score(line_numbers, lines)
+                break
+            except RetryChunk as e:
+                if attempt == JOBS_MAX_RETRIES:
+                    results = [{"line": line, "error": str(e)} for line in line_numbers]
+                    break
+                self.chunks_retried += 1
+                await asyncio.sleep(JOBS_RETRY_DELAY * 2 ** attempt)
+
+        # A job cancelled while its chunk was scored keeps its last committed state
+        current = await asyncio.to_thread(self.store.get, job_id)
+        if current is None or current["status"] in FINISHED:
+            return False
+        failed = sum(1 for result in results if "error" in result)
+        await asyncio.to_thread(self.store.add_chunk, job_id, job["next_chunk"], results, offset,
+                                job["lines_read"] + len(lines), failed)
+        self.chunks_scored += 1
+        return True
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "runnable_jobs": len(self._runnable),
+            "chunks_scored": self.chunks_scored,
+            "chunks_retried": self.chunks_retried,
+            "yields_to_interactive": self.yields
+        }
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_inline_input(records):
+    """Writes the records of an inline submission to JOBS_INPUT_DIR, returning the path"""
+    os.makedirs(JOBS_INPUT_DIR, exist_ok=True)
+    path = os.path.join(JOBS_INPUT_DIR, f"{uuid.uuid4().hex}.ndjson")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def resolve_input_path(path):
+    """
+    Resolves a local dataset path, which must be a file inside JOBS_ALLOWED_DIRS
+
+    Raises:
+        PermissionError: If the path is outside of the allowed directories
+        FileNotFoundError: If there is no file at the path
+    """
+    resolved = os.path.realpath(path)
+    allowed = [os.path.realpath(directory.strip()) for directory in JOBS_ALLOWED_DIRS.split(",") if directory.strip()]
+    if not any(os.path.commonpath([resolved, directory]) == directory for directory in allowed):
+        raise PermissionError(f"{path} is outside of the directories jobs may read from")
+    if not os.path.isfile(resolved):
+        raise FileNotFoundError(f"No dataset at {path}")
+    return resolved
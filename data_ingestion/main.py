@@ -1,15 +1,32 @@
+import asyncio
+import json
 import logging
 import os
-from fastapi import FastAPI, HTTPException
+import sys
+import time
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from fastapi.responses import StreamingResponse
 import uvicorn
+import numpy as np
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 
+# Make the helpers shared between services importable when running from the service directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.http_client import ServiceClient, RequestError, circuit_breakers
+from shared import wire
+from shared.metrics import install_metrics, phase
+from shared.tracing import install_tracing
+from shared.admission import install_admission
+from shared.deadline import check_deadline, current_deadline, install_deadlines
+from shared.logging_setup import configure_logging
+from shared.startup import install_probes
+import jobs
+from jobs import JobRunner, JobStore, RetryChunk, job_view
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging("data_ingestion")
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -26,32 +43,157 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts, in-flight gauges and per-phase latency histograms on /metrics
+metrics = install_metrics(app, "data_ingestion")
+
+# Request spans sharing one trace ID across the four services, sampled at TRACE_SAMPLE_RATE
+install_tracing(app, "data_ingestion")
+
+# Bounded in-flight requests and queue; excess work is rejected early with 429/503
+admission = install_admission(app, "data_ingestion", metrics)
+
+# Deadline of every request, forwarded downstream and capping the downstream timeouts
+install_deadlines(app, "data_ingestion", metrics)
+
 # Preprocessing service URL
 PREPROCESSING_URL = os.getenv("PREPROCESSING_URL", "http://0.0.0.0:8001/preprocess")
+PREPROCESSING_BATCH_URL = os.getenv("PREPROCESSING_BATCH_URL", f"{PREPROCESSING_URL}/batch")
+
+# Pooled, non-blocking client for the preprocessing service
+preprocessing_client = ServiceClient("preprocessing")
+
+# Rows per pipeline call when scoring an NDJSON stream. Only one chunk is
+# held in memory at a time, whatever the size of the stream.
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+
+# "split" forwards to the preprocessing service over HTTP, "fused" runs every
+# stage in this process (single-node deployments only)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "split").lower()
+if PIPELINE_MODE == "fused":
+    import fused_pipeline
+
+# /livez, and /readyz once the service, and in fused mode the model, is ready
+startup = install_probes(app, "data_ingestion", metrics)
 
 # Define data models
 class FeatureData(BaseModel):
     features: List[float]
     metadata: Optional[Dict[str, Any]] = None
 
+class BatchFeatureData(BaseModel):
+    # Missing values are sent as null since NaN is not valid JSON
+    features: List[List[Optional[float]]]
+    metadata: Optional[List[Optional[Dict[str, Any]]]] = None
+
+class JobRequest(BaseModel):
+    # The dataset: FeatureData records, a batch of rows, or the path of a
+    # local NDJSON file with one FeatureData record per line
+    records: Optional[List[FeatureData]] = None
+    features: Optional[List[List[Optional[float]]]] = None
+    metadata: Optional[List[Optional[Dict[str, Any]]]] = None
+    path: Optional[str] = None
+    chunk_size: Optional[int] = None
+
+# Scores asynchronous jobs in the background, created on startup
+job_runner = None
+init_task = None
+# Requests job chunks make way for
+INTERACTIVE_PATHS = ("/ingest", "/ingest/batch", "/ingest/stream")
+
+@app.on_event("startup")
+async def start_http_client():
+    await preprocessing_client.start()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await preprocessing_client.close()
+
+@app.on_event("startup")
+async def start_job_runner():
+    global job_runner
+    job_runner = JobRunner(JobStore(jobs.JOBS_DB_PATH), score_job_chunk, busy=interactive_requests_waiting)
+    await job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    if job_runner is not None:
+        await job_runner.stop()
+
+async def initialize_fused_pipeline():
+    """Loads and warms up the in-process stages off the event loop"""
+    loop = asyncio.get_running_loop()
+    try:
+        loaded = await loop.run_in_executor(None, fused_pipeline.initialize, startup.phase)
+        if loaded is None:
+            startup.mark_failed("Model could not be loaded")
+        else:
+            startup.mark_ready()
+    except Exception as e:
+        startup.mark_failed(str(e))
+
+@app.on_event("startup")
+async def start_initialization():
+    global init_task
+    if PIPELINE_MODE == "fused":
+        with startup.phase("audit_log"):
+            await fused_pipeline.start_audit_log(metrics)
+        # /livez answers while the model loads; /readyz and the pipeline endpoints wait for it
+        init_task = asyncio.create_task(initialize_fused_pipeline())
+    else:
+        startup.mark_ready()
+
+@app.on_event("shutdown")
+async def stop_fused_audit_log():
+    if PIPELINE_MODE == "fused":
+        await fused_pipeline.stop_audit_log()
+
 @app.get("/")
 def read_root():
     return {"message": "Data Ingestion Service is running"}
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    if PIPELINE_MODE == "fused":
+        if fused_pipeline.model_loaded():
+            return {"status": "healthy", "mode": "fused", "model_loaded": True}
+        return {"status": "unhealthy", "mode": "fused", "model_loaded": False}
+    return {"status": "healthy", "circuit_breakers": circuit_breakers(preprocessing_client)}
+
+async def run_fused(pipeline_fn, data, rows=1):
+    """Runs the in-process pipeline on ``rows`` rows, mapping failures to HTTP errors"""
+    if not fused_pipeline.model_loaded():
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    check_deadline()
+    await fused_pipeline.reserve_audit(rows)
+    try:
+        with phase("compute"):
+            return pipeline_fn(data)
+    except Exception as e:
+        logger.error(f"Error in fused pipeline: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Pipeline error: {str(e)}")
 
 @app.post("/ingest")
 async def ingest_data(data: FeatureData):
     """
     Ingests data and forwards it to the preprocessing service
     """
-    logger.info(f"Received data for ingestion: {data}")
+    logger.info("Received data for ingestion: %s", data)
+
+    # Callers that cannot set headers may pass their deadline in the metadata
+    deadline = current_deadline()
+    if deadline is not None and data.metadata and isinstance(data.metadata.get("deadline_ms"), (int, float)):
+        deadline.tighten(data.metadata["deadline_ms"])
+    
+    if PIPELINE_MODE == "fused":
+        return {
+            "status": "success",
+            "message": "Data ingested and preprocessed successfully",
+            "data": await run_fused(fused_pipeline.run, data)
+        }
     
     try:
         # Forward the data to the preprocessing service
-        response = requests.post(PREPROCESSING_URL, json=data.dict())
+        response = await preprocessing_client.post(PREPROCESSING_URL, json=data.dict())
         
         if response.status_code != 200:
             logger.error(f"Preprocessing service error: {response.text}")
@@ -59,7 +201,7 @@ async def ingest_data(data: FeatureData):
                                detail=f"Preprocessing service error: {response.text}")
         
         preprocessed_data = response.json()
-        logger.info(f"Data successfully ingested and preprocessed")
+        logger.info("Data successfully ingested and preprocessed")
         
         return {
             "status": "success",
@@ -67,7 +209,9 @@ async def ingest_data(data: FeatureData):
             "data": preprocessed_data
         }
         
-    except requests.RequestException as e:
+    except HTTPException:
+        raise
+    except RequestError as e:
         logger.error(f"Error connecting to preprocessing service: {str(e)}")
         raise HTTPException(status_code=503, 
                            detail=f"Error connecting to preprocessing service: {str(e)}")
@@ -75,6 +219,308 @@ async def ingest_data(data: FeatureData):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.post("/ingest/batch")
+async def ingest_batch(data: BatchFeatureData):
+    """
+    Ingests an N x F batch of rows and forwards it to the preprocessing service
+    """
+    num_rows = len(data.features)
+    logger.info("Received batch of %d rows for ingestion", num_rows)
+
+    if data.metadata is not None and len(data.metadata) != num_rows:
+        raise HTTPException(status_code=422,
+                            detail=f"Expected {num_rows} metadata entries, got {len(data.metadata)}")
+
+    if PIPELINE_MODE == "fused":
+        return {
+            "status": "success",
+            "message": f"Batch of {num_rows} rows ingested and preprocessed successfully",
+            "data": await run_fused(fused_pipeline.run_batch, data, num_rows)
+        }
+
+    try:
+        preprocessed_data = await score_batch(data)
+        logger.info("Batch successfully ingested and preprocessed")
+
+        return {
+            "status": "success",
+            "message": f"Batch of {num_rows} rows ingested and preprocessed successfully",
+            "data": preprocessed_data
+        }
+
+    except HTTPException:
+        raise
+    except RequestError as e:
+        logger.error(f"Error connecting to preprocessing service: {str(e)}")
+        raise HTTPException(status_code=503,
+                           detail=f"Error connecting to preprocessing service: {str(e)}")
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+async def score_batch(data):
+    """
+    Sends a batch through the rest of the pipeline and returns the postprocessed batch
+
+    Raises:
+        HTTPException: If the preprocessing service answers with an error
+        RequestError: If the preprocessing service cannot be reached
+    """
+    payload = data.dict()
+    binary = wire.binary_enabled() and len({len(row) for row in data.features}) == 1
+    if binary:
+        # Rectangular batches travel as a single float64 buffer, null becoming NaN.
+        # Ragged batches stay JSON so preprocessing can report the bad rows.
+        payload["features"] = np.array(data.features, dtype=float)
+
+    # Forward the batch to the preprocessing service
+    response = await preprocessing_client.post(PREPROCESSING_BATCH_URL,
+                                               **wire.request_kwargs(payload, binary))
+
+    if response.status_code != 200:
+        logger.error(f"Preprocessing service error: {response.text}")
+        raise HTTPException(status_code=response.status_code,
+                           detail=f"Preprocessing service error: {response.text}")
+
+    return wire.to_json_compatible(wire.read_response(response))
+
+async def read_ndjson_lines(request):
+    """Yields the lines of an NDJSON request body as they arrive, skipping blank lines"""
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+def parse_record(line):
+    """A FeatureData from one NDJSON line, or the error message if it is not valid"""
+    try:
+        return FeatureData(**json.loads(line))
+    except (ValueError, TypeError) as e:
+        # json.JSONDecodeError and pydantic's ValidationError are both ValueErrors
+        return f"Invalid record: {str(e)}"
+
+async def score_records(line_numbers, records, retry_unavailable=False):
+    """
+    Scores one chunk of records, returning one ``{"line", "result"}`` or
+    ``{"line", "error"}`` object per record
+
+    ``records`` holds a FeatureData for each valid line, or the error message
+    for lines that could not be parsed. A failing chunk marks all its rows as
+    failed, unless ``retry_unavailable`` is set and the pipeline is only
+    unavailable for now (unreachable, shedding load, or a later stage
+    unreachable so the batch comes back unpostprocessed), in which case
+    RetryChunk is raised.
+    """
+    valid = [i for i, record in enumerate(records) if isinstance(record, FeatureData)]
+    results = [{"line": line_numbers[i], "error": records[i]} for i in range(len(records))]
+    if valid:
+        batch = BatchFeatureData(features=[records[i].features for i in valid],
+                                 metadata=[records[i].metadata for i in valid])
+        try:
+            if PIPELINE_MODE == "fused":
+                scored = await run_fused(fused_pipeline.run_batch, batch, len(valid))
+            else:
+                scored = await score_batch(batch)
+            if "results" not in scored:
+                # A downstream hop was unreachable and its caller passed back
+                # the batch as far as it got, without postprocessed results
+                if retry_unavailable:
+                    raise RetryChunk("Incomplete pipeline: the batch was not postprocessed")
+                for i in valid:
+                    results[i] = {"line": line_numbers[i],
+                                  "error": "Incomplete pipeline: the batch was not postprocessed"}
+                return results
+            for j, i in enumerate(valid):
+                result = scored["results"][j]
+                if "error" in result:
+                    results[i] = {"line": line_numbers[i], "error": result["error"]}
+                else:
+                    results[i] = {"line": line_numbers[i], "result": result}
+        except HTTPException as e:
+            if retry_unavailable and e.status_code in (429, 503):
+                raise RetryChunk(str(e.detail))
+            for i in valid:
+                results[i] = {"line": line_numbers[i], "error": str(e.detail)}
+        except RequestError as e:
+            logger.error(f"Error connecting to preprocessing service: {str(e)}")
+            if retry_unavailable:
+                raise RetryChunk(f"Error connecting to preprocessing service: {str(e)}")
+            for i in valid:
+                results[i] = {"line": line_numbers[i],
+                              "error": f"Error connecting to preprocessing service: {str(e)}"}
+    return results
+
+async def score_chunk(line_numbers, records):
+    """Scores one chunk of a stream, returning one NDJSON result line per record"""
+    return "".join(json.dumps(result) + "\n" for result in await score_records(line_numbers, records))
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for generators that are still reading the request body
+
+    The stock response listens for client disconnects by calling ``receive``,
+    which would consume the body chunks the generator is waiting for. Reading
+    the body already fails when the client goes away, so the listener is skipped.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/ingest/stream")
+async def ingest_stream(request: Request, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Scores an NDJSON body of FeatureData records, one record per line
+
+    Records are sent through the pipeline in chunks of ``chunk_size`` rows
+    and results are streamed back as NDJSON in input order while the body is
+    still being read, one ``{"line", "result"}`` or ``{"line", "error"}``
+    object per record. Line numbers count the non-blank lines from 1.
+    """
+    if chunk_size < 1:
+        raise HTTPException(status_code=422, detail="chunk_size must be at least 1")
+
+    async def generate():
+        start_time = time.perf_counter()
+        line_number = 0
+        line_numbers, records = [], []
+        async for line in read_ndjson_lines(request):
+            line_number += 1
+            line_numbers.append(line_number)
+            records.append(parse_record(line))
+
+            if len(records) == chunk_size:
+                yield await score_chunk(line_numbers, records)
+                line_numbers, records = [], []
+                elapsed = time.perf_counter() - start_time
+                logger.info("Streamed %d rows (%.0f rows/s)", line_number, line_number / elapsed)
+
+        if records:
+            yield await score_chunk(line_numbers, records)
+        elapsed = time.perf_counter() - start_time
+        logger.info(f"Stream completed: {line_number} rows in {elapsed:.2f}s")
+
+    return RequestStreamingResponse(generate(), media_type="application/x-ndjson")
+
+def interactive_requests_waiting():
+    """Whether interactive requests are being handled or queued, in which case job chunks wait"""
+    if admission is not None and admission.queued > 0:
+        return True
+    if metrics is None:
+        # Without metrics there is no in-flight count; admission's queue is the only signal
+        return False
+    in_flight = sum(metrics.in_flight.value("data_ingestion", path) for path in INTERACTIVE_PATHS)
+    return 0 < jobs.JOBS_YIELD_IN_FLIGHT <= in_flight
+
+async def score_job_chunk(line_numbers, lines):
+    """Scores one chunk of a job, asking for a retry while the pipeline is unavailable"""
+    return await score_records(line_numbers, [parse_record(line) for line in lines], retry_unavailable=True)
+
+def get_job_or_404(job_id):
+    job = job_runner.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def submit_job(job: JobRequest):
+    """
+    Submits a dataset for scoring in the background and returns the job right away
+
+    The dataset is given inline as ``records`` or as ``features`` (with
+    optional ``metadata``), or as the ``path`` of a local NDJSON file.
+    Progress is available from ``/jobs/{job_id}`` and results, as they are
+    scored, from ``/jobs/{job_id}/results``.
+    """
+    sources = [source for source in (job.records, job.features, job.path) if source is not None]
+    if len(sources) != 1:
+        raise HTTPException(status_code=422, detail="Give exactly one of records, features or path")
+    chunk_size = job.chunk_size or jobs.JOBS_CHUNK_SIZE
+    if chunk_size < 1:
+        raise HTTPException(status_code=422, detail="chunk_size must be at least 1")
+
+    if job.path is not None:
+        try:
+            path = jobs.resolve_input_path(job.path)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        total_rows = await asyncio.to_thread(jobs.count_records, path)
+        inline = False
+    else:
+        if job.records is not None:
+            records = [record.dict() for record in job.records]
+        else:
+            if job.metadata is not None and len(job.metadata) != len(job.features):
+                raise HTTPException(status_code=422,
+                                    detail=f"Expected {len(job.features)} metadata entries, got {len(job.metadata)}")
+            metadata = job.metadata or [None] * len(job.features)
+            records = [{"features": row, "metadata": meta} for row, meta in zip(job.features, metadata)]
+        path = await asyncio.to_thread(jobs.write_inline_input, records)
+        total_rows = len(records)
+        inline = True
+
+    created = await asyncio.to_thread(job_runner.store.create, path, inline, chunk_size, total_rows)
+    job_runner.submit(created["id"])
+    logger.info(f"Job {created['id']} submitted: {total_rows} rows in chunks of {chunk_size}")
+    return job_view(created)
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 50, status: Optional[str] = None):
+    """The most recent jobs, newest first, and the state of the job workers"""
+    recent = await asyncio.to_thread(job_runner.store.list, limit, status)
+    return {"jobs": [job_view(job) for job in recent], "workers": job_runner.stats()}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and progress of a job"""
+    return job_view(await asyncio.to_thread(get_job_or_404, job_id))
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str, follow: bool = False):
+    """
+    Results of a job as NDJSON, one ``{"line", "result"}`` or ``{"line", "error"}`` object per row in input order
+
+    Without ``follow`` only the rows scored so far are returned. With it
+    the response stays open and streams the remaining rows as they are
+    scored, ending when the job is finished.
+    """
+    await asyncio.to_thread(get_job_or_404, job_id)
+
+    async def generate():
+        next_chunk = 0
+        while True:
+            # Read the status first so no chunk stored before the job finished is missed
+            job = await asyncio.to_thread(job_runner.store.get, job_id)
+            chunks = await asyncio.to_thread(job_runner.store.results, job_id, next_chunk)
+            for chunk, results in chunks:
+                yield results
+                next_chunk = chunk + 1
+            if chunks:
+                continue
+            if not follow or job is None or job["status"] in jobs.FINISHED:
+                return
+            await job_runner.wait_for_progress(job_id, timeout=15)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancels a queued or running job, or deletes a finished job and its results"""
+    job = await asyncio.to_thread(get_job_or_404, job_id)
+    if await job_runner.cancel(job):
+        logger.info(f"Job {job_id} cancelled")
+        return job_view(await asyncio.to_thread(get_job_or_404, job_id))
+    await asyncio.to_thread(job_runner.store.delete, job_id)
+    return {"job_id": job_id, "deleted": True}
+
 if __name__ == "__main__":
     # Run the application
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
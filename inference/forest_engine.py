@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Estimators whose fitted trees can be flattened into a ForestEngine
+SUPPORTED_ESTIMATORS = ("DecisionTreeRegressor", "ExtraTreeRegressor",
+                        "RandomForestRegressor", "ExtraTreesRegressor")
+
+
+class ForestEngine:
+    """
+    Vectorized NumPy traversal of a fitted tree ensemble
+
+    Every node of every tree is stored in flat arrays (feature index,
+    threshold, left/right child and leaf value). Scoring walks all rows
+    through all trees at once, one tree level per step, so a single row
+    and a large batch go through the same handful of array operations
+    instead of sklearn's per-call validation and per-estimator dispatch.
+
+    Leaves point to themselves, which lets every row take the same number
+    of steps regardless of the depth at which it reaches its leaf.
+    Thresholds and leaf values are stored as float32 to halve memory.
+    Thresholds are rounded down so that comparing float32 inputs gives
+    exactly the same split decisions as sklearn.
+    """
+
+    # Rows scored per traversal, keeping each level's working set in cache
+    chunk_size = 2048
+
+    # Arrays written by save() and memory-mapped by attach()
+    array_names = ("feature", "threshold", "children", "value", "roots")
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        # Interleaved (right, left) children so one lookup picks the next node
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features = n_features
+
+    @classmethod
+    def from_sklearn(cls, model, dtype=np.float32):
+        """
+        Flattens a fitted single-output tree regressor or forest of regressors
+
+        Raises:
+            TypeError: If the estimator is not supported
+        """
+        name = type(model).__name__
+        if name not in SUPPORTED_ESTIMATORS:
+            raise TypeError(f"Unsupported estimator {name}")
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise TypeError(f"Only single-output models are supported, got {model.n_outputs_} outputs")
+
+        estimators = getattr(model, "estimators_", [model])
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left < 0
+
+            threshold = tree.threshold.astype(dtype)
+            # Round down so that float32(x) <= threshold matches sklearn's float64 comparison
+            rounded_up = threshold.astype(np.float64) > tree.threshold
+            threshold[rounded_up] = np.nextafter(threshold[rounded_up], dtype(-np.inf))
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, dtype(np.inf), threshold).astype(dtype))
+            lefts.append(np.where(is_leaf, nodes, tree.children_left).astype(np.int32) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right).astype(np.int32) + offset)
+            values.append(tree.value[:, 0, 0].astype(dtype))
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            children=np.stack([np.concatenate(rights), np.concatenate(lefts)], axis=1).ravel(),
+            value=np.concatenate(values),
+            roots=np.array(roots, dtype=np.int32),
+            max_depth=max_depth,
+            n_features=model.n_features_in_
+        )
+
+    def save(self, directory):
+        """Writes the engine's arrays as .npy files that attach() can memory-map"""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.array_names:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "engine.json"), "w") as f:
+            json.dump({"max_depth": int(self.max_depth), "n_features": int(self.n_features)}, f)
+
+    @classmethod
+    def attach(cls, directory):
+        """
+        Memory-maps an engine written by save() read-only
+
+        The arrays are not copied: every process attaching to the same
+        directory shares the same physical pages through the page cache.
+        """
+        with open(os.path.join(directory, "engine.json")) as f:
+            meta = json.load(f)
+        # asarray drops the memmap subclass without copying, so results are plain ndarrays
+        arrays = {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+                  for name in cls.array_names}
+        return cls(max_depth=meta["max_depth"], n_features=meta["n_features"], **arrays)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.feature, self.threshold, self.children,
+                                              self.value, self.roots))
+
+    def predict(self, X):
+        """
+        Predicts an N x F matrix, returning an array of N predictions
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[-1]} features, but the model is expecting "
+                             f"{self.n_features} features as input.")
+
+        if X.shape[0] <= self.chunk_size:
+            return self._predict_chunk(X)
+        return np.concatenate([self._predict_chunk(X[start:start + self.chunk_size])
+                               for start in range(0, X.shape[0], self.chunk_size)])
+
+    def _predict_chunk(self, X):
+        flat = X.ravel()
+        offsets = (np.arange(X.shape[0], dtype=np.int32) * X.shape[1])[:, None]
+        nodes = np.tile(self.roots, (X.shape[0], 1))
+        for _ in range(self.max_depth):
+            go_left = flat.take(offsets + self.feature.take(nodes)) <= self.threshold.take(nodes)
+            nodes = self.children.take(nodes * 2 + go_left)
+
+        return self.value.take(nodes).mean(axis=1, dtype=np.float64)
+
+
+def build_engine(model):
+    """
+    Builds a ForestEngine for the model, or returns None if it is not supported
+    """
+    try:
+        engine = ForestEngine.from_sklearn(model)
+    except (TypeError, AttributeError) as e:
+        logger.warning(f"NumPy forest engine not available, using sklearn: {str(e)}")
+        return None
+
+    # Check parity on random rows before taking over from sklearn
+    rng = np.random.default_rng(0)
+    sample = rng.normal(size=(64, engine.n_features))
+    if not np.allclose(engine.predict(sample), model.predict(sample), rtol=1e-5, atol=1e-6):
+        logger.warning("NumPy forest engine disagrees with sklearn, using sklearn")
+        return None
+
+    logger.info(f"Using NumPy forest engine ({engine.roots.shape[0]} trees, "
+                f"{engine.value.shape[0]} nodes, {engine.nbytes / 1024:.1f} KiB)")
+    return engine
@@ -1,19 +1,35 @@
+import asyncio
 import logging
 import os
-import joblib
+import sys
 import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel
+from typing import Optional
 from fastapi.middleware.cors import CORSMiddleware
-import requests
 import uvicorn
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+
+# Make the helpers shared between services importable when running from the service directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.http_client import ServiceClient, RequestError, circuit_breakers
+from shared import wire
+from shared.metrics import install_metrics, phase
+from shared.tracing import install_tracing
+from shared.admission import install_admission
+from shared.deadline import check_deadline, install_deadlines
+from shared.logging_setup import configure_logging
+from shared.startup import install_probes
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging("inference")
 logger = logging.getLogger(__name__)
 
+from micro_batcher import MicroBatcher
+from model_executor import ModelExecutor, ModelQueueFull
+from prediction_cache import PredictionCache
+import predictor
+from predictor import PreprocessedData, PreprocessedBatch, batch_features, batch_result, build_prediction, valid_rows
+
 # Initialize FastAPI app
 app = FastAPI(title="Inference Service",
               description="Makes predictions using a pre-trained ML model",
@@ -28,39 +44,146 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts, in-flight gauges and per-phase latency histograms on /metrics
+metrics = install_metrics(app, "inference")
+
+# Request spans sharing one trace ID across the four services, sampled at TRACE_SAMPLE_RATE
+install_tracing(app, "inference")
+
+# Bounded in-flight requests and queue; excess work is rejected early with 429/503
+admission = install_admission(app, "inference", metrics)
+
+# Deadline of every request, forwarded downstream and capping the downstream timeouts
+install_deadlines(app, "inference", metrics)
+
+# /livez, and /readyz once the model is loaded, warmed up and its workers are running
+startup = install_probes(app, "inference", metrics)
+
 # Post-processing service URL
 POSTPROCESSING_URL = os.getenv("POSTPROCESSING_URL", "http://0.0.0.0:8003/postprocess")
+POSTPROCESSING_BATCH_URL = os.getenv("POSTPROCESSING_BATCH_URL", f"{POSTPROCESSING_URL}/batch")
 
-# Define data models
-class PreprocessedData(BaseModel):
-    features: List[float]
-    metadata: Optional[Dict[str, Any]] = None
-    preprocessing_info: Optional[Dict[str, Any]] = None
-
-class PredictionResponse(BaseModel):
-    prediction: List[float]
-    prediction_probabilities: Optional[List[float]] = None
-    metadata: Optional[Dict[str, Any]] = None
-    preprocessing_info: Optional[Dict[str, Any]] = None
-
-# Load the ML model
-MODEL_PATH = os.getenv("MODEL_PATH", "model.pkl")
-
-try:
-    # Check if model file exists
-    if not os.path.exists(MODEL_PATH):
-        logger.warning(f"Model file {MODEL_PATH} not found. Will attempt to generate it.")
-        # Import and run the model generator
-        import model_generator
-        model_generator.generate_model(MODEL_PATH)
-        logger.info(f"Model generated and saved to {MODEL_PATH}")
-    
-    # Load the model
-    model = joblib.load(MODEL_PATH)
-    logger.info(f"Successfully loaded model from {MODEL_PATH}")
-except Exception as e:
-    logger.error(f"Error loading model: {str(e)}")
-    model = None
+# Pooled, non-blocking client for the postprocessing service
+postprocessing_client = ServiceClient("postprocessing")
+
+# Where model calls run: "inline" on the event loop, or in a pool of "thread" or
+# "process" workers so /health and other requests are served during heavy batches.
+# At most INFERENCE_QUEUE_SIZE calls wait or run at once, further ones get a 503.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "thread").lower()
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+
+model_executor = ModelExecutor(INFERENCE_BACKEND, workers=INFERENCE_WORKERS, max_pending=INFERENCE_QUEUE_SIZE)
+
+# Dynamic micro-batching of concurrent single-row predictions
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "true").lower() == "true"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "256"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2"))
+
+micro_batcher = MicroBatcher(model_executor.run, max_batch_size=MICRO_BATCH_MAX_SIZE,
+                             max_wait_ms=MICRO_BATCH_MAX_WAIT_MS)
+
+# Cache of model outputs keyed on the model version and preprocessed features.
+# Individual requests can bypass it with {"cache": false} in their metadata.
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "300"))
+
+prediction_cache = PredictionCache(max_entries=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL)
+
+def use_cache(metadata):
+    return PREDICTION_CACHE_ENABLED and not (metadata and metadata.get("cache") is False)
+
+# Seconds between checks of the registry's ACTIVE file (0 disables watching)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+
+# Serializes reloads triggered by the admin endpoint and the file watcher
+model_reload_lock = asyncio.Lock()
+model_watch_task = None
+model_init_task = None
+
+class ReloadRequest(BaseModel):
+    version: Optional[str] = None
+
+async def reload_model(version=None):
+    """
+    Loads and warms up a model version in a worker thread, then swaps it in
+
+    The event loop keeps serving requests with the current model while the
+    new one loads.
+    """
+    async with model_reload_lock:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, predictor.reload_model, version)
+
+async def watch_model_registry():
+    """Reloads the model when the registry's ACTIVE version changes"""
+    last_mtime = predictor.registry.active_pointer_mtime()
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            mtime = predictor.registry.active_pointer_mtime()
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            version = predictor.registry.active_version()
+            if version is not None and (predictor.active is None or version != predictor.active.version):
+                logger.info(f"Registry switched to model version {version}, reloading")
+                await reload_model(version)
+        except Exception as e:
+            logger.error(f"Error reloading model from the registry: {str(e)}")
+
+@app.on_event("startup")
+async def start_http_client():
+    await postprocessing_client.start()
+
+async def initialize_model():
+    """Loads and warms up the model off the event loop, then starts the model workers"""
+    loop = asyncio.get_running_loop()
+    try:
+        loaded = await loop.run_in_executor(None, predictor.initialize, startup.phase)
+        if loaded is None:
+            startup.mark_failed("Model could not be loaded")
+            return
+        with startup.phase("workers"):
+            await model_executor.start()
+        startup.mark_ready()
+    except Exception as e:
+        startup.mark_failed(str(e))
+
+@app.on_event("startup")
+async def start_model_initialization():
+    # /livez answers while the model loads; /readyz and the predict endpoints wait for it
+    global model_init_task
+    model_init_task = asyncio.create_task(initialize_model())
+
+@app.on_event("startup")
+async def start_micro_batcher():
+    if MICRO_BATCH_ENABLED:
+        await micro_batcher.start()
+
+@app.on_event("startup")
+async def start_model_watcher():
+    global model_watch_task
+    if MODEL_WATCH_INTERVAL > 0:
+        model_watch_task = asyncio.create_task(watch_model_registry())
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await postprocessing_client.close()
+
+@app.on_event("shutdown")
+async def stop_micro_batcher():
+    await micro_batcher.stop()
+
+@app.on_event("shutdown")
+async def stop_model_watcher():
+    if model_watch_task is not None:
+        model_watch_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_model_executor():
+    await model_executor.stop()
 
 @app.get("/")
 def read_root():
@@ -68,66 +191,189 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    if model is not None:
-        return {"status": "healthy", "model_loaded": True}
-    return {"status": "unhealthy", "model_loaded": False}
+    breakers = circuit_breakers(postprocessing_client)
+    if predictor.active is not None:
+        return {"status": "healthy", "model_loaded": True, "model_version": predictor.active.version,
+                "circuit_breakers": breakers}
+    return {"status": "unhealthy", "model_loaded": False, "model_version": None, "circuit_breakers": breakers}
+
+@app.get("/batching/stats")
+def batching_stats():
+    """Micro-batching statistics, including the batch size histogram"""
+    return {"enabled": MICRO_BATCH_ENABLED, **micro_batcher.stats()}
+
+@app.get("/executor/stats")
+def executor_stats():
+    """Backend, worker count and queue occupancy of the model executor"""
+    return model_executor.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Prediction cache hit, miss and eviction counters"""
+    model_version = predictor.active.version if predictor.active is not None else None
+    return {"enabled": PREDICTION_CACHE_ENABLED, "model_version": model_version,
+            **prediction_cache.stats()}
+
+@app.get("/admin/models")
+def list_models():
+    """Registered model versions and the model currently serving"""
+    return {
+        "active": predictor.active.info() if predictor.active is not None else None,
+        "registry": predictor.MODEL_REGISTRY_DIR,
+        "versions": [predictor.registry.metadata(version) for version in predictor.registry.versions()]
+    }
+
+@app.post("/admin/models/reload")
+async def reload_model_version(request: Optional[ReloadRequest] = None):
+    """
+    Loads a model version (default: the registry's active version), warms it
+    up and swaps it in without interrupting in-flight requests
+    """
+    version = request.version if request is not None else None
+    try:
+        info = await reload_model(version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reloading model: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Reload error: {str(e)}")
+
+    # Record the choice so restarts and other replicas serve the same version
+    predictor.registry.set_active_version(info["version"])
+    return {"status": "success", "active": info}
 
 @app.post("/predict")
 async def predict(data: PreprocessedData):
     """
     Makes predictions using the loaded ML model
     """
-    logger.info(f"Received data for prediction")
+    logger.info("Received data for prediction")
     
-    if model is None:
+    if predictor.active is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
+    check_deadline()
     
     try:
-        # Convert features to numpy array
-        features = np.array(data.features).reshape(1, -1)
+        with phase("compute"):
+            # Convert features to numpy array
+            features = np.array(data.features).reshape(1, -1)
         
-        # Make prediction
-        prediction = model.predict(features)
+            cached = None
+            caching = use_cache(data.metadata)
+            if caching:
+                cached_model = predictor.active
+                cache_key = PredictionCache.make_key(cached_model.checksum, features)
+                cached = prediction_cache.get(cache_key)
         
-        # Get prediction probabilities if the model supports it
-        prediction_probabilities = None
-        if hasattr(model, 'predict_proba'):
-            try:
-                prediction_probabilities = model.predict_proba(features).tolist()[0]
-            except Exception as e:
-                logger.warning(f"Could not get prediction probabilities: {str(e)}")
+            if cached is not None:
+                prediction, probabilities = cached
+            else:
+                # Make prediction, coalesced with concurrent requests when micro-batching is enabled
+                if MICRO_BATCH_ENABLED:
+                    prediction, probabilities = await micro_batcher.predict(features[0])
+                else:
+                    prediction, probabilities = await model_executor.run(features)
+                # Skip storing if the model was swapped while this prediction ran
+                if caching and predictor.active is cached_model:
+                    prediction_cache.put(cache_key, (prediction, probabilities))
         
-        # Create prediction response
-        prediction_response = PredictionResponse(
-            prediction=prediction.tolist(),
-            prediction_probabilities=prediction_probabilities,
-            metadata=data.metadata,
-            preprocessing_info=data.preprocessing_info
-        )
+            # Create prediction response
+            prediction_response = build_prediction(data, prediction, probabilities)
         
         # Forward to post-processing service
         try:
-            response = requests.post(POSTPROCESSING_URL, json=prediction_response.dict())
+            response = await postprocessing_client.post(POSTPROCESSING_URL, json=prediction_response.dict())
             
             if response.status_code != 200:
                 logger.error(f"Post-processing service error: {response.text}")
                 # Even if post-processing fails, return the prediction
-                return prediction_response.dict()
+                return prediction_response.dict(exclude={"features"})
             
             postprocessed_result = response.json()
-            logger.info(f"Post-processing completed successfully")
+            logger.info("Post-processing completed successfully")
             
             return postprocessed_result
             
-        except requests.RequestException as e:
+        except RequestError as e:
             logger.error(f"Error connecting to post-processing service: {str(e)}")
             # Return prediction without post-processing
-            return prediction_response.dict()
+            return prediction_response.dict(exclude={"features"})
         
+    except ModelQueueFull as e:
+        logger.warning(f"Rejecting prediction: {str(e)}")
+        raise HTTPException(status_code=503, detail="Inference queue full")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during prediction: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
+def without_features(prediction_batch):
+    """A prediction batch returned to the caller when postprocessing fails, without the echoed features"""
+    return {key: value for key, value in prediction_batch.items() if key != "features"}
+
+@app.post("/predict/batch")
+async def predict_batch_data(request: Request):
+    """
+    Makes predictions for a whole batch with a single model call
+
+    Rows flagged with an error by an earlier stage are passed through untouched.
+    Accepts and replies with JSON (PreprocessedBatch) or msgpack.
+    """
+    with phase("parse"):
+        data, _ = await wire.read_batch(request, PreprocessedBatch)
+    num_rows = len(data.features)
+    logger.info("Received batch of %d rows for prediction", num_rows)
+
+    if predictor.active is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    if not (len(data.metadata) == len(data.preprocessing_info) == len(data.errors) == num_rows):
+        raise HTTPException(status_code=422, detail="Batch fields must all have the same length")
+    check_deadline()
+
+    try:
+        binary = wire.binary_enabled()
+        with phase("compute"):
+            valid = valid_rows(data, predictor.active.n_features)
+            prediction = probabilities = error = None
+            if valid:
+                try:
+                    # Make predictions for every valid row at once
+                    prediction, probabilities = await model_executor.run(batch_features(data, valid))
+                except ValueError as e:
+                    error = e
+            prediction_batch = batch_result(data, valid, prediction, probabilities, error, as_arrays=binary)
+            if not binary:
+                prediction_batch = prediction_batch.dict()
+
+        # Forward to post-processing service
+        try:
+            response = await postprocessing_client.post(POSTPROCESSING_BATCH_URL,
+                                                        **wire.request_kwargs(prediction_batch, binary))
+
+            if response.status_code != 200:
+                logger.error(f"Post-processing service error: {response.text}")
+                # Even if post-processing fails, return the predictions
+                return wire.respond(without_features(prediction_batch), wire.accepts_binary(request))
+
+            logger.info("Batch post-processing completed successfully")
+            return wire.respond(wire.read_response(response), wire.accepts_binary(request))
+
+        except RequestError as e:
+            logger.error(f"Error connecting to post-processing service: {str(e)}")
+            # Return predictions without post-processing
+            return wire.respond(without_features(prediction_batch), wire.accepts_binary(request))
+
+    except ModelQueueFull as e:
+        logger.warning(f"Rejecting batch prediction: {str(e)}")
+        raise HTTPException(status_code=503, detail="Inference queue full")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during batch prediction: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
 if __name__ == "__main__":
     # Run the application
     uvicorn.run("main:app", host="0.0.0.0", port=8002, reload=True)
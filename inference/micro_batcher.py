@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions into one model call
+
+    Rows submitted while a batch is being collected are stacked into a matrix
+    once ``max_wait_ms`` has passed since the first row arrived or
+    ``max_batch_size`` rows are waiting, whichever comes first. The results
+    are scattered back to the waiting callers. A batch is dispatched as its
+    own task, so the next batch is collected while the model runs.
+
+    Args:
+        predict_fn: Coroutine function taking an N x F matrix and returning a
+            tuple of (predictions, probabilities or None) with N rows each
+        max_batch_size (int): Maximum number of rows per model call
+        max_wait_ms (float): Maximum time to wait for more rows
+    """
+
+    def __init__(self, predict_fn, max_batch_size=256, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._task = None
+        self._dispatches = set()
+
+        # Batch size histogram with power-of-two upper bounds
+        self.bucket_bounds = [1]
+        while self.bucket_bounds[-1] < max_batch_size:
+            self.bucket_bounds.append(min(self.bucket_bounds[-1] * 2, max_batch_size))
+        self.bucket_counts = [0] * len(self.bucket_bounds)
+        self.batches = 0
+        self.rows = 0
+        self.wait_seconds = 0.0
+
+    async def start(self):
+        """Start the background task that collects and runs batches"""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Micro-batching enabled (max_batch_size={self.max_batch_size}, "
+                        f"max_wait_ms={self.max_wait * 1000:g})")
+
+    async def stop(self):
+        """Stop the background task and fail any rows still waiting"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            for dispatch in list(self._dispatches):
+                dispatch.cancel()
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    async def predict(self, row):
+        """
+        Queue a single feature row and wait for its (prediction, probabilities)
+        """
+        if self._task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((np.asarray(row, dtype=float), future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(items) < self.max_batch_size:
+                if not self._queue.empty():
+                    items.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            dispatch = asyncio.create_task(self._dispatch(items))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, items):
+        now = time.perf_counter()
+        self._record(len(items), sum(now - queued_at for _, _, queued_at in items))
+
+        # Rows of different widths cannot be stacked, so each width gets its own call
+        groups = {}
+        for item in items:
+            groups.setdefault(item[0].shape[0], []).append(item)
+
+        for group in groups.values():
+            try:
+                await self._scatter(group, np.vstack([row for row, _, _ in group]))
+            except Exception as e:
+                # Only a rejected matrix is worth splitting up, other errors would fail every row again
+                if len(group) == 1 or not isinstance(e, ValueError):
+                    for _, future, _ in group:
+                        self._fail(future, e)
+                    continue
+                # Retry row by row so one bad row does not fail its neighbours
+                logger.warning(f"Batched prediction failed, retrying rows individually: {str(e)}")
+                for item in group:
+                    try:
+                        await self._scatter([item], item[0].reshape(1, -1))
+                    except Exception as row_error:
+                        self._fail(item[1], row_error)
+
+    async def _scatter(self, group, matrix):
+        predictions, probabilities = await self.predict_fn(matrix)
+        for j, (_, future, _) in enumerate(group):
+            if not future.done():
+                future.set_result((predictions[j:j + 1],
+                                   probabilities[j:j + 1] if probabilities is not None else None))
+
+    @staticmethod
+    def _fail(future, error):
+        if not future.done():
+            future.set_exception(error)
+
+    def _record(self, batch_size, wait_seconds):
+        self.batches += 1
+        self.rows += batch_size
+        self.wait_seconds += wait_seconds
+        for i, bound in enumerate(self.bucket_bounds):
+            if batch_size <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def _bucket_label(self, i):
+        low = self.bucket_bounds[i - 1] + 1 if i > 0 else 1
+        high = self.bucket_bounds[i]
+        return str(high) if low == high else f"{low}-{high}"
+
+    def stats(self):
+        """Batch size histogram and averages for tuning the batching window"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "mean_queue_wait_ms": self.wait_seconds / self.rows * 1000 if self.rows else 0.0,
+            "batch_size_histogram": {
+                self._bucket_label(i): count for i, count in enumerate(self.bucket_counts)
+            }
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import predictor
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("inline", "thread", "process")
+
+
+class ModelQueueFull(Exception):
+    """Raised when more model calls are pending than the executor accepts"""
+
+
+def _init_worker():
+    # Each process worker loads the active model once when it starts
+    predictor.initialize()
+    logger.info(f"Inference worker ready with model version "
+                f"{predictor.active.version if predictor.active is not None else None}")
+
+
+def _ping():
+    return predictor.active is not None
+
+
+def _run_in_worker(version, checksum, features):
+    # Workers load a newly activated version on their first call after the swap
+    if predictor.active is None or predictor.active.checksum != checksum:
+        predictor.reload_model(version)
+    return predictor.run_model(features)
+
+
+class ModelExecutor:
+    """
+    Runs model calls off the event loop, behind a bounded queue
+
+    ``inline`` calls the model on the event loop, ``thread`` in a pool of
+    threads and ``process`` in a pool of worker processes that each load the
+    active model once at startup. Calls beyond ``max_pending`` waiting or
+    running ones are rejected with ModelQueueFull instead of queueing up.
+
+    Args:
+        backend (str): One of "inline", "thread" or "process"
+        workers (int): Number of threads or processes
+        max_pending (int): Maximum number of model calls waiting or running
+    """
+
+    def __init__(self, backend="thread", workers=4, max_pending=64):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self._pool = None
+        self._start_lock = None
+
+    async def start(self):
+        """Create the worker pool; process workers are spawned and load the model now"""
+        if self._pool is not None or self.backend == "inline":
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._pool is None:
+                await self._create_pool()
+
+    async def _create_pool(self):
+        if self.backend == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        else:
+            # Forking a process that already runs an event loop and threads is unsafe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self._pool, _ping) for _ in range(self.workers)])
+        logger.info(f"Inference backend: {self.backend} with {self.workers} workers "
+                    f"(max_pending={self.max_pending})")
+
+    async def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, features):
+        """
+        Runs the active model on an N x F feature matrix
+
+        Returns:
+            tuple: (predictions, probabilities or None)
+
+        Raises:
+            ModelQueueFull: If ``max_pending`` model calls are already pending
+        """
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ModelQueueFull(f"{self.pending} model calls already pending")
+
+        self.pending += 1
+        self.calls += 1
+        try:
+            if self.backend == "inline":
+                return predictor.run_model(features)
+            if self._pool is None:
+                await self.start()
+            loop = asyncio.get_running_loop()
+            if self.backend == "thread":
+                return await loop.run_in_executor(self._pool, predictor.run_model, features)
+            active = predictor.active
+            return await loop.run_in_executor(self._pool, _run_in_worker, active.version, active.checksum, features)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "workers": self.workers if self.backend != "inline" else 0,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "calls": self.calls,
+            "rejected": self.rejected
+        }
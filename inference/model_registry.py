@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILENAME = "model.pkl"
+METADATA_FILENAME = "metadata.json"
+# File holding the version the inference service should serve
+ACTIVE_FILENAME = "ACTIVE"
+
+
+def file_checksum(path):
+    """SHA-256 of a file, used to identify and verify model versions"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Local on-disk registry of model versions
+
+    Each version is a directory holding the pickled model and a
+    ``metadata.json`` with its checksum::
+
+        <root>/
+            ACTIVE              version currently selected for serving
+            v0001/model.pkl
+            v0001/metadata.json
+            v0002/...
+
+    Args:
+        root (str): Directory of the registry, created on first registration
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def versions(self):
+        """All registered versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, name, METADATA_FILENAME)))
+
+    def latest_version(self):
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def model_path(self, version):
+        return os.path.join(self.root, version, MODEL_FILENAME)
+
+    def metadata(self, version):
+        with open(os.path.join(self.root, version, METADATA_FILENAME)) as f:
+            return json.load(f)
+
+    def verify(self, version):
+        """
+        Returns the checksum of a version after checking it against its metadata
+
+        Raises:
+            ValueError: If the version is unknown or the model file does not
+                match the recorded checksum
+        """
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version {version}")
+        checksum = file_checksum(self.model_path(version))
+        expected = self.metadata(version)["checksum"]
+        if checksum != expected:
+            raise ValueError(f"Checksum mismatch for model version {version}")
+        return checksum
+
+    def register(self, model_path, description=None, activate=False):
+        """
+        Copies a pickled model into the registry as a new version
+
+        Returns:
+            str: The new version name
+        """
+        latest = self.latest_version()
+        number = int(latest.lstrip("v")) + 1 if latest and latest.lstrip("v").isdigit() else 1
+        version = f"v{number:04d}"
+
+        # Write into a temporary directory and rename it, so watchers never see
+        # a partially written version
+        staging_dir = os.path.join(self.root, f".{version}.tmp")
+        os.makedirs(staging_dir, exist_ok=True)
+        shutil.copyfile(model_path, os.path.join(staging_dir, MODEL_FILENAME))
+        metadata = {
+            "version": version,
+            "checksum": file_checksum(os.path.join(staging_dir, MODEL_FILENAME)),
+            "source": os.path.abspath(model_path),
+            "description": description,
+            "created_at": datetime.now().isoformat()
+        }
+        with open(os.path.join(staging_dir, METADATA_FILENAME), "w") as f:
+            json.dump(metadata, f, indent=2)
+        os.rename(staging_dir, os.path.join(self.root, version))
+        logger.info(f"Registered model version {version} from {model_path}")
+
+        if activate:
+            self.set_active_version(version)
+        return version
+
+    def active_version(self):
+        """The version selected for serving, defaulting to the latest one"""
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILENAME)) as f:
+                version = f.read().strip()
+            if version in self.versions():
+                return version
+            logger.warning(f"Active model version {version} is not registered, using the latest version")
+        except FileNotFoundError:
+            pass
+        return self.latest_version()
+
+    def set_active_version(self, version):
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version {version}")
+        pointer = os.path.join(self.root, ACTIVE_FILENAME)
+        with open(f"{pointer}.tmp", "w") as f:
+            f.write(version)
+        os.replace(f"{pointer}.tmp", pointer)
+
+    def active_pointer_mtime(self):
+        try:
+            return os.path.getmtime(os.path.join(self.root, ACTIVE_FILENAME))
+        except FileNotFoundError:
+            return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Manage the local model registry')
+    parser.add_argument('--registry', type=str, default=os.getenv("MODEL_REGISTRY_DIR", "model_registry"),
+                        help='Registry directory (default: $MODEL_REGISTRY_DIR or model_registry)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    register_parser = subparsers.add_parser('register', help='Register a pickled model as a new version')
+    register_parser.add_argument('model_path', type=str)
+    register_parser.add_argument('--description', type=str, default=None)
+    register_parser.add_argument('--activate', action='store_true',
+                                 help='Make the new version active (running services pick it up)')
+    activate_parser = subparsers.add_parser('activate', help='Select the version to serve')
+    activate_parser.add_argument('version', type=str)
+    subparsers.add_parser('list', help='List registered versions')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'register':
+        print(registry.register(args.model_path, description=args.description, activate=args.activate))
+    elif args.command == 'activate':
+        registry.set_active_version(args.version)
+    else:
+        active = registry.active_version()
+        for version in registry.versions():
+            marker = "*" if version == active else " "
+            print(f"{marker} {version} {registry.metadata(version)['checksum'][:12]}")
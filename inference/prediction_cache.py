@@ -0,0 +1,76 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    In-process LRU cache of model outputs with a TTL and a size bound
+
+    Entries are keyed on the model version and the bytes of the preprocessed
+    feature vector, so loading a different model invalidates every entry
+    without an explicit flush.
+
+    Args:
+        max_entries (int): Maximum number of cached predictions
+        ttl_seconds (float): Time after which an entry is no longer served
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(model_version, features):
+        digest = hashlib.blake2b(np.ascontiguousarray(features, dtype=np.float64).tobytes(),
+                                 digest_size=16)
+        digest.update(str(model_version).encode())
+        return digest.digest()
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,446 @@
+import logging
+import os
+import shutil
+from contextlib import nullcontext
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from forest_engine import ForestEngine, build_engine
+from model_registry import ModelRegistry, file_checksum
+
+logger = logging.getLogger(__name__)
+
+# Define data models
+class PreprocessedData(BaseModel):
+    features: List[float]
+    metadata: Optional[Dict[str, Any]] = None
+    preprocessing_info: Optional[Dict[str, Any]] = None
+
+class PredictionResponse(BaseModel):
+    prediction: List[float]
+    prediction_probabilities: Optional[List[float]] = None
+    metadata: Optional[Dict[str, Any]] = None
+    preprocessing_info: Optional[Dict[str, Any]] = None
+    # Features the model was given, for the postprocessing audit log
+    features: Optional[List[float]] = None
+
+class PreprocessedBatch(BaseModel):
+    features: List[List[float]]
+    metadata: List[Optional[Dict[str, Any]]]
+    preprocessing_info: List[Optional[Dict[str, Any]]]
+    errors: List[Optional[str]]
+
+class PredictionBatch(BaseModel):
+    prediction: List[Optional[List[float]]]
+    prediction_probabilities: List[Optional[List[float]]]
+    metadata: List[Optional[Dict[str, Any]]]
+    preprocessing_info: List[Optional[Dict[str, Any]]]
+    errors: List[Optional[str]]
+    features: Optional[List[List[float]]] = None
+
+# Load the ML model
+MODEL_PATH = os.getenv("MODEL_PATH", "model.pkl")
+
+# Versioned model registry. When it holds any versions it takes precedence
+# over MODEL_PATH and the active version can be swapped at runtime.
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry")
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
+
+# "sklearn" calls the model directly, "numpy" scores supported tree ensembles
+# with the compiled ForestEngine and falls back to sklearn for anything else
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "sklearn").lower()
+# Above this many rows sklearn's compiled traversal is faster than the NumPy engine
+INFERENCE_ENGINE_MAX_ROWS = int(os.getenv("INFERENCE_ENGINE_MAX_ROWS", "2048"))
+
+# Shared mode serves supported tree ensembles from ForestEngine arrays exported
+# once per model file and memory-mapped read-only, so every worker process
+# shares one copy and starts without unpickling the model. The arrays go to
+# SHARED_MODEL_DIR (e.g. /dev/shm/models), by default next to the model file.
+INFERENCE_SHARED_MODEL = os.getenv("INFERENCE_SHARED_MODEL", "false").lower() == "true"
+SHARED_MODEL_DIR = os.getenv("SHARED_MODEL_DIR", "")
+
+class LoadedModel:
+    """
+    A loaded model together with its version, checksum and optional NumPy engine
+
+    The service swaps whole LoadedModel objects, so a prediction always uses
+    the model, engine and version of a single load. In shared mode ``model``
+    is None and every prediction goes through the memory-mapped ``engine``.
+    """
+
+    def __init__(self, model, version, checksum, path, engine=None):
+        self.model = model
+        self.version = version
+        self.checksum = checksum
+        self.path = path
+        if engine is None and INFERENCE_ENGINE == "numpy":
+            engine = build_engine(model)
+        self.engine = engine
+        self.loaded_at = datetime.now().isoformat()
+
+    @property
+    def n_features(self):
+        """Number of features the model expects, None if it does not say"""
+        if self.model is None:
+            return self.engine.n_features
+        return getattr(self.model, "n_features_in_", None)
+
+    def predict(self, features):
+        """
+        Runs the model on an N x F feature matrix
+
+        Returns the predictions and, if the model supports it, the prediction
+        probabilities (None otherwise).
+        """
+        if self.engine is not None and (self.model is None or features.shape[0] <= INFERENCE_ENGINE_MAX_ROWS):
+            prediction = self.engine.predict(features)
+        else:
+            prediction = self.model.predict(features)
+
+        # Get prediction probabilities if the model supports it
+        prediction_probabilities = None
+        if hasattr(self.model, 'predict_proba'):
+            try:
+                prediction_probabilities = self.model.predict_proba(features)
+            except Exception as e:
+                logger.warning(f"Could not get prediction probabilities: {str(e)}")
+
+        return prediction, prediction_probabilities
+
+    def warm_up(self, num_rows=8):
+        """
+        Runs a few predictions so the first real request does not pay for
+        lazy initialization
+
+        Raises:
+            ValueError: If the model does not produce finite predictions
+        """
+        if self.n_features is None:
+            return
+        rows = np.random.default_rng(0).normal(size=(num_rows, self.n_features))
+        # Exercise both the single-row and the batch path
+        self.predict(rows[:1])
+        prediction, _ = self.predict(rows)
+        if not np.all(np.isfinite(prediction)):
+            raise ValueError(f"Model version {self.version} produced non-finite predictions during warm-up")
+
+    def info(self):
+        return {
+            "version": self.version,
+            "checksum": self.checksum,
+            "path": self.path,
+            "engine": "sklearn" if self.engine is None else "numpy" if self.model is not None else "shared",
+            "loaded_at": self.loaded_at
+        }
+
+def load_model(model_path=MODEL_PATH):
+    """
+    Loads the model from disk, generating it first if the file does not exist
+
+    Returns None if the model could not be loaded.
+    """
+    try:
+        # Check if model file exists
+        if not os.path.exists(model_path):
+            logger.warning(f"Model file {model_path} not found. Will attempt to generate it.")
+            # Import and run the model generator
+            import model_generator
+            model_generator.generate_model(model_path)
+            logger.info(f"Model generated and saved to {model_path}")
+
+        # Load the model, memory-mapping its arrays where the file format allows it.
+        # joblib, and sklearn through the unpickled model, are only imported here.
+        import joblib
+        loaded_model = joblib.load(model_path, mmap_mode="r")
+        logger.info(f"Successfully loaded model from {model_path}")
+        return loaded_model
+    except Exception as e:
+        logger.error(f"Error loading model: {str(e)}")
+        return None
+
+def shared_engine(path, checksum):
+    """
+    Attaches to the exported engine arrays of a model file, exporting them first if needed
+
+    The first process to load a model file unpickles it once and writes its
+    arrays; concurrent exports race on an atomic rename and the losers
+    discard their copy.
+
+    Returns:
+        ForestEngine: The memory-mapped engine, or None if the model is not a
+        supported tree ensemble
+    """
+    directory = os.path.join(SHARED_MODEL_DIR or f"{path}.shared", checksum[:16])
+    if not os.path.isdir(directory):
+        import joblib
+        model = joblib.load(path)
+        engine = build_engine(model)
+        if engine is None:
+            return None
+        staging = f"{directory}.{os.getpid()}.tmp"
+        engine.save(staging)
+        try:
+            os.rename(staging, directory)
+            logger.info(f"Exported shared model arrays to {directory}")
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+    return ForestEngine.attach(directory)
+
+def open_model(path, version, checksum):
+    """
+    Loads a model file, attaching to its shared engine arrays in shared mode
+    """
+    if INFERENCE_SHARED_MODEL:
+        engine = shared_engine(path, checksum)
+        if engine is not None:
+            return LoadedModel(None, version, checksum, path, engine=engine)
+        logger.warning(f"Model {path} cannot be shared between workers, loading a private copy")
+    import joblib
+    return LoadedModel(joblib.load(path, mmap_mode="r"), version, checksum, path)
+
+def _untimed(phase_name):
+    return nullcontext()
+
+def load_version(version, phase=_untimed):
+    """
+    Loads and warms up a registered model version without activating it
+
+    Args:
+        version (str): The registered version
+        phase (callable): Context manager factory timing the ``model_load``
+            and ``warm_up`` phases, e.g. Startup.phase
+
+    Raises:
+        ValueError: If the version fails verification or warm-up
+    """
+    with phase("model_load"):
+        checksum = registry.verify(version)
+        path = registry.model_path(version)
+        loaded = open_model(path, version, checksum)
+    with phase("warm_up"):
+        loaded.warm_up()
+    return loaded
+
+def load_initial_model(phase=_untimed):
+    """
+    Loads the active registry version, or MODEL_PATH if the registry is empty
+
+    ``phase`` times the ``model_load`` and ``warm_up`` phases, see load_version.
+    """
+    version = registry.active_version()
+    if version is not None:
+        try:
+            loaded = load_version(version, phase)
+            logger.info(f"Loaded model version {version} from the registry")
+            return loaded
+        except Exception as e:
+            logger.error(f"Error loading model version {version}, falling back to {MODEL_PATH}: {str(e)}")
+
+    with phase("model_load"):
+        if INFERENCE_SHARED_MODEL and os.path.exists(MODEL_PATH):
+            try:
+                checksum = file_checksum(MODEL_PATH)
+                loaded = open_model(MODEL_PATH, checksum[:12], checksum)
+            except Exception as e:
+                logger.error(f"Error loading model: {str(e)}")
+                return None
+        else:
+            model = load_model(MODEL_PATH)
+            if model is None:
+                return None
+            checksum = file_checksum(MODEL_PATH)
+            loaded = LoadedModel(model, checksum[:12], checksum, MODEL_PATH)
+    with phase("warm_up"):
+        try:
+            loaded.warm_up()
+        except Exception as e:
+            logger.warning(f"Warm-up failed: {str(e)}")
+    return loaded
+
+# The model currently serving predictions, replaced as a whole on reload. It
+# is loaded by initialize() rather than on import, so that importing this
+# module stays cheap and services can report readiness once it is loaded.
+active = None
+
+def initialize(phase=_untimed):
+    """
+    Loads, warms up and activates the initial model
+
+    Returns:
+        LoadedModel: The active model, or None if it could not be loaded
+    """
+    global active
+    active = load_initial_model(phase)
+    return active
+
+def model_loaded():
+    return active is not None
+
+def reload_model(version=None):
+    """
+    Loads a registry version in the calling thread and swaps it in
+
+    In-flight predictions keep the model they started with. The previous
+    model is released once they finish. Defaults to the active version in
+    the registry.
+
+    Returns:
+        dict: Information about the newly active model
+    """
+    global active
+    version = version or registry.active_version()
+    if version is None:
+        raise ValueError(f"No model versions registered in {MODEL_REGISTRY_DIR}")
+
+    loaded = load_version(version)
+    previous = active
+    active = loaded
+    logger.info(f"Activated model version {version} "
+                f"(previous: {previous.version if previous is not None else None})")
+    return loaded.info()
+
+def run_model(features):
+    """
+    Runs the active model on an N x F feature matrix
+
+    Returns the predictions and, if the model supports it, the prediction
+    probabilities (None otherwise).
+    """
+    return active.predict(features)
+
+def build_prediction(data, prediction, probabilities):
+    """
+    Creates the prediction response for a single row from the model output
+    """
+    prediction_probabilities = None
+    if probabilities is not None:
+        prediction_probabilities = probabilities.tolist()[0]
+
+    return PredictionResponse(
+        prediction=prediction.tolist(),
+        prediction_probabilities=prediction_probabilities,
+        metadata=data.metadata,
+        preprocessing_info=data.preprocessing_info,
+        features=data.features
+    )
+
+def predict(data):
+    """
+    Makes a prediction for a single row
+
+    Args:
+        data: Object with ``features``, ``metadata`` and ``preprocessing_info``
+            attributes, e.g. PreprocessedData
+
+    Returns:
+        PredictionResponse: The prediction together with the input context
+    """
+    # Convert features to numpy array
+    features = np.array(data.features).reshape(1, -1)
+    prediction, probabilities = run_model(features)
+    return build_prediction(data, prediction, probabilities)
+
+def valid_rows(data, n_features=None):
+    """
+    Indices of the batch rows not flagged with an error by an earlier stage
+
+    Rows of a list batch whose length is not ``n_features`` are flagged in
+    ``data.errors`` here, so they fail on their own rather than failing the
+    model call for the whole batch.
+    """
+    if n_features is not None and not isinstance(data.features, np.ndarray):
+        for i, row in enumerate(data.features):
+            if data.errors[i] is None and len(row) != n_features:
+                data.errors[i] = f"Prediction error: Expected {n_features} features, got {len(row)}"
+    return [i for i in range(len(data.features)) if data.errors[i] is None]
+
+def batch_features(data, valid):
+    """
+    Stacks the ``valid`` rows of a batch into a feature matrix
+
+    Raises:
+        ValueError: If the rows cannot be stacked into a matrix
+    """
+    if isinstance(data.features, np.ndarray):
+        return np.asarray(data.features, dtype=float)[valid]
+    return np.array([data.features[i] for i in valid], dtype=float)
+
+def predict_batch(data, as_arrays=False):
+    """
+    Makes predictions for a whole batch with a single model call
+
+    Rows flagged with an error by an earlier stage are passed through untouched.
+
+    Args:
+        data: Object with the fields of PreprocessedBatch. ``features`` may
+            also be an N x F ndarray.
+        as_arrays (bool): Return a dict holding the predictions as an N x K
+            ndarray (NaN for failed rows) for the binary wire format
+
+    Returns:
+        PredictionBatch: One entry per input row, in order (a dict of the
+        same fields if ``as_arrays`` is set)
+    """
+    valid = valid_rows(data, active.n_features if active is not None else None)
+    prediction = probabilities = error = None
+    if valid:
+        try:
+            # Make predictions for every valid row at once
+            prediction, probabilities = run_model(batch_features(data, valid))
+        except ValueError as e:
+            error = e
+    return batch_result(data, valid, prediction, probabilities, error, as_arrays)
+
+def batch_result(data, valid, prediction, probabilities, error=None, as_arrays=False):
+    """
+    Builds the response of predict_batch from the model output for the ``valid`` rows
+
+    ``error`` is the ValueError raised when the model rejected the matrix as
+    a whole (e.g. wrong number of features), which fails every valid row.
+    """
+    num_rows = len(data.features)
+    errors = list(data.errors)
+    if error is not None:
+        logger.error(f"Model rejected batch: {str(error)}")
+        for i in valid:
+            errors[i] = f"Prediction error: {str(error)}"
+        prediction = probabilities = None
+    elif prediction is not None:
+        prediction = prediction.reshape(len(valid), -1)
+
+    if as_arrays:
+        prediction_matrix = np.full((num_rows, prediction.shape[1] if prediction is not None else 1), np.nan)
+        probability_matrix = None
+        if prediction is not None:
+            prediction_matrix[valid] = prediction
+            if probabilities is not None:
+                probability_matrix = np.full((num_rows, probabilities.shape[1]), np.nan)
+                probability_matrix[valid] = probabilities
+        return {
+            "prediction": prediction_matrix,
+            "prediction_probabilities": probability_matrix,
+            "metadata": data.metadata,
+            "preprocessing_info": data.preprocessing_info,
+            "errors": errors,
+            "features": data.features
+        }
+
+    predictions = [None] * num_rows
+    prediction_probabilities = [None] * num_rows
+    if prediction is not None:
+        for j, i in enumerate(valid):
+            predictions[i] = prediction[j].tolist()
+            if probabilities is not None:
+                prediction_probabilities[i] = probabilities[j].tolist()
+
+    return PredictionBatch(
+        prediction=predictions,
+        prediction_probabilities=prediction_probabilities,
+        metadata=data.metadata,
+        preprocessing_info=data.preprocessing_info,
+        errors=errors,
+        features=data.features
+    )
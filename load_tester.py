@@ -0,0 +1,236 @@
+"""
+Server-side load tests run from the dashboard against the ingestion service
+
+A load test keeps ``concurrency`` requests in flight for ``duration``
+seconds (closed loop, like client_demo.py's closed mode). Live statistics
+are available while it runs, and the summaries of finished runs are kept
+so runs can be compared across deployment changes.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Window over which the live throughput and percentiles are computed
+LIVE_WINDOW_SECONDS = 5.0
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else None
+    }
+
+
+class LoadTest:
+    """
+    One closed-loop load test against the ingestion service
+
+    Args:
+        ingestion_url (str): Base URL of the ingestion service
+        concurrency (int): Requests kept in flight
+        duration (float): Seconds to run for
+        batch_size (int): Rows per request; 1 uses /ingest, more uses /ingest/batch
+        num_features (int): Features per row
+        label (str): Name of the run in the results
+        timeout (float): Per-request timeout in seconds
+    """
+
+    def __init__(self, ingestion_url, concurrency, duration, batch_size=1, num_features=4,
+                 label=None, timeout=30.0):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.batch_size = batch_size
+        self.num_features = num_features
+        self.timeout = timeout
+        self.url = f"{ingestion_url}/ingest" if batch_size == 1 else f"{ingestion_url}/ingest/batch"
+        self.label = label or f"c={concurrency} rows={batch_size} features={num_features}"
+        self.state = "pending"
+        self.started_at = None
+        self.finished_at = None
+        self._start = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # (completion time since start, latency in ms, HTTP status or error name), in completion order
+        self._samples = []
+
+    def _payload(self):
+        if self.batch_size == 1:
+            return {"features": [random.uniform(0, 1) for _ in range(self.num_features)],
+                    "metadata": {"source": "dashboard-load-test"}}
+        return {"features": [[random.uniform(0, 1) for _ in range(self.num_features)]
+                             for _ in range(self.batch_size)]}
+
+    def run(self):
+        """Send load until the duration is over or the test is stopped, then summarize"""
+        self.state = "running"
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        end_time = self._start + self.duration
+        logger.info(f"Starting load test {self.run_id} ({self.label}) against {self.url} for {self.duration:g}s")
+
+        def worker():
+            with requests.Session() as session:
+                while not self._stop.is_set() and time.perf_counter() < end_time:
+                    start = time.perf_counter()
+                    try:
+                        status = session.post(self.url, json=self._payload(), timeout=self.timeout).status_code
+                    except requests.RequestException as e:
+                        status = type(e).__name__
+                    now = time.perf_counter()
+                    with self._lock:
+                        self._samples.append((now - self._start, (now - start) * 1000, status))
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load-test") as executor:
+                for future in [executor.submit(worker) for _ in range(self.concurrency)]:
+                    future.result()
+            self.state = "stopped" if self._stop.is_set() else "completed"
+        except Exception as e:
+            logger.error(f"Load test {self.run_id} failed: {str(e)}")
+            self.state = "failed"
+        self.finished_at = time.time()
+        logger.info(f"Load test {self.run_id} {self.state}: {len(self._samples)} requests")
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def done(self):
+        return self.state in ("completed", "stopped", "failed")
+
+    def live(self):
+        """Progress and the throughput and latency percentiles of the last few seconds"""
+        with self._lock:
+            samples = list(self._samples)
+        elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+        if self.done and samples:
+            elapsed = min(elapsed, samples[-1][0])
+        window_start = max(0.0, elapsed - LIVE_WINDOW_SECONDS)
+        # Samples are appended in completion order, so the window is a suffix
+        window = samples[bisect_left(samples, (window_start,)):]
+        window_seconds = elapsed - window_start
+        return {
+            "run_id": self.run_id,
+            "state": self.state,
+            "elapsed_s": elapsed,
+            "requests": len(samples),
+            "errors": sum(1 for _, _, status in samples if status != 200),
+            "throughput_rps": len(window) / window_seconds if window_seconds > 0 else 0.0,
+            **latency_stats([latency for _, latency, _ in window])
+        }
+
+    def summary(self):
+        """Parameters and overall results of the run"""
+        with self._lock:
+            samples = list(self._samples)
+        statuses = {}
+        for _, _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        errors = sum(count for status, count in statuses.items() if status != "200")
+        elapsed = samples[-1][0] if samples else 0.0
+        return {
+            "run_id": self.run_id,
+            "label": self.label,
+            "state": self.state,
+            "url": self.url,
+            "concurrency": self.concurrency,
+            "duration_s": self.duration,
+            "batch_size": self.batch_size,
+            "num_features": self.num_features,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "requests": len(samples),
+            "errors": errors,
+            "error_rate": errors / len(samples) if samples else 0.0,
+            "throughput_rps": len(samples) / elapsed if elapsed > 0 else 0.0,
+            "rows_per_s": len(samples) * self.batch_size / elapsed if elapsed > 0 else 0.0,
+            "status_codes": statuses,
+            **latency_stats([latency for _, latency, _ in samples])
+        }
+
+
+class LoadTestRunner:
+    """
+    Runs one load test at a time in a background thread and keeps past results
+
+    Summaries of finished runs are kept in memory, newest last, and appended
+    to ``results_file`` (one JSON object per line) when it is set, so they
+    survive dashboard restarts.
+    """
+
+    def __init__(self, history_size=50, results_file=None):
+        self.results_file = results_file
+        self.current = None
+        self._results = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        if results_file and os.path.exists(results_file):
+            with open(results_file) as f:
+                for line in f:
+                    if line.strip():
+                        self._results.append(json.loads(line))
+            logger.info(f"Loaded {len(self._results)} past load test results from {results_file}")
+
+    def start(self, load_test):
+        """
+        Start a load test in the background
+
+        Raises:
+            RuntimeError: If another load test is still running
+        """
+        with self._lock:
+            if self.current is not None and not self.current.done:
+                raise RuntimeError(f"Load test {self.current.run_id} is still running")
+            self.current = load_test
+        threading.Thread(target=self._run, args=(load_test,), name="load-test-runner", daemon=True).start()
+
+    def _run(self, load_test):
+        load_test.run()
+        summary = load_test.summary()
+        with self._lock:
+            self._results.append(summary)
+        if self.results_file:
+            try:
+                with open(self.results_file, "a") as f:
+                    f.write(json.dumps(summary) + "\n")
+            except OSError as e:
+                logger.error(f"Could not save load test results to {self.results_file}: {str(e)}")
+
+    def get(self, run_id):
+        """The running load test with this ID, or None"""
+        current = self.current
+        return current if current is not None and current.run_id == run_id else None
+
+    def result(self, run_id):
+        with self._lock:
+            for summary in self._results:
+                if summary["run_id"] == run_id:
+                    return summary
+        return None
+
+    def results(self):
+        with self._lock:
+            return list(self._results)
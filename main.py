@@ -1,12 +1,17 @@
 import os
 import logging
-import subprocess
+import random
 import signal
 import sys
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify, render_template, Response
 import requests
 import json
+from load_tester import LoadTest, LoadTestRunner
+from supervisor import Stage, Supervisor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -22,76 +27,136 @@ SERVICE_INFO = {
     "data_ingestion": {
         "url": "http://0.0.0.0:8000",
         "health_endpoint": "/health",
+        "ready_endpoint": "/readyz",
         "description": "Receives data and forwards it to preprocessing"
     },
     "preprocessing": {
         "url": "http://0.0.0.0:8001",
         "health_endpoint": "/health",
+        "ready_endpoint": "/readyz",
         "description": "Prepares data for inference"
     },
     "inference": {
         "url": "http://0.0.0.0:8002",
         "health_endpoint": "/health",
+        "ready_endpoint": "/readyz",
         "description": "Makes predictions using the ML model"
     },
     "postprocessing": {
         "url": "http://0.0.0.0:8003",
         "health_endpoint": "/health",
+        "ready_endpoint": "/readyz",
         "description": "Processes and formats prediction results"
     }
 }
 
-# Microservice processes
-service_processes = {}
+# "split" runs one process per stage, "fused" serves the whole pipeline from
+# the data ingestion process
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "split").lower()
+FUSED_STAGES = ["preprocessing", "inference", "postprocessing"]
+
+# Seconds start_services waits for every service to report ready
+SERVICE_STARTUP_TIMEOUT = float(os.environ.get("SERVICE_STARTUP_TIMEOUT", "120"))
+
+# The process-backed stages, each run as one or more replicas (see supervisor.py).
+# Jobs live in the first data ingestion replica, which alone runs job workers.
+supervisor = Supervisor([
+    Stage("data_ingestion", "data_ingestion", 8000, 0, env={"PIPELINE_MODE": PIPELINE_MODE},
+          follower_env={"JOBS_WORKERS": "0"}, pinned_prefixes=("/jobs",))
+] + ([] if PIPELINE_MODE == "fused" else [
+    Stage("preprocessing", "preprocessing", 8001, 1),
+    Stage("inference", "inference", 8002, 2),
+    Stage("postprocessing", "postprocessing", 8003, 3)
+]))
+
+# Seconds between background health checks, and number of checks kept per service
+HEALTH_POLL_INTERVAL = float(os.environ.get("HEALTH_POLL_INTERVAL", "5"))
+HEALTH_HISTORY_SIZE = int(os.environ.get("HEALTH_HISTORY_SIZE", "20"))
+
+# Load tests run from the dashboard: upper bounds on a run, and where past results are kept
+LOAD_TEST_MAX_CONCURRENCY = int(os.environ.get("LOAD_TEST_MAX_CONCURRENCY", "64"))
+LOAD_TEST_MAX_DURATION = float(os.environ.get("LOAD_TEST_MAX_DURATION", "300"))
+LOAD_TEST_MAX_BATCH_SIZE = int(os.environ.get("LOAD_TEST_MAX_BATCH_SIZE", "1000"))
+LOAD_TEST_HISTORY_SIZE = int(os.environ.get("LOAD_TEST_HISTORY_SIZE", "50"))
+LOAD_TEST_RESULTS_FILE = os.environ.get("LOAD_TEST_RESULTS_FILE", "load_test_results.jsonl")
+
+load_test_runner = LoadTestRunner(LOAD_TEST_HISTORY_SIZE, LOAD_TEST_RESULTS_FILE or None)
+
+# Number of recent traces kept by the in-memory span collector
+TRACE_COLLECTOR_MAX_TRACES = int(os.environ.get("TRACE_COLLECTOR_MAX_TRACES", "1000"))
+
+class TraceCollector:
+    """
+    In-memory store of the spans exported by the services, grouped by trace
+
+    Only the most recent ``max_traces`` traces are kept; older ones are
+    dropped as new traces arrive.
+    """
+
+    def __init__(self, max_traces=1000):
+        self.max_traces = max_traces
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, spans):
+        with self._lock:
+            for span in spans:
+                trace = self._traces.get(span["trace_id"])
+                if trace is None:
+                    trace = self._traces[span["trace_id"]] = []
+                trace.append(span)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id):
+        with self._lock:
+            spans = list(self._traces.get(trace_id, []))
+        return sorted(spans, key=lambda span: span["start"])
+
+    @staticmethod
+    def summarize(trace_id, spans):
+        span_ids = {span["span_id"] for span in spans}
+        # The root is the earliest span whose parent was not collected
+        roots = [span for span in spans if span["parent_id"] not in span_ids] or spans
+        root = min(roots, key=lambda span: span["start"])
+        start = min(span["start"] for span in spans)
+        end = max(span["end"] for span in spans)
+        return {
+            "trace_id": trace_id,
+            "root": f"{root['service']} {root['name']}",
+            "start": start,
+            "duration_ms": (end - start) * 1000,
+            "spans": len(spans),
+            "services": sorted({span["service"] for span in spans})
+        }
+
+    def slowest(self, limit=20):
+        """Summaries of the slowest recent traces, slowest first"""
+        with self._lock:
+            traces = [(trace_id, list(spans)) for trace_id, spans in self._traces.items()]
+        summaries = [self.summarize(trace_id, spans) for trace_id, spans in traces]
+        summaries.sort(key=lambda summary: summary["duration_ms"], reverse=True)
+        return summaries[:limit]
+
+trace_collector = TraceCollector(TRACE_COLLECTOR_MAX_TRACES)
 
 def start_services():
-    """Start all microservices as background processes"""
+    """Start the replicas of all microservices as background processes and wait until they are ready"""
     try:
-        # Data Ingestion Service
-        logger.info("Starting Data Ingestion Service...")
-        service_processes["data_ingestion"] = subprocess.Popen(
-            ["python", "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000"],
-            cwd="data_ingestion"
-        )
+        if PIPELINE_MODE == "fused":
+            logger.info("Running in fused mode, the remaining stages are served in-process")
+        supervisor.start()
         
-        # Preprocessing Service
-        logger.info("Starting Preprocessing Service...")
-        service_processes["preprocessing"] = subprocess.Popen(
-            ["python", "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8001"],
-            cwd="preprocessing"
-        )
-        
-        # Inference Service
-        logger.info("Starting Inference Service...")
-        service_processes["inference"] = subprocess.Popen(
-            ["python", "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8002"],
-            cwd="inference"
-        )
-        
-        # Postprocessing Service
-        logger.info("Starting Postprocessing Service...")
-        service_processes["postprocessing"] = subprocess.Popen(
-            ["python", "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8003"],
-            cwd="postprocessing"
-        )
-        
-        # Give services time to start
-        logger.info("Waiting for services to start...")
-        time.sleep(5)
+        # Wait until every service has loaded and warmed up
+        logger.info("Waiting for services to become ready...")
+        supervisor.wait_until_ready(SERVICE_STARTUP_TIMEOUT)
         
     except Exception as e:
         logger.error(f"Error starting services: {str(e)}")
 
 def stop_services():
     """Stop all microservices"""
-    for service_name, process in service_processes.items():
-        logger.info(f"Stopping {service_name} service...")
-        process.terminate()
-        try:
-            process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            logger.warning(f"{service_name} service did not terminate gracefully, killing...")
-            process.kill()
+    supervisor.stop()
 
 def check_service_health(service_name):
     """Check the health of a microservice"""
@@ -99,17 +164,133 @@ def check_service_health(service_name):
     if not service:
         return {"status": "unknown", "error": "Service not found"}
     
+    if PIPELINE_MODE == "fused" and service_name in FUSED_STAGES:
+        # Fused stages share the data ingestion process
+        health = check_service_health("data_ingestion")
+        health["fused_into"] = "data_ingestion"
+        return health
+    
+    start_time = time.perf_counter()
     try:
         health_url = f"{service['url']}{service['health_endpoint']}"
         response = requests.get(health_url, timeout=2)
         
         if response.status_code == 200:
-            return {"status": "healthy", "details": response.json()}
+            details = response.json()
+            # State of the service's circuit breakers, one per downstream service it calls
+            health = {"status": "healthy", "circuit_breakers": details.pop("circuit_breakers", {}),
+                      "details": details}
         else:
-            return {"status": "unhealthy", "error": f"Received status code {response.status_code}"}
+            health = {"status": "unhealthy", "error": f"Received status code {response.status_code}"}
             
     except requests.RequestException as e:
-        return {"status": "unhealthy", "error": str(e)}
+        health = {"status": "unhealthy", "error": str(e)}
+    
+    health["latency_ms"] = (time.perf_counter() - start_time) * 1000
+    return health
+
+def breaker_states(health):
+    """State of each circuit breaker in a service's health, by downstream service"""
+    return {name: breaker["state"] for name, breaker in health.get("circuit_breakers", {}).items()}
+
+def replica_loads(health):
+    """
+    Status and outstanding requests of each replica in a service's health
+
+    The ever-growing request counts are left out, or any traffic would
+    count as a change on every poll.
+    """
+    replicas = (health.get("replicas") or {}).get("replicas", [])
+    return [(replica["index"], replica["status"], replica["outstanding"]) for replica in replicas]
+
+class HealthPoller:
+    """
+    Checks every service concurrently on an interval and caches the results
+
+    Each service's entry holds its latest health, when it was checked, when
+    its status last changed and the status and latency of its recent checks.
+    ``version`` is bumped whenever a service's status, the state of one of
+    its circuit breakers, or the status or outstanding requests of one of
+    its replicas changes, which wakes up the clients waiting in
+    ``wait_for_change``.
+    """
+
+    def __init__(self, service_names, interval=5.0, history_size=20):
+        self.service_names = list(service_names)
+        self.interval = interval
+        self.version = 0
+        self._status = {}
+        self._history = {name: deque(maxlen=history_size) for name in self.service_names}
+        self._changed = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.service_names),
+                                            thread_name_prefix="health-check")
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Run a first check and start polling in the background, once"""
+        with self._start_lock:
+            if self._thread is None:
+                self.poll()
+                self._thread = threading.Thread(target=self._run, name="health-poller", daemon=True)
+                self._thread.start()
+                logger.info(f"Polling service health every {self.interval:g}s")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error polling service health: {str(e)}")
+
+    def poll(self):
+        """Check all services at once, taking as long as the slowest check"""
+        results = dict(zip(self.service_names, self._executor.map(check_service_health, self.service_names)))
+        replicas = supervisor.snapshot() if supervisor.started else {}
+        for service_name, health in results.items():
+            health["replicas"] = replicas.get(service_name)
+        now = time.time()
+        
+        with self._changed:
+            changed = False
+            for service_name, health in results.items():
+                previous = self._status.get(service_name)
+                if previous is None or previous["status"] != health["status"]:
+                    changed = True
+                    last_change = now
+                else:
+                    last_change = previous["last_change"]
+                    if (breaker_states(previous) != breaker_states(health)
+                            or replica_loads(previous) != replica_loads(health)):
+                        changed = True
+                
+                history = self._history[service_name]
+                history.append({"checked_at": now, "status": health["status"], "latency_ms": health["latency_ms"]})
+                self._status[service_name] = {**health, "checked_at": now, "last_change": last_change,
+                                              "history": list(history)}
+            
+            if changed:
+                self.version += 1
+                self._changed.notify_all()
+
+    def snapshot(self):
+        with self._changed:
+            return self.version, dict(self._status)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the version differs from ``version`` or ``timeout`` passes"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+health_poller = HealthPoller(SERVICE_INFO, HEALTH_POLL_INTERVAL, HEALTH_HISTORY_SIZE)
+
+def services_status(health):
+    return {
+        service_name: {"info": SERVICE_INFO[service_name], "health": health[service_name]}
+        for service_name in SERVICE_INFO
+    }
 
 @app.route("/")
 def get_dashboard():
@@ -118,16 +299,30 @@ def get_dashboard():
 
 @app.route("/api/services")
 def get_services():
-    """Get information about all services"""
-    services_status = {}
+    """Get information about all services, from the latest background health check"""
+    health_poller.start()
+    _, health = health_poller.snapshot()
+    return jsonify(services_status(health))
+
+@app.route("/api/services/stream")
+def stream_services():
+    """Stream the status of all services as server-sent events, sent again whenever a status changes"""
+    health_poller.start()
     
-    for service_name in SERVICE_INFO:
-        services_status[service_name] = {
-            "info": SERVICE_INFO[service_name],
-            "health": check_service_health(service_name)
-        }
+    def generate():
+        sent_version = None
+        while True:
+            version, health = health_poller.snapshot()
+            if version != sent_version:
+                sent_version = version
+                yield f"data: {json.dumps(services_status(health))}\n\n"
+            else:
+                # Comment line keeping idle connections open through proxies
+                yield ": keep-alive\n\n"
+            health_poller.wait_for_change(sent_version, timeout=15)
     
-    return jsonify(services_status)
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/test-inference", methods=["POST"])
 def test_inference():
@@ -141,7 +336,6 @@ def test_inference():
         
     if features is None or not isinstance(features, list):
         # Generate random features if none provided
-        import random
         features = [random.uniform(0, 1) for _ in range(4)]
     
     data = {
@@ -152,17 +346,122 @@ def test_inference():
         }
     }
     
+    # Dashboard test requests are always traced, whatever the services' sampling rate
+    traceparent = f"00-{random.getrandbits(128):032x}-{random.getrandbits(64):016x}-01"
+    
     try:
-        response = requests.post(f"{SERVICE_INFO['data_ingestion']['url']}/ingest", json=data, timeout=5)
+        response = requests.post(f"{SERVICE_INFO['data_ingestion']['url']}/ingest", json=data, timeout=5,
+                                 headers={"traceparent": traceparent})
         
         if response.status_code == 200:
-            return jsonify(response.json())
+            return jsonify({**response.json(), "trace_id": response.headers.get("x-trace-id")})
         else:
             return jsonify({"error": f"Error from ingestion service: {response.text}"}), response.status_code
             
     except requests.RequestException as e:
         return jsonify({"error": f"Error connecting to ingestion service: {str(e)}"}), 503
 
+@app.route("/api/load-tests", methods=["POST"])
+def start_load_test():
+    """Start a load test against the ingestion service"""
+    params = request.get_json(silent=True) or {}
+    
+    try:
+        concurrency = int(params.get("concurrency", 8))
+        duration = float(params.get("duration", 30))
+        batch_size = int(params.get("batch_size", 1))
+        num_features = int(params.get("num_features", 4))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid load test parameters: {str(e)}"}), 400
+    
+    if not 1 <= concurrency <= LOAD_TEST_MAX_CONCURRENCY:
+        return jsonify({"error": f"concurrency must be between 1 and {LOAD_TEST_MAX_CONCURRENCY}"}), 400
+    if not 0 < duration <= LOAD_TEST_MAX_DURATION:
+        return jsonify({"error": f"duration must be between 0 and {LOAD_TEST_MAX_DURATION:g} seconds"}), 400
+    if not 1 <= batch_size <= LOAD_TEST_MAX_BATCH_SIZE:
+        return jsonify({"error": f"batch_size must be between 1 and {LOAD_TEST_MAX_BATCH_SIZE}"}), 400
+    if num_features < 1:
+        return jsonify({"error": "num_features must be at least 1"}), 400
+    
+    load_test = LoadTest(SERVICE_INFO["data_ingestion"]["url"], concurrency, duration,
+                         batch_size=batch_size, num_features=num_features, label=params.get("label"))
+    try:
+        load_test_runner.start(load_test)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    
+    return jsonify({"run_id": load_test.run_id, "label": load_test.label}), 202
+
+@app.route("/api/load-tests")
+def get_load_tests():
+    """Get the summaries of past load tests and the progress of the running one"""
+    current = load_test_runner.current
+    return jsonify({
+        "running": current.live() if current is not None and not current.done else None,
+        "results": load_test_runner.results()
+    })
+
+@app.route("/api/load-tests/<run_id>/stop", methods=["POST"])
+def stop_load_test(run_id):
+    """Stop a running load test early, keeping its results so far"""
+    load_test = load_test_runner.get(run_id)
+    if load_test is None or load_test.done:
+        return jsonify({"error": "Load test not running"}), 404
+    
+    load_test.stop()
+    return jsonify({"run_id": run_id, "state": "stopping"})
+
+@app.route("/api/load-tests/<run_id>/stream")
+def stream_load_test(run_id):
+    """Stream live throughput and latency percentiles of a load test as server-sent events"""
+    load_test = load_test_runner.get(run_id)
+    if load_test is None:
+        summary = load_test_runner.result(run_id)
+        if summary is None:
+            return jsonify({"error": "Load test not found"}), 404
+        return Response(f"event: done\ndata: {json.dumps(summary)}\n\n", mimetype="text/event-stream")
+    
+    def generate():
+        while not load_test.done:
+            yield f"data: {json.dumps(load_test.live())}\n\n"
+            time.sleep(1)
+        # The summary is stored right after the run finishes
+        summary = load_test_runner.result(run_id)
+        while summary is None:
+            time.sleep(0.1)
+            summary = load_test_runner.result(run_id)
+        yield f"event: done\ndata: {json.dumps(summary)}\n\n"
+    
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/traces/spans", methods=["POST"])
+def collect_spans():
+    """Receive a batch of finished spans from a service"""
+    spans = request.get_json(silent=True)
+    if not isinstance(spans, list):
+        return jsonify({"error": "Expected a JSON list of spans"}), 400
+    
+    required = ("trace_id", "span_id", "parent_id", "service", "name", "start", "end")
+    spans = [span for span in spans if isinstance(span, dict) and all(key in span for key in required)]
+    trace_collector.add(spans)
+    return jsonify({"accepted": len(spans)})
+
+@app.route("/api/traces")
+def get_slowest_traces():
+    """Get the slowest of the recently collected traces"""
+    limit = request.args.get("limit", default=20, type=int)
+    return jsonify(trace_collector.slowest(limit))
+
+@app.route("/api/traces/<trace_id>")
+def get_trace(trace_id):
+    """Get the spans of one trace, ordered by start time"""
+    spans = trace_collector.get(trace_id)
+    if not spans:
+        return jsonify({"error": "Trace not found"}), 404
+    
+    return jsonify({**TraceCollector.summarize(trace_id, spans), "spans": spans})
+
 def signal_handler(sig, frame):
     """Handle Ctrl+C to gracefully shut down services"""
     logger.info("Shutting down services...")
@@ -176,5 +475,6 @@ if __name__ == "__main__":
     # Start the microservices
     start_services()
     
-    # Run the application on port 5000
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Run the application on port 5000. The reloader would run this script
+    # again in a child process, starting a second set of replicas.
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
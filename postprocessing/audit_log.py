@@ -0,0 +1,457 @@
+"""
+Write-behind audit log of the predictions served by the pipeline
+
+Every postprocessed prediction is recorded with the features the model
+was given, its preprocessing_info, metadata, prediction, confidence and
+timestamp. Requests only append to a bounded in-memory queue; a
+background task writes the queue to the database in bulk, up to
+AUDIT_LOG_BATCH_SIZE rows per transaction (a multi-row INSERT on
+PostgreSQL), at least every AUDIT_LOG_FLUSH_INTERVAL_MS, so the database
+never sits on the request path.
+
+AUDIT_LOG_DB_URL picks the database: ``sqlite:///<path>`` (the default, a
+file next to this module) or ``postgresql://...`` (requires psycopg2).
+
+When the database falls behind and the queue is full, AUDIT_LOG_OVERFLOW
+decides what gives:
+
+- ``drop_newest``: new records are dropped and counted
+- ``drop_oldest``: the oldest queued records are dropped to make room
+- ``block``: requests wait up to AUDIT_LOG_BLOCK_TIMEOUT_MS for room before
+  being computed, then get a 503, so records are never dropped silently
+  (the inference service answers with the raw prediction then, as for any
+  postprocessing error)
+
+A failed write is retried with a growing delay; records that keep coming
+in meanwhile, and the failed batch put back in the queue, are subject to
+the overflow policy.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from fastapi import HTTPException
+
+from shared import deadline
+from shared.metrics import Counter, Gauge
+from shared.tracing import current_trace_id
+
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:  # Only needed for PostgreSQL audit databases
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_LOG_ENABLED = os.getenv("AUDIT_LOG_ENABLED", "true").lower() == "true"
+AUDIT_LOG_DB_URL = os.getenv("AUDIT_LOG_DB_URL", "sqlite:///" + os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "predictions.db"))
+# Records held in memory while waiting to be written
+AUDIT_LOG_MAX_QUEUE = int(os.getenv("AUDIT_LOG_MAX_QUEUE", "10000"))
+# Rows per insert, and longest time a record waits for a batch to fill up
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "500"))
+AUDIT_LOG_FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL_MS", "1000"))
+# What happens to records arriving while the queue is full: drop_newest, drop_oldest or block
+AUDIT_LOG_OVERFLOW = os.getenv("AUDIT_LOG_OVERFLOW", "drop_newest").lower()
+AUDIT_LOG_BLOCK_TIMEOUT_MS = float(os.getenv("AUDIT_LOG_BLOCK_TIMEOUT_MS", "100"))
+# Delay before retrying a failed write, doubled up to 30s while writes keep failing
+AUDIT_LOG_RETRY_DELAY = float(os.getenv("AUDIT_LOG_RETRY_DELAY", "1.0"))
+# Most predictions returned by one query
+AUDIT_LOG_QUERY_MAX_LIMIT = int(os.getenv("AUDIT_LOG_QUERY_MAX_LIMIT", "1000"))
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+_COLUMNS = ("recorded_at", "trace_id", "features", "metadata", "preprocessing_info", "prediction",
+            "confidence", "timestamp")
+# Columns holding JSON documents
+_JSON_COLUMNS = ("features", "metadata", "preprocessing_info", "prediction")
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at REAL NOT NULL,
+    trace_id TEXT,
+    features TEXT,
+    metadata TEXT,
+    preprocessing_info TEXT,
+    prediction TEXT NOT NULL,
+    confidence REAL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_recorded_at ON predictions (recorded_at);
+"""
+
+_POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id BIGSERIAL PRIMARY KEY,
+    recorded_at DOUBLE PRECISION NOT NULL,
+    trace_id TEXT,
+    features JSONB,
+    metadata JSONB,
+    preprocessing_info JSONB,
+    prediction JSONB NOT NULL,
+    confidence DOUBLE PRECISION,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_recorded_at ON predictions (recorded_at);
+"""
+
+
+def _json_default(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _to_row(record):
+    """Database row of a queued record, serialized in the writer's thread"""
+    return tuple(json.dumps(value, default=_json_default) if name in _JSON_COLUMNS and value is not None
+                 else value for name, value in zip(_COLUMNS, record))
+
+
+class SQLiteSink:
+    """
+    SQLite audit database
+
+    One connection is shared by the writer and the queries, serialized by
+    a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SQLITE_SCHEMA)
+        self._lock = threading.Lock()
+
+    def write(self, records):
+        rows = [_to_row(record) for record in records]
+        with self._lock, self._db:
+            self._db.executemany(f"INSERT INTO predictions ({', '.join(_COLUMNS)}) "
+                                 f"VALUES ({', '.join('?' for _ in _COLUMNS)})", rows)
+
+    def recent(self, limit, before_id=None):
+        query = f"SELECT id, {', '.join(_COLUMNS)} FROM predictions"
+        params = ()
+        if before_id is not None:
+            query += " WHERE id < ?"
+            params = (before_id,)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        predictions = []
+        for row in rows:
+            prediction = dict(zip(("id",) + _COLUMNS, row))
+            for name in _JSON_COLUMNS:
+                if prediction[name] is not None:
+                    prediction[name] = json.loads(prediction[name])
+            predictions.append(prediction)
+        return predictions
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class PostgresSink:
+    """PostgreSQL audit database, written with multi-row inserts"""
+
+    def __init__(self, url):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for a PostgreSQL audit database")
+        self.url = url
+        self._db = psycopg2.connect(url)
+        self._lock = threading.Lock()
+        with self._db, self._db.cursor() as cursor:
+            cursor.execute(_POSTGRES_SCHEMA)
+
+    def _connection(self):
+        # Reconnects after the server closed the connection
+        if self._db.closed:
+            self._db = psycopg2.connect(self.url)
+        return self._db
+
+    def write(self, records):
+        rows = [_to_row(record) for record in records]
+        with self._lock, self._connection() as db, db.cursor() as cursor:
+            psycopg2.extras.execute_values(
+                cursor, f"INSERT INTO predictions ({', '.join(_COLUMNS)}) VALUES %s", rows, page_size=len(rows))
+
+    def recent(self, limit, before_id=None):
+        query = f"SELECT id, {', '.join(_COLUMNS)} FROM predictions"
+        params = ()
+        if before_id is not None:
+            query += " WHERE id < %s"
+            params = (before_id,)
+        with self._lock, self._connection() as db, db.cursor() as cursor:
+            cursor.execute(query + " ORDER BY id DESC LIMIT %s", params + (limit,))
+            rows = cursor.fetchall()
+        # JSONB columns come back decoded
+        return [dict(zip(("id",) + _COLUMNS, row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_sink(url):
+    """Opens the audit database at ``url``"""
+    if url.startswith("sqlite:///"):
+        return SQLiteSink(url[len("sqlite:///"):])
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresSink(url)
+    raise ValueError(f"Unsupported audit database URL: {url}")
+
+
+def prediction_record(result, features=None):
+    """Queued record of one postprocessed result, a ProcessedResultData dict"""
+    confidence = result["postprocessing_info"].get("confidence")
+    return (time.time(), current_trace_id(), features, result.get("metadata"), result.get("preprocessing_info"),
+            result["prediction"], float(confidence) if confidence is not None else None, result["timestamp"])
+
+
+def batch_records(batch_result, features=None):
+    """Queued records of the rows of a postprocess_batch result that have a prediction"""
+    return [prediction_record(result, features[i] if features is not None else None)
+            for i, result in enumerate(batch_result["results"]) if "error" not in result]
+
+
+class AuditLog:
+    """
+    Bounded queue of prediction records and the task writing them to the database
+
+    Meant to be used from a single event loop; only the database calls run
+    in worker threads.
+
+    Args:
+        sink: SQLiteSink or PostgresSink the records are written to
+        service (str): Name of the service, for the metrics
+        max_queue (int): Records held in memory at most
+        batch_size (int): Rows written per insert
+        flush_interval (float): Seconds a record waits at most for a batch to fill up
+        overflow (str): Policy applied while the queue is full, see OVERFLOW_POLICIES
+        block_timeout (float): Seconds a request waits for room under the ``block`` policy
+        registry (MetricsRegistry): Where the audit log metrics are exported, if given
+    """
+
+    def __init__(self, sink, service, max_queue=AUDIT_LOG_MAX_QUEUE, batch_size=AUDIT_LOG_BATCH_SIZE,
+                 flush_interval=AUDIT_LOG_FLUSH_INTERVAL_MS / 1000, overflow=AUDIT_LOG_OVERFLOW,
+                 block_timeout=AUDIT_LOG_BLOCK_TIMEOUT_MS / 1000, registry=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown audit log overflow policy: {overflow}")
+        self.sink = sink
+        self.service = service
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.write_errors = 0
+        self.last_error = None
+        self._queue = deque()
+        self._batch_ready = None
+        self._room = None
+        self._task = None
+        # Batch being written when the writer was stopped, and its write
+        self._pending = None
+        self._records = None
+        self._queue_depth = None
+        if registry is not None:
+            self._records = Counter("pipeline_audit_records_total",
+                                    "Prediction records by outcome: written, dropped or rejected",
+                                    ("service", "outcome"))
+            self._queue_depth = Gauge("pipeline_audit_queue_depth", "Prediction records waiting to be written",
+                                      ("service",))
+            registry.add(self._records, self._queue_depth)
+
+    @classmethod
+    def from_env(cls, service, registry=None):
+        """The audit log configured by the AUDIT_LOG_* variables, or None if disabled"""
+        if not AUDIT_LOG_ENABLED:
+            logger.info("Prediction audit log disabled")
+            return None
+        return cls(open_sink(AUDIT_LOG_DB_URL), service, registry=registry)
+
+    async def start(self):
+        self._batch_ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Prediction audit log started (overflow={self.overflow}, batch_size={self.batch_size}, "
+                    f"max_queue={self.max_queue})")
+
+    async def stop(self):
+        """Stops the writer and writes what is still queued, in one last attempt"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pending is not None:
+            batch, write = self._pending
+            self._pending = None
+            try:
+                await write
+                self.batches += 1
+                self._count("written", len(batch))
+            except Exception:
+                # Tried once more below with the rest of the queue
+                self._requeue(batch)
+        while self._queue:
+            batch = self._take_batch()
+            try:
+                await asyncio.to_thread(self.sink.write, batch)
+                self._count("written", len(batch))
+            except Exception as e:
+                self._count("dropped", len(batch) + len(self._queue))
+                logger.error(f"Dropped {len(batch) + len(self._queue)} prediction records on shutdown: {str(e)}")
+                self._queue.clear()
+        await asyncio.to_thread(self.sink.close)
+
+    def _count(self, outcome, amount):
+        if outcome == "written":
+            self.written += amount
+        elif outcome == "dropped":
+            self.dropped += amount
+        else:
+            self.rejected += amount
+        if self._records is not None:
+            self._records.inc(self.service, outcome, amount=amount)
+        if self._queue_depth is not None:
+            self._queue_depth.set(len(self._queue), self.service)
+
+    async def reserve(self, rows):
+        """
+        Waits for room for ``rows`` records under the ``block`` policy, before the request's work is done
+
+        Raises:
+            HTTPException: 503 if no room freed up within the block timeout or the request's deadline
+        """
+        if self.overflow != "block" or len(self._queue) + rows <= self.max_queue:
+            return
+        wait = self.block_timeout
+        if deadline.remaining() is not None:
+            wait = min(wait, deadline.remaining())
+        end = time.monotonic() + wait
+        while len(self._queue) + rows > self.max_queue:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                self._count("rejected", rows)
+                raise HTTPException(status_code=503, detail="Prediction audit log is full",
+                                    headers={"Retry-After": "1"})
+            self._room.clear()
+            try:
+                await asyncio.wait_for(self._room.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def record(self, records):
+        """Queues prediction records without waiting, applying the overflow policy if the queue is full"""
+        overflow = len(self._queue) + len(records) - self.max_queue
+        if overflow > 0:
+            if self.overflow == "drop_oldest":
+                dropped = min(overflow, len(self._queue))
+                for _ in range(dropped):
+                    self._queue.popleft()
+                kept = records[-self.max_queue:]
+                dropped += len(records) - len(kept)
+            else:
+                # drop_newest, or block when the room reserved was taken in the meantime
+                kept = records[:max(0, len(records) - overflow)]
+                dropped = len(records) - len(kept)
+            records = kept
+            self._count("dropped", dropped)
+        self._queue.extend(records)
+        if self._queue_depth is not None:
+            self._queue_depth.set(len(self._queue), self.service)
+        if len(self._queue) >= self.batch_size and self._batch_ready is not None:
+            self._batch_ready.set()
+
+    def _requeue(self, batch):
+        """Puts a batch that could not be written back at the head of the queue, applying the overflow policy"""
+        queued = len(self._queue) + len(batch)
+        overflow = queued - self.max_queue
+        if overflow > 0:
+            if self.overflow == "drop_oldest":
+                batch = batch[overflow:]
+            else:
+                # drop_newest, and block, whose requests were given room already
+                for _ in range(min(overflow, len(self._queue))):
+                    self._queue.pop()
+                batch = batch[:max(0, self.max_queue - len(self._queue))]
+        self._queue.extendleft(reversed(batch))
+        dropped = queued - len(self._queue)
+        if dropped:
+            self._count("dropped", dropped)
+        elif self._queue_depth is not None:
+            self._queue_depth.set(len(self._queue), self.service)
+
+    def _take_batch(self):
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if self._room is not None:
+            self._room.set()
+        return batch
+
+    async def _run(self):
+        retry_delay = AUDIT_LOG_RETRY_DELAY
+        while True:
+            if len(self._queue) < self.batch_size:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not self._queue:
+                continue
+
+            batch = self._take_batch()
+            write = asyncio.ensure_future(asyncio.to_thread(self.sink.write, batch))
+            try:
+                # The thread cannot be interrupted, so cancelling the writer
+                # leaves the write running for stop() to wait for
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                self._pending = (batch, write)
+                raise
+            except Exception as e:
+                self.write_errors += 1
+                self.last_error = str(e)
+                logger.error(f"Error writing {len(batch)} prediction records, retrying in {retry_delay:g}s: {str(e)}")
+                # Back at the head of the queue; the overflow policy applies to new records meanwhile
+                self._requeue(batch)
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30.0)
+                continue
+            retry_delay = AUDIT_LOG_RETRY_DELAY
+            self.batches += 1
+            self._count("written", len(batch))
+
+    async def recent(self, limit=50, before_id=None):
+        """Most recently written predictions, newest first, optionally only those older than ``before_id``"""
+        return await asyncio.to_thread(self.sink.recent, max(1, min(limit, AUDIT_LOG_QUERY_MAX_LIMIT)), before_id)
+
+    def stats(self):
+        return {
+            "database": self.sink.__class__.__name__,
+            "overflow": self.overflow,
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "write_errors": self.write_errors,
+            "last_error": self.last_error
+        }
@@ -1,16 +1,26 @@
 import logging
 import os
-from fastapi import FastAPI, HTTPException
+import sys
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import numpy as np
-from datetime import datetime
+
+# Make the helpers shared between services importable when running from the service directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared import wire
+from shared.metrics import install_metrics, phase
+from shared.tracing import install_tracing
+from shared.admission import install_admission
+from shared.deadline import check_deadline, install_deadlines
+from shared.logging_setup import configure_logging
+from shared.startup import install_probes
+import postprocessor
+from audit_log import AuditLog, batch_records, prediction_record
+from postprocessor import PredictionData, PredictionBatch, postprocess, postprocess_batch
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging("postprocessing")
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -27,20 +37,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Define data models
-class PredictionData(BaseModel):
-    prediction: List[float]
-    prediction_probabilities: Optional[List[float]] = None
-    metadata: Optional[Dict[str, Any]] = None
-    preprocessing_info: Optional[Dict[str, Any]] = None
-
-class ProcessedResultData(BaseModel):
-    prediction: List[float]
-    prediction_probabilities: Optional[List[float]] = None
-    metadata: Optional[Dict[str, Any]] = None
-    preprocessing_info: Optional[Dict[str, Any]] = None
-    postprocessing_info: Dict[str, Any]
-    timestamp: str
+# Request counts, in-flight gauges and per-phase latency histograms on /metrics
+metrics = install_metrics(app, "postprocessing")
+
+# Request spans sharing one trace ID across the four services, sampled at TRACE_SAMPLE_RATE
+install_tracing(app, "postprocessing")
+
+# Bounded in-flight requests and queue; excess work is rejected early with 429/503
+admission = install_admission(app, "postprocessing", metrics)
+
+# Deadline of every request, forwarded downstream and capping the downstream timeouts
+install_deadlines(app, "postprocessing", metrics)
+
+# /livez, and /readyz once the service is warmed up
+startup = install_probes(app, "postprocessing", metrics)
+
+# Write-behind record of every prediction, opened on startup (None when AUDIT_LOG_ENABLED=false)
+audit_log = None
+
+@app.on_event("startup")
+async def start_audit_log():
+    global audit_log
+    with startup.phase("audit_log"):
+        audit_log = AuditLog.from_env("postprocessing", metrics)
+        if audit_log is not None:
+            await audit_log.start()
+
+@app.on_event("shutdown")
+async def stop_audit_log():
+    if audit_log is not None:
+        await audit_log.stop()
+
+@app.on_event("startup")
+async def warm_up_service():
+    with startup.phase("warm_up"):
+        postprocessor.warm_up()
+    startup.mark_ready()
 
 @app.get("/")
 def read_root():
@@ -50,55 +82,88 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/audit/stats")
+def audit_stats():
+    """Records queued, written and dropped by the prediction audit log"""
+    if audit_log is None:
+        return {"enabled": False}
+    return {"enabled": True, **audit_log.stats()}
+
+@app.get("/predictions")
+async def recent_predictions(limit: int = 50, before_id: Optional[int] = None):
+    """
+    Most recent predictions in the audit log, newest first
+
+    Pass the smallest ``id`` returned as ``before_id`` to page back in time.
+    Predictions still queued for writing are not returned yet.
+    """
+    if audit_log is None:
+        raise HTTPException(status_code=404, detail="Prediction audit log disabled")
+    predictions = await audit_log.recent(limit, before_id)
+    return {
+        "predictions": predictions,
+        "next_before_id": predictions[-1]["id"] if predictions else None
+    }
+
 @app.post("/postprocess")
 async def postprocess_prediction(data: PredictionData):
     """
     Processes prediction results and applies business logic
     """
-    logger.info(f"Received prediction for postprocessing")
+    logger.info("Received prediction for postprocessing")
+    check_deadline()
+    if audit_log is not None:
+        await audit_log.reserve(1)
     
     try:
-        # Get the prediction
-        prediction = np.array(data.prediction)
+        with phase("compute"):
+            processed_result = postprocess(data).dict()
         
-        # Apply post-processing operations
-        # 1. Apply any business rules or transformations
-        # For example, ensure predictions are in a valid range for your application
-        processed_prediction = np.clip(prediction, 0, 100)  # Clip between 0 and 100
-        
-        # 2. Round to specified decimal places if needed
-        processed_prediction = np.round(processed_prediction, 2)
-        
-        # 3. Add confidence metrics if available
-        confidence = None
-        if data.prediction_probabilities:
-            confidence = np.max(data.prediction_probabilities)
-        
-        # Create processed result object
-        current_time = datetime.now().isoformat()
-        processed_result = ProcessedResultData(
-            prediction=processed_prediction.tolist(),
-            prediction_probabilities=data.prediction_probabilities,
-            metadata=data.metadata,
-            preprocessing_info=data.preprocessing_info,
-            postprocessing_info={
-                "confidence": confidence,
-                "modified": bool(np.any(processed_prediction != prediction)),
-                "original_range": {
-                    "min": float(np.min(prediction)),
-                    "max": float(np.max(prediction))
-                }
-            },
-            timestamp=current_time
-        )
-        
-        logger.info(f"Postprocessing completed successfully")
-        return processed_result.dict()
+        if audit_log is not None:
+            audit_log.record([prediction_record(processed_result, data.features)])
+        logger.info("Postprocessing completed successfully")
+        return processed_result
         
     except Exception as e:
         logger.error(f"Error during postprocessing: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Postprocessing error: {str(e)}")
 
+@app.post("/postprocess/batch")
+async def postprocess_batch_data(request: Request):
+    """
+    Applies the postprocessing rules to a whole batch of predictions
+
+    Returns one result per input row, in order. Rows that failed in an
+    earlier stage carry an ``error`` instead of a prediction. Accepts and
+    replies with JSON (PredictionBatch) or msgpack.
+    """
+    with phase("parse"):
+        # Binary batches from regression models carry no probabilities
+        data, _ = await wire.read_batch(request, PredictionBatch, nullable=("prediction_probabilities",))
+    num_rows = len(data.prediction)
+    logger.info("Received batch of %d predictions for postprocessing", num_rows)
+
+    # Binary batches send no probabilities at all for regression models
+    num_probabilities = len(data.prediction_probabilities) if data.prediction_probabilities is not None else num_rows
+    if not (num_probabilities == len(data.metadata)
+            == len(data.preprocessing_info) == len(data.errors) == num_rows):
+        raise HTTPException(status_code=422, detail="Batch fields must all have the same length")
+    check_deadline()
+    if audit_log is not None:
+        await audit_log.reserve(num_rows)
+
+    try:
+        with phase("compute"):
+            batch_result = postprocess_batch(data)
+        if audit_log is not None:
+            audit_log.record(batch_records(batch_result, getattr(data, "features", None)))
+        logger.info("Batch postprocessing completed successfully")
+        return wire.respond(batch_result, wire.accepts_binary(request))
+
+    except Exception as e:
+        logger.error(f"Error during batch postprocessing: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Postprocessing error: {str(e)}")
+
 if __name__ == "__main__":
     # Run the application
     uvicorn.run("main:app", host="0.0.0.0", port=8003, reload=True)
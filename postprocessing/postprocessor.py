@@ -0,0 +1,164 @@
+import logging
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Define data models
+class PredictionData(BaseModel):
+    prediction: List[float]
+    prediction_probabilities: Optional[List[float]] = None
+    metadata: Optional[Dict[str, Any]] = None
+    preprocessing_info: Optional[Dict[str, Any]] = None
+    # Features the model was given, kept for the audit log only
+    features: Optional[List[float]] = None
+
+class ProcessedResultData(BaseModel):
+    prediction: List[float]
+    prediction_probabilities: Optional[List[float]] = None
+    metadata: Optional[Dict[str, Any]] = None
+    preprocessing_info: Optional[Dict[str, Any]] = None
+    postprocessing_info: Dict[str, Any]
+    timestamp: str
+
+class PredictionBatch(BaseModel):
+    prediction: List[Optional[List[float]]]
+    prediction_probabilities: List[Optional[List[float]]]
+    metadata: List[Optional[Dict[str, Any]]]
+    preprocessing_info: List[Optional[Dict[str, Any]]]
+    errors: List[Optional[str]]
+    features: Optional[List[Optional[List[float]]]] = None
+
+def warm_up():
+    """Runs the postprocessing rules once on a dummy prediction"""
+    postprocess(PredictionData(prediction=[0.0], prediction_probabilities=[0.5, 0.5]))
+
+def postprocess(data):
+    """
+    Applies the postprocessing rules to a single prediction
+
+    Args:
+        data: Object with the fields of PredictionData
+
+    Returns:
+        ProcessedResultData: The final result with postprocessing details
+    """
+    # Get the prediction
+    prediction = np.array(data.prediction)
+
+    # Apply post-processing operations
+    # 1. Apply any business rules or transformations
+    # For example, ensure predictions are in a valid range for your application
+    processed_prediction = np.clip(prediction, 0, 100)  # Clip between 0 and 100
+
+    # 2. Round to specified decimal places if needed
+    processed_prediction = np.round(processed_prediction, 2)
+
+    # 3. Add confidence metrics if available
+    confidence = None
+    if data.prediction_probabilities:
+        confidence = np.max(data.prediction_probabilities)
+
+    # Create processed result object
+    current_time = datetime.now().isoformat()
+    return ProcessedResultData(
+        prediction=processed_prediction.tolist(),
+        prediction_probabilities=data.prediction_probabilities,
+        metadata=data.metadata,
+        preprocessing_info=data.preprocessing_info,
+        postprocessing_info={
+            "confidence": confidence,
+            "modified": bool(np.any(processed_prediction != prediction)),
+            "original_range": {
+                "min": float(np.min(prediction)),
+                "max": float(np.max(prediction))
+            }
+        },
+        timestamp=current_time
+    )
+
+def postprocess_batch(data):
+    """
+    Applies the postprocessing rules to a whole batch of predictions
+
+    Returns one result per input row, in order. Rows that failed in an
+    earlier stage carry an ``error`` instead of a prediction.
+
+    Args:
+        data: Object with the fields of PredictionBatch. ``prediction`` may
+            also be an N x K ndarray and ``prediction_probabilities`` an
+            ndarray or None, as sent over the binary wire format.
+    """
+    num_rows = len(data.prediction)
+    current_time = datetime.now().isoformat()
+    results = [None] * num_rows
+    errors = list(data.errors)
+    all_probabilities = data.prediction_probabilities
+    if all_probabilities is None:
+        all_probabilities = [None] * num_rows
+    elif isinstance(all_probabilities, np.ndarray):
+        all_probabilities = all_probabilities.tolist()
+
+    # Rows are grouped by prediction width so that clipping and rounding run
+    # as a single array operation per group
+    groups = {}
+    if isinstance(data.prediction, np.ndarray):
+        groups[data.prediction.shape[1]] = [i for i in range(num_rows) if errors[i] is None]
+    else:
+        for i in range(num_rows):
+            if errors[i] is None and data.prediction[i] is None:
+                errors[i] = "Missing prediction"
+            elif errors[i] is None:
+                groups.setdefault(len(data.prediction[i]), []).append(i)
+
+    for rows in groups.values():
+        if not rows:
+            continue
+        if isinstance(data.prediction, np.ndarray):
+            prediction = np.asarray(data.prediction, dtype=float)[rows]
+        else:
+            prediction = np.array([data.prediction[i] for i in rows], dtype=float)
+        processed_prediction = np.round(np.clip(prediction, 0, 100), 2)
+        modified = np.any(processed_prediction != prediction, axis=1)
+        original_min = np.min(prediction, axis=1)
+        original_max = np.max(prediction, axis=1)
+
+        for j, i in enumerate(rows):
+            probabilities = all_probabilities[i]
+            confidence = None
+            if probabilities:
+                confidence = np.max(probabilities)
+            results[i] = ProcessedResultData(
+                prediction=processed_prediction[j].tolist(),
+                prediction_probabilities=probabilities,
+                metadata=data.metadata[i],
+                preprocessing_info=data.preprocessing_info[i],
+                postprocessing_info={
+                    "confidence": confidence,
+                    "modified": bool(modified[j]),
+                    "original_range": {
+                        "min": float(original_min[j]),
+                        "max": float(original_max[j])
+                    }
+                },
+                timestamp=current_time
+            ).dict()
+
+    for i in range(num_rows):
+        if results[i] is None:
+            results[i] = {
+                "error": errors[i],
+                "metadata": data.metadata[i],
+                "timestamp": current_time
+            }
+
+    failed = sum(1 for error in errors if error is not None)
+    return {
+        "results": results,
+        "count": num_rows,
+        "succeeded": num_rows - failed,
+        "failed": failed
+    }
@@ -0,0 +1,167 @@
+"""
+Per-feature preprocessing statistics fitted offline and optionally updated online
+
+The artifact holds, for every feature, the mean and std used to
+standardize it, the value replacing a missing entry and the bounds values
+are clipped to. It is a small JSON file written by fit_stats.py.
+
+In online mode the means and stds keep being updated from the rows the
+service preprocesses. Only a count, mean and sum of squared deviations are
+kept per feature, so memory stays constant however much traffic is seen.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILL_STRATEGIES = ("mean", "median")
+
+
+class FeatureStats:
+    """
+    Standardizes rows with per-feature statistics
+
+    Args:
+        count (array): Non-missing values seen per feature
+        mean (array): Mean per feature
+        std (array): Standard deviation per feature
+        fill (array): Value replacing a missing entry, per feature
+        clip_min (array): Lower bound per feature, applied before standardizing
+        clip_max (array): Upper bound per feature
+        fill_strategy (str): "mean" makes ``fill`` follow the mean in online updates
+        fitted_at (float): Time the statistics were fitted
+        source (str): Dataset they were fitted on
+    """
+
+    def __init__(self, count, mean, std, fill, clip_min, clip_max, fill_strategy="mean",
+                 fitted_at=None, source=None):
+        self.count = np.asarray(count, dtype=np.int64)
+        self.mean = np.asarray(mean, dtype=float)
+        # Sum of squared deviations, from which online updates are merged
+        self.m2 = np.asarray(std, dtype=float) ** 2 * self.count
+        self.fill = np.asarray(fill, dtype=float)
+        self.clip_min = np.asarray(clip_min, dtype=float)
+        self.clip_max = np.asarray(clip_max, dtype=float)
+        self.fill_strategy = fill_strategy
+        self.fitted_at = fitted_at
+        self.source = source
+        self.updated_rows = 0
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @property
+    def num_features(self):
+        return len(self.mean)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / np.maximum(self.count, 1))
+
+    def _refresh(self):
+        std = self.std
+        self.scale = np.where(std > 0, std, 1.0)
+
+    @classmethod
+    def empty(cls, num_features):
+        """Statistics to be learned online: no clipping, missing values filled with 0"""
+        zeros = np.zeros(num_features)
+        return cls(zeros, zeros, zeros, zeros, np.full(num_features, -np.inf), np.full(num_features, np.inf))
+
+    @classmethod
+    def fit(cls, matrix, clip_quantile=0.001, fill_strategy="mean", source=None):
+        """
+        Fits the statistics on an N x F matrix, NaN marking missing values
+
+        Clip bounds are the ``clip_quantile`` and ``1 - clip_quantile``
+        quantiles of each feature.
+        """
+        if fill_strategy not in FILL_STRATEGIES:
+            raise ValueError(f"Unknown fill strategy {fill_strategy!r}, expected one of {', '.join(FILL_STRATEGIES)}")
+        matrix = np.asarray(matrix, dtype=float)
+        count = (~np.isnan(matrix)).sum(axis=0)
+        if (count == 0).any():
+            raise ValueError(f"Features {np.flatnonzero(count == 0).tolist()} have no values")
+        mean = np.nanmean(matrix, axis=0)
+        fill = mean if fill_strategy == "mean" else np.nanmedian(matrix, axis=0)
+        return cls(count, mean, np.nanstd(matrix, axis=0), fill,
+                   np.nanquantile(matrix, clip_quantile, axis=0), np.nanquantile(matrix, 1 - clip_quantile, axis=0),
+                   fill_strategy=fill_strategy, fitted_at=time.time(), source=source)
+
+    def transform(self, matrix):
+        """
+        Standardizes an N x F matrix in one pass
+
+        Returns:
+            tuple: (standardized matrix, mask of the rows that had missing values replaced)
+        """
+        missing = np.isnan(matrix)
+        replaced_missing = missing.any(axis=1)
+        if replaced_missing.any():
+            matrix = np.where(missing, self.fill, matrix)
+        return (np.clip(matrix, self.clip_min, self.clip_max) - self.mean) / self.scale, replaced_missing
+
+    def update(self, matrix):
+        """Merges the non-missing values of an N x F matrix into the means and stds"""
+        present = ~np.isnan(matrix)
+        batch_count = present.sum(axis=0)
+        if not batch_count.any():
+            return
+        values = np.where(present, matrix, 0.0)
+        batch_mean = values.sum(axis=0) / np.maximum(batch_count, 1)
+        batch_m2 = (np.where(present, matrix - batch_mean, 0.0) ** 2).sum(axis=0)
+
+        with self._lock:
+            # Chan et al.'s parallel variance update
+            total = self.count + batch_count
+            delta = batch_mean - self.mean
+            safe_total = np.maximum(total, 1)
+            self.mean = self.mean + delta * batch_count / safe_total
+            self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / safe_total
+            self.count = total
+            if self.fill_strategy == "mean":
+                self.fill = self.mean
+            self.updated_rows += len(matrix)
+            self._refresh()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "num_features": self.num_features,
+                "count": self.count.tolist(),
+                "mean": self.mean.tolist(),
+                "std": self.std.tolist(),
+                "fill": self.fill.tolist(),
+                # JSON has no infinity; null means unbounded
+                "clip_min": [None if np.isinf(v) else v for v in self.clip_min.tolist()],
+                "clip_max": [None if np.isinf(v) else v for v in self.clip_max.tolist()],
+                "fill_strategy": self.fill_strategy,
+                "fitted_at": self.fitted_at,
+                "source": self.source,
+                "updated_rows": self.updated_rows
+            }
+
+    def save(self, path):
+        """Writes the statistics to ``path``, replacing it atomically"""
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        stats = cls(data["count"], data["mean"], data["std"], data["fill"],
+                    [-np.inf if v is None else v for v in data["clip_min"]],
+                    [np.inf if v is None else v for v in data["clip_max"]],
+                    fill_strategy=data.get("fill_strategy", "mean"),
+                    fitted_at=data.get("fitted_at"), source=data.get("source"))
+        stats.updated_rows = data.get("updated_rows", 0)
+        return stats
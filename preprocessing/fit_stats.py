@@ -0,0 +1,70 @@
+import argparse
+import csv
+import json
+import logging
+import os
+
+import numpy as np
+
+from feature_stats import FILL_STRATEGIES, FeatureStats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def read_dataset(path):
+    """
+    Reads an N x F matrix from an NDJSON file of {"features": [...]} records or a CSV file
+
+    Missing values (null in NDJSON, empty in CSV) become NaN. A CSV header
+    row is skipped.
+    """
+    rows = []
+    with open(path) as f:
+        if path.endswith(".csv"):
+            for record in csv.reader(f):
+                try:
+                    rows.append([float(value) if value.strip() else np.nan for value in record])
+                except ValueError:
+                    if rows:
+                        raise
+        else:
+            for line in f:
+                if line.strip():
+                    rows.append([np.nan if value is None else value for value in json.loads(line)["features"]])
+    widths = {len(row) for row in rows}
+    if len(widths) != 1:
+        raise ValueError(f"Rows of {path} have different numbers of features: {sorted(widths)}")
+    return np.array(rows, dtype=float)
+
+def fit_stats(dataset_path, output_path, clip_quantile=0.001, fill_strategy="mean"):
+    """
+    Fits the per-feature preprocessing statistics on a dataset and saves them
+
+    Args:
+        dataset_path (str): NDJSON or CSV file of feature rows
+        output_path (str): Where to write the statistics
+        clip_quantile (float): Values are clipped to this quantile and its complement
+        fill_strategy (str): Missing values are replaced with the feature's "mean" or "median"
+    """
+    matrix = read_dataset(dataset_path)
+    logger.info(f"Fitting preprocessing statistics on {matrix.shape[0]} rows of {matrix.shape[1]} features")
+    stats = FeatureStats.fit(matrix, clip_quantile=clip_quantile, fill_strategy=fill_strategy,
+                             source=os.path.abspath(dataset_path))
+    stats.save(output_path)
+    logger.info(f"Preprocessing statistics saved to {output_path}")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit the per-feature statistics used by the fitted and online preprocessing modes')
+    parser.add_argument('dataset', type=str,
+                        help='NDJSON file of {"features": [...]} records (the bulk_score.py input format) or CSV file')
+    parser.add_argument('--output', type=str, default='preprocessing_stats.json',
+                        help='Where to write the statistics (default: preprocessing_stats.json)')
+    parser.add_argument('--clip-quantile', type=float, default=0.001,
+                        help='Values are clipped to this quantile and its complement (default: 0.001)')
+    parser.add_argument('--fill', type=str, default='mean', choices=FILL_STRATEGIES,
+                        help='Value replacing missing entries (default: mean)')
+    args = parser.parse_args()
+    fit_stats(args.dataset, args.output, args.clip_quantile, args.fill)
@@ -1,16 +1,27 @@
+import asyncio
 import logging
 import os
-from fastapi import FastAPI, HTTPException
+import sys
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import requests
 import uvicorn
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
 import numpy as np
 
+# Make the helpers shared between services importable when running from the service directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.http_client import ServiceClient, RequestError, circuit_breakers
+from shared import wire
+from shared.metrics import install_metrics, phase
+from shared.tracing import install_tracing
+from shared.admission import install_admission
+from shared.deadline import check_deadline, install_deadlines
+from shared.logging_setup import configure_logging
+from shared.startup import install_probes
+import preprocessor
+from preprocessor import FeatureData, BatchFeatureData, preprocess, preprocess_batch
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, 
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_logging("preprocessing")
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -27,18 +38,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts, in-flight gauges and per-phase latency histograms on /metrics
+metrics = install_metrics(app, "preprocessing")
+
+# Request spans sharing one trace ID across the four services, sampled at TRACE_SAMPLE_RATE
+install_tracing(app, "preprocessing")
+
+# Bounded in-flight requests and queue; excess work is rejected early with 429/503
+admission = install_admission(app, "preprocessing", metrics)
+
+# Deadline of every request, forwarded downstream and capping the downstream timeouts
+install_deadlines(app, "preprocessing", metrics)
+
+# /livez, and /readyz once the service is warmed up
+startup = install_probes(app, "preprocessing", metrics)
+
 # Inference service URL
 INFERENCE_URL = os.getenv("INFERENCE_URL", "http://0.0.0.0:8002/predict")
+INFERENCE_BATCH_URL = os.getenv("INFERENCE_BATCH_URL", f"{INFERENCE_URL}/batch")
+
+# Seconds between snapshots of the statistics learned in online mode (0 disables them)
+PREPROCESSING_SNAPSHOT_INTERVAL = float(os.getenv("PREPROCESSING_SNAPSHOT_INTERVAL", "60"))
+
+# Pooled, non-blocking client for the inference service
+inference_client = ServiceClient("inference")
+
+snapshot_task = None
+
+async def snapshot_stats_periodically():
+    """Writes the online statistics to disk so a restart resumes from them"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(PREPROCESSING_SNAPSHOT_INTERVAL)
+        try:
+            await loop.run_in_executor(None, preprocessor.snapshot_stats)
+        except Exception as e:
+            logger.error(f"Error saving preprocessing statistics: {str(e)}")
+
+@app.on_event("startup")
+async def start_http_client():
+    await inference_client.start()
+
+@app.on_event("startup")
+async def start_stats_snapshots():
+    global snapshot_task
+    if preprocessor.PREPROCESSING_MODE == "online" and PREPROCESSING_SNAPSHOT_INTERVAL > 0:
+        snapshot_task = asyncio.create_task(snapshot_stats_periodically())
 
-# Define data models
-class FeatureData(BaseModel):
-    features: List[float]
-    metadata: Optional[Dict[str, Any]] = None
+@app.on_event("shutdown")
+async def close_http_client():
+    await inference_client.close()
+
+@app.on_event("shutdown")
+async def stop_stats_snapshots():
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+    try:
+        preprocessor.snapshot_stats()
+    except Exception as e:
+        logger.error(f"Error saving preprocessing statistics: {str(e)}")
 
-class PreprocessedData(BaseModel):
-    features: List[float]
-    metadata: Optional[Dict[str, Any]] = None
-    preprocessing_info: Dict[str, Any]
+@app.on_event("startup")
+async def warm_up_service():
+    with startup.phase("warm_up"):
+        preprocessor.warm_up()
+    startup.mark_ready()
 
 @app.get("/")
 def read_root():
@@ -46,49 +110,30 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "circuit_breakers": circuit_breakers(inference_client)}
+
+@app.get("/stats")
+def preprocessing_stats():
+    """The preprocessing mode and, in fitted and online mode, the per-feature statistics"""
+    if preprocessor.stats is None:
+        return {"mode": preprocessor.PREPROCESSING_MODE}
+    return {"mode": preprocessor.PREPROCESSING_MODE, **preprocessor.stats.to_dict()}
 
 @app.post("/preprocess")
 async def preprocess_data(data: FeatureData):
     """
     Preprocesses the input data before sending to the inference service
     """
-    logger.info(f"Received data for preprocessing: {data}")
+    logger.info("Received data for preprocessing: %s", data)
+    check_deadline()
     
     try:
-        # Get the features as numpy array
-        features = np.array(data.features)
-        
-        # Perform preprocessing operations
-        # 1. Check for missing values
-        if np.isnan(features).any():
-            logger.warning("Missing values detected in features")
-            # Replace NaN with mean of the feature
-            features = np.nan_to_num(features, nan=np.nanmean(features))
-        
-        # 2. Standardize the features (mean=0, std=1)
-        mean = np.mean(features)
-        std = np.std(features)
-        if std > 0:
-            features = (features - mean) / std
-        
-        # 3. Clip extreme values
-        features = np.clip(features, -5, 5)
-        
-        # Create preprocessed data object
-        preprocessed_data = PreprocessedData(
-            features=features.tolist(),
-            metadata=data.metadata,
-            preprocessing_info={
-                "mean": float(mean),
-                "std": float(std),
-                "replaced_missing": bool(np.isnan(np.array(data.features)).any())
-            }
-        )
+        with phase("compute"):
+            preprocessed_data = preprocess(data)
         
         # Forward preprocessed data to inference service
         try:
-            response = requests.post(INFERENCE_URL, json=preprocessed_data.dict())
+            response = await inference_client.post(INFERENCE_URL, json=preprocessed_data.dict())
             
             if response.status_code != 200:
                 logger.error(f"Inference service error: {response.text}")
@@ -96,19 +141,73 @@ async def preprocess_data(data: FeatureData):
                                   detail=f"Inference service error: {response.text}")
             
             inference_result = response.json()
-            logger.info(f"Inference completed successfully")
+            logger.info("Inference completed successfully")
             
             return inference_result
             
-        except requests.RequestException as e:
+        except RequestError as e:
             logger.error(f"Error connecting to inference service: {str(e)}")
             # In case of connection error, still return the preprocessed data
             return preprocessed_data.dict()
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Preprocessing error: {str(e)}")
 
+@app.post("/preprocess/batch")
+async def preprocess_batch_data(request: Request):
+    """
+    Preprocesses an N x F batch of rows and forwards it to the inference service
+
+    Rows that cannot be preprocessed are reported in ``errors`` and skipped by
+    the later stages instead of failing the whole batch. Accepts and replies
+    with JSON (BatchFeatureData) or msgpack.
+    """
+    with phase("parse"):
+        data, _ = await wire.read_batch(request, BatchFeatureData)
+    num_rows = len(data.features)
+    logger.info("Received batch of %d rows for preprocessing", num_rows)
+
+    if data.metadata is not None and len(data.metadata) != num_rows:
+        raise HTTPException(status_code=422,
+                            detail=f"Expected {num_rows} metadata entries, got {len(data.metadata)}")
+    check_deadline()
+
+    try:
+        # Ragged batches stay JSON, their rows being standardized separately in row mode
+        binary = wire.binary_enabled() and (isinstance(data.features, np.ndarray)
+                                            or len({len(row) for row in data.features}) <= 1)
+        with phase("compute"):
+            preprocessed_batch = preprocess_batch(data, as_arrays=binary)
+            if not binary:
+                preprocessed_batch = preprocessed_batch.dict()
+
+        # Forward preprocessed batch to inference service
+        try:
+            response = await inference_client.post(INFERENCE_BATCH_URL,
+                                                    **wire.request_kwargs(preprocessed_batch, binary))
+
+            if response.status_code != 200:
+                logger.error(f"Inference service error: {response.text}")
+                raise HTTPException(status_code=response.status_code,
+                                  detail=f"Inference service error: {response.text}")
+
+            logger.info("Batch inference completed successfully")
+            return wire.respond(wire.read_response(response), wire.accepts_binary(request))
+
+        except RequestError as e:
+            logger.error(f"Error connecting to inference service: {str(e)}")
+            # In case of connection error, still return the preprocessed batch
+            return wire.respond(preprocessed_batch, wire.accepts_binary(request))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during batch preprocessing: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Preprocessing error: {str(e)}")
+
 if __name__ == "__main__":
     # Run the application
     uvicorn.run("main:app", host="0.0.0.0", port=8001, reload=True)
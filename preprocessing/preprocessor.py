@@ -0,0 +1,266 @@
+import logging
+import os
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from feature_stats import FeatureStats
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# "row" standardizes every row with its own mean and std, "fitted" with the
+# per-feature statistics of PREPROCESSING_STATS_PATH, and "online" keeps
+# updating those statistics from the rows it preprocesses
+PREPROCESSING_MODE = os.getenv("PREPROCESSING_MODE", "row").lower()
+PREPROCESSING_MODES = ("row", "fitted", "online")
+PREPROCESSING_STATS_PATH = os.getenv("PREPROCESSING_STATS_PATH",
+                                     os.path.join(SERVICE_DIR, "preprocessing_stats.json"))
+# Where online mode snapshots its statistics, and resumes from on restart
+PREPROCESSING_SNAPSHOT_PATH = os.getenv("PREPROCESSING_SNAPSHOT_PATH",
+                                        os.path.join(SERVICE_DIR, "preprocessing_stats.online.json"))
+# Width of the statistics learned online when no fitted artifact exists
+PREPROCESSING_NUM_FEATURES = int(os.getenv("PREPROCESSING_NUM_FEATURES", "4"))
+
+# Define data models
+class FeatureData(BaseModel):
+    features: List[float]
+    metadata: Optional[Dict[str, Any]] = None
+
+class PreprocessedData(BaseModel):
+    features: List[float]
+    metadata: Optional[Dict[str, Any]] = None
+    preprocessing_info: Dict[str, Any]
+
+class BatchFeatureData(BaseModel):
+    # Missing values are sent as null since NaN is not valid JSON
+    features: List[List[Optional[float]]]
+    metadata: Optional[List[Optional[Dict[str, Any]]]] = None
+
+class PreprocessedBatch(BaseModel):
+    features: List[List[float]]
+    metadata: List[Optional[Dict[str, Any]]]
+    preprocessing_info: List[Optional[Dict[str, Any]]]
+    errors: List[Optional[str]]
+
+def standardize_rows(matrix):
+    """
+    Applies the per-row preprocessing to an N x F matrix in one pass
+
+    Rows must contain at least one non-missing value. Returns the standardized
+    matrix together with the per-row means, stds and a mask of the rows that
+    had missing values replaced.
+    """
+    missing = np.isnan(matrix)
+    replaced_missing = missing.any(axis=1)
+    if replaced_missing.any():
+        # Replace NaN with the mean of the remaining features in the same row
+        row_means = np.nanmean(matrix, axis=1)
+        matrix = np.where(missing, row_means[:, None], matrix)
+
+    mean = np.mean(matrix, axis=1)
+    std = np.std(matrix, axis=1)
+    safe_std = np.where(std > 0, std, 1.0)
+    standardized = np.where((std > 0)[:, None], (matrix - mean[:, None]) / safe_std[:, None], matrix)
+
+    return np.clip(standardized, -5, 5), mean, std, replaced_missing
+
+def load_stats():
+    """
+    Loads the statistics used in fitted and online mode, None in row mode
+
+    Raises:
+        FileNotFoundError: In fitted mode, if there is no fitted artifact
+    """
+    if PREPROCESSING_MODE not in PREPROCESSING_MODES:
+        raise ValueError(f"Unknown preprocessing mode {PREPROCESSING_MODE!r}, "
+                         f"expected one of {', '.join(PREPROCESSING_MODES)}")
+    if PREPROCESSING_MODE == "row":
+        return None
+    for path in ([PREPROCESSING_SNAPSHOT_PATH] if PREPROCESSING_MODE == "online" else []) + [PREPROCESSING_STATS_PATH]:
+        if os.path.exists(path):
+            loaded = FeatureStats.load(path)
+            logger.info(f"Loaded preprocessing statistics for {loaded.num_features} features from {path}")
+            return loaded
+    if PREPROCESSING_MODE == "fitted":
+        raise FileNotFoundError(f"No preprocessing statistics at {PREPROCESSING_STATS_PATH}; "
+                                f"fit them with fit_stats.py")
+    logger.warning(f"No preprocessing statistics found, learning them online "
+                   f"for {PREPROCESSING_NUM_FEATURES} features")
+    return FeatureStats.empty(PREPROCESSING_NUM_FEATURES)
+
+stats = load_stats()
+
+def standardize_features(matrix):
+    """
+    Applies the fitted statistics to an N x F matrix, updating them first in online mode
+
+    Returns:
+        tuple: (standardized matrix, mask of the rows that had missing values replaced)
+    """
+    if matrix.shape[1] != stats.num_features:
+        raise ValueError(f"Expected {stats.num_features} features, got {matrix.shape[1]}")
+    if PREPROCESSING_MODE == "online":
+        stats.update(matrix)
+    return stats.transform(matrix)
+
+def snapshot_stats():
+    """Writes the online statistics to PREPROCESSING_SNAPSHOT_PATH"""
+    if PREPROCESSING_MODE == "online":
+        stats.save(PREPROCESSING_SNAPSHOT_PATH)
+
+def warm_up():
+    """Runs the preprocessing code once on a dummy batch, leaving the online statistics untouched"""
+    if stats is not None:
+        stats.transform(np.zeros((2, stats.num_features)))
+    else:
+        preprocess_batch(BatchFeatureData(features=[[0.0, 1.0], [1.0, 0.0]]))
+
+def preprocess(data):
+    """
+    Preprocesses a single row of features
+
+    Args:
+        data: Object with ``features`` and ``metadata`` attributes, e.g. FeatureData
+
+    Returns:
+        PreprocessedData: The standardized features and preprocessing details
+    """
+    if stats is not None:
+        standardized, replaced_missing = standardize_features(np.array([data.features], dtype=float))
+        return PreprocessedData(
+            features=standardized[0].tolist(),
+            metadata=data.metadata,
+            preprocessing_info={"mode": PREPROCESSING_MODE, "replaced_missing": bool(replaced_missing[0])}
+        )
+
+    # Get the features as numpy array
+    features = np.array(data.features)
+
+    # Perform preprocessing operations
+    # 1. Check for missing values
+    if np.isnan(features).any():
+        logger.warning("Missing values detected in features")
+        # Replace NaN with mean of the feature
+        features = np.nan_to_num(features, nan=np.nanmean(features))
+
+    # 2. Standardize the features (mean=0, std=1)
+    mean = np.mean(features)
+    std = np.std(features)
+    if std > 0:
+        features = (features - mean) / std
+
+    # 3. Clip extreme values
+    features = np.clip(features, -5, 5)
+
+    # Create preprocessed data object
+    return PreprocessedData(
+        features=features.tolist(),
+        metadata=data.metadata,
+        preprocessing_info={
+            "mean": float(mean),
+            "std": float(std),
+            "replaced_missing": bool(np.isnan(np.array(data.features)).any())
+        }
+    )
+
+def preprocess_batch(data, as_arrays=False):
+    """
+    Preprocesses an N x F batch of rows
+
+    Rows that cannot be preprocessed are reported in ``errors`` and skipped by
+    the later stages instead of failing the whole batch. In row mode rows of
+    different lengths are standardized separately, each as it would be on
+    its own.
+
+    Args:
+        data: Object with ``features`` and ``metadata`` attributes, e.g.
+            BatchFeatureData. ``features`` may also be an N x F ndarray with
+            NaN for missing values.
+        as_arrays (bool): Return a dict holding the features as an N x F
+            ndarray (zeros for failed rows) for the binary wire format
+
+    Raises:
+        ValueError: If ``as_arrays`` is set for valid rows of different lengths
+
+    Returns:
+        PreprocessedBatch: One entry per input row, in order (a dict of the
+        same fields if ``as_arrays`` is set)
+    """
+    num_rows = len(data.features)
+    metadata = data.metadata if data.metadata is not None else [None] * num_rows
+    if len(metadata) != num_rows:
+        raise ValueError(f"Expected {num_rows} metadata entries, got {len(metadata)}")
+
+    errors = [None] * num_rows
+    if isinstance(data.features, np.ndarray):
+        # Rectangular batches from the binary wire format skip the per-row checks
+        width = data.features.shape[1]
+        if stats is not None and width != stats.num_features:
+            errors = [f"Expected {stats.num_features} features, got {width}"] * num_rows
+        else:
+            for i in np.flatnonzero(np.isnan(data.features).all(axis=1)):
+                errors[i] = "All feature values are missing"
+        valid = [i for i in range(num_rows) if errors[i] is None]
+        groups = {width: valid} if valid else {}
+    else:
+        width = stats.num_features if stats is not None else max((len(row) for row in data.features), default=0)
+        for i, row in enumerate(data.features):
+            if stats is not None and len(row) != width:
+                errors[i] = f"Expected {width} features, got {len(row)}"
+            elif all(value is None or np.isnan(value) for value in row):
+                errors[i] = "All feature values are missing"
+        valid = [i for i in range(num_rows) if errors[i] is None]
+        # One matrix per row length; in fitted and online mode all valid rows have the same
+        groups = {}
+        for i in valid:
+            groups.setdefault(len(data.features[i]), []).append(i)
+
+    standardized_groups = []
+    preprocessing_info = [None] * num_rows
+    for group_width, rows in groups.items():
+        if isinstance(data.features, np.ndarray):
+            matrix = np.asarray(data.features, dtype=float)[rows]
+        else:
+            matrix = np.array([data.features[i] for i in rows], dtype=float).reshape(len(rows), group_width)
+        if stats is not None:
+            standardized, replaced_missing = standardize_features(matrix)
+            for j, i in enumerate(rows):
+                preprocessing_info[i] = {"mode": PREPROCESSING_MODE, "replaced_missing": bool(replaced_missing[j])}
+        else:
+            standardized, mean, std, replaced_missing = standardize_rows(matrix)
+            for j, i in enumerate(rows):
+                preprocessing_info[i] = {
+                    "mean": float(mean[j]),
+                    "std": float(std[j]),
+                    "replaced_missing": bool(replaced_missing[j])
+                }
+        standardized_groups.append((rows, standardized))
+
+    if as_arrays:
+        if len(groups) > 1:
+            raise ValueError("Rows of different lengths cannot be returned as one array")
+        width = next(iter(groups), width)
+        features = np.zeros((num_rows, width))
+        for rows, standardized in standardized_groups:
+            features[rows] = standardized
+        return {
+            "features": features,
+            "metadata": metadata,
+            "preprocessing_info": preprocessing_info,
+            "errors": errors
+        }
+
+    features = [[] for _ in range(num_rows)]
+    for rows, standardized in standardized_groups:
+        for j, i in enumerate(rows):
+            features[i] = standardized[j].tolist()
+
+    return PreprocessedBatch(
+        features=features,
+        metadata=metadata,
+        preprocessing_info=preprocessing_info,
+        errors=errors
+    )
@@ -0,0 +1,252 @@
+"""
+Admission control for the pipeline services
+
+At most ADMISSION_MAX_IN_FLIGHT requests are handled at once. Further
+requests wait in a queue of ADMISSION_MAX_QUEUE entries for up to
+ADMISSION_MAX_QUEUE_WAIT_MS, and are turned away once the queue is full
+(429) or their wait is over (503), with a Retry-After header. Overload
+then shows up as fast rejections at the service that cannot keep up
+instead of as latency growing in every stage of the chain.
+
+Health checks and metrics are never queued, and admin requests are
+admitted ahead of queued traffic.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+
+from shared import deadline
+from shared.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_QUEUE_WAIT_MS = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_MS", "1000"))
+# Paths that bypass admission control entirely
+ADMISSION_EXEMPT_PATHS = os.getenv("ADMISSION_EXEMPT_PATHS",
+                                   "/,/health,/metrics,/admission,/stats,/batching/stats,"
+                                   "/executor/stats,/cache/stats,/audit/stats")
+# Path prefixes admitted ahead of queued requests
+ADMISSION_PRIORITY_PREFIXES = os.getenv("ADMISSION_PRIORITY_PREFIXES", "/admin")
+
+# Weight of the latest request in the moving average of handling times
+_SERVICE_TIME_ALPHA = 0.05
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away instead of being handled"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the requests handled at once and the requests waiting for a slot
+
+    A finished request hands its slot directly to the oldest waiting request,
+    priority requests first, so waiting requests are admitted in order.
+    Meant to be used from a single event loop.
+
+    Args:
+        max_in_flight (int): Requests handled at once
+        max_queue (int): Requests waiting for a slot
+        max_queue_wait (float): Seconds a request waits before being rejected
+    """
+
+    def __init__(self, max_in_flight, max_queue, max_queue_wait):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "queue_timeout": 0}
+        self.service_time = 0.0
+        self._priority = deque()
+        self._normal = deque()
+
+    @property
+    def queued(self):
+        return len(self._priority) + len(self._normal)
+
+    def retry_after(self):
+        """Seconds until the current backlog is expected to have drained, at least 1"""
+        backlog = (self.in_flight + self.queued) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(backlog * self.service_time))
+
+    def _reject(self, status, reason):
+        self.rejected[reason] += 1
+        return AdmissionRejected(status, reason, self.retry_after())
+
+    def _expire(self, queue, future):
+        if not future.done():
+            queue.remove(future)
+            future.set_exception(self._reject(503, "queue_timeout"))
+
+    async def acquire(self, priority=False, max_wait=None):
+        """
+        Waits for a slot, for at most ``max_wait`` seconds if shorter than ``max_queue_wait``
+
+        Returns:
+            float: Seconds spent waiting in the queue
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait exceeds ``max_queue_wait``
+        """
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+        if self.queued >= self.max_queue:
+            raise self._reject(429, "queue_full")
+
+        loop = asyncio.get_running_loop()
+        queue = self._priority if priority else self._normal
+        future = loop.create_future()
+        queue.append(future)
+        wait = self.max_queue_wait if max_wait is None else max(0.0, min(self.max_queue_wait, max_wait))
+        timer = loop.call_later(wait, self._expire, queue, future)
+        start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The client went away; give back a slot handed over in the meantime,
+            # but not when the wait had already expired and no slot was held
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release(0.0)
+            elif future in queue:
+                queue.remove(future)
+            raise
+        finally:
+            timer.cancel()
+        self.admitted += 1
+        return time.perf_counter() - start
+
+    def release(self, service_time):
+        """Frees the slot of a finished request, handing it to the next waiting one"""
+        if service_time:
+            self.service_time += _SERVICE_TIME_ALPHA * (service_time - self.service_time)
+        for queue in (self._priority, self._normal):
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    # The slot moves to the waiting request, in_flight is unchanged
+                    future.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "max_queue_wait_ms": self.max_queue_wait * 1000,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "service_time_ms": self.service_time * 1000
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests through an AdmissionController
+
+    Installed outside the metrics and tracing middleware, so rejected
+    requests cost no parsing, tracing or metrics work beyond the admission
+    counters.
+    """
+
+    def __init__(self, app, controller, service, exempt_paths, priority_prefixes, registry=None):
+        self.app = app
+        self.controller = controller
+        self.service = service
+        self.exempt_paths = exempt_paths
+        self.priority_prefixes = priority_prefixes
+        self.registry = registry
+        if registry is not None:
+            self.queue_depth = Gauge("pipeline_admission_queue_depth", "Requests waiting for admission",
+                                     ("service",))
+            self.queue_wait = Histogram("pipeline_admission_queue_wait_seconds",
+                                        "Time admitted requests waited in the admission queue", ("service",))
+            self.rejections = Counter("pipeline_admission_rejected_total", "Requests rejected by admission control",
+                                      ("service", "reason"))
+            registry.add(self.queue_depth, self.queue_wait, self.rejections)
+
+    async def _reject(self, send, rejected):
+        detail = f"Service overloaded ({rejected.reason.replace('_', ' ')})"
+        body = json.dumps({"detail": detail}, separators=(",", ":")).encode()
+        await send({"type": "http.response.start", "status": rejected.status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"retry-after", str(rejected.retry_after).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        priority = scope["path"].startswith(self.priority_prefixes)
+        try:
+            # Waiting longer than the request's deadline would be wasted
+            waited = await controller.acquire(priority, deadline.remaining())
+        except AdmissionRejected as rejected:
+            if self.registry is not None:
+                self.rejections.inc(self.service, rejected.reason)
+                self.queue_depth.set(controller.queued, self.service)
+            await self._reject(send, rejected)
+            return
+        if self.registry is not None:
+            self.queue_wait.observe(waited, self.service)
+            self.queue_depth.set(controller.queued, self.service)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.perf_counter() - start)
+
+
+def install_admission(app, service, registry=None):
+    """
+    Adds admission control and an ``/admission`` stats endpoint to a service
+
+    Install it after the metrics and tracing middleware so it runs before them.
+
+    Args:
+        app: The FastAPI app
+        service (str): Service name used in metric labels
+        registry (MetricsRegistry): Registry receiving the admission metrics, if any
+
+    Returns:
+        AdmissionController: The controller, or None if ADMISSION_ENABLED is false
+    """
+    if not ADMISSION_ENABLED:
+        logger.info("Admission control disabled")
+        return None
+
+    controller = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE,
+                                     ADMISSION_MAX_QUEUE_WAIT_MS / 1000)
+    exempt_paths = {path.strip() for path in ADMISSION_EXEMPT_PATHS.split(",") if path.strip()}
+    priority_prefixes = tuple(prefix.strip() for prefix in ADMISSION_PRIORITY_PREFIXES.split(",") if prefix.strip())
+    app.add_middleware(AdmissionMiddleware, controller=controller, service=service, exempt_paths=exempt_paths,
+                       priority_prefixes=priority_prefixes, registry=registry)
+
+    @app.get("/admission")
+    def admission_stats():
+        return controller.stats()
+
+    logger.info(f"Admission control: max_in_flight={controller.max_in_flight}, "
+                f"max_queue={controller.max_queue}, max_queue_wait={ADMISSION_MAX_QUEUE_WAIT_MS:g}ms")
+    return controller
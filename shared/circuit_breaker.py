@@ -0,0 +1,178 @@
+"""
+Circuit breakers for the downstream hops of the pipeline services
+
+A breaker watches the outcome and latency of the calls to one downstream
+service over a rolling window. When too many of them fail or are slow, it
+opens: calls fail immediately with CircuitOpenError, a RequestError, so
+the services take their usual fallback for an unreachable downstream
+without waiting for a connection attempt to time out. After
+BREAKER_OPEN_SECONDS a few probe calls are let through (half-open); the
+breaker closes if they all succeed and opens again otherwise.
+
+Thresholds default to the BREAKER_* variables and can be set per
+downstream, e.g. ``INFERENCE_BREAKER_FAILURE_RATE`` for the client named
+``inference``.
+"""
+import logging
+import os
+import time
+from collections import deque
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# False lets every call reach the downstream service
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _setting(name, key, default):
+    return float(os.getenv(f"{name.upper()}_BREAKER_{key}", os.getenv(f"BREAKER_{key}", default)))
+
+
+class CircuitOpenError(httpx.RequestError):
+    """Raised instead of calling a downstream service whose breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one downstream service
+
+    Outcomes are counted in one-second buckets over ``window`` seconds, so
+    memory stays constant whatever the request rate.
+
+    Args:
+        name (str): Name of the downstream service
+        window (float): Seconds of calls the rates are computed over
+        min_calls (int): Calls needed in the window before the breaker can open
+        failure_rate (float): Fraction of failed calls that opens the breaker
+        slow_call_seconds (float): Calls taking longer count as slow
+        slow_call_rate (float): Fraction of slow calls that opens the breaker
+        open_seconds (float): Time the breaker stays open before probing
+        half_open_calls (int): Probe calls let through while half-open
+    """
+
+    def __init__(self, name, window=10.0, min_calls=20, failure_rate=0.5, slow_call_seconds=5.0,
+                 slow_call_rate=0.8, open_seconds=5.0, half_open_calls=3):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_change = time.time()
+        self.rejected = 0
+        self.times_opened = 0
+        self._buckets = deque()
+        self._probes = 0
+        self._probe_successes = 0
+
+    @classmethod
+    def from_env(cls, name):
+        return cls(name,
+                   window=_setting(name, "WINDOW", "10"),
+                   min_calls=int(_setting(name, "MIN_CALLS", "20")),
+                   failure_rate=_setting(name, "FAILURE_RATE", "0.5"),
+                   slow_call_seconds=_setting(name, "SLOW_CALL_MS", "5000") / 1000,
+                   slow_call_rate=_setting(name, "SLOW_CALL_RATE", "0.8"),
+                   open_seconds=_setting(name, "OPEN_SECONDS", "5"),
+                   half_open_calls=int(_setting(name, "HALF_OPEN_CALLS", "3")))
+
+    def _set_state(self, state):
+        if state != self.state:
+            log = logger.warning if state == OPEN else logger.info
+            log(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+            self.state = state
+            self.last_change = time.time()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        else:
+            self._buckets.clear()
+
+    def _counts(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        calls = failures = slow = 0
+        for _, bucket_calls, bucket_failures, bucket_slow in self._buckets:
+            calls += bucket_calls
+            failures += bucket_failures
+            slow += bucket_slow
+        return calls, failures, slow
+
+    def before_call(self):
+        """
+        Lets a call through or rejects it
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with all probes in flight
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(f"Circuit breaker for {self.name} is half-open, waiting for probe calls")
+            self._probes += 1
+
+    def record(self, success, seconds):
+        """Records the outcome of a call let through by ``before_call``"""
+        slow = seconds >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if not success or slow:
+                self._set_state(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call started before the breaker opened
+            return
+
+        now = time.monotonic()
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            bucket = self._buckets[-1]
+        else:
+            bucket = [second, 0, 0, 0]
+            self._buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += 0 if success else 1
+        bucket[3] += 1 if slow else 0
+
+        calls, failures, slow_calls = self._counts(now)
+        if calls >= self.min_calls and (failures >= self.failure_rate * calls
+                                        or slow_calls >= self.slow_call_rate * calls):
+            self._set_state(OPEN)
+
+    def release(self):
+        """Gives back the probe slot of a call whose outcome says nothing about the downstream"""
+        if self.state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def snapshot(self):
+        calls, failures, slow = self._counts(time.monotonic())
+        return {
+            "state": self.state,
+            "since": self.last_change,
+            "window_calls": calls,
+            "window_failures": failures,
+            "window_slow_calls": slow,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened
+        }
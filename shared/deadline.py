@@ -0,0 +1,172 @@
+"""
+End-to-end request deadlines
+
+A caller sets the time it is willing to wait in an ``X-Request-Deadline-Ms``
+header (milliseconds remaining, so clocks need not agree between hosts);
+without one, the first service applies REQUEST_DEADLINE_MS. Each stage
+forwards what is left of the budget to the next one, and ServiceClient
+uses it as the timeout of the downstream call. A stage whose deadline has
+passed stops right away with a 504 instead of doing work nobody is
+waiting for.
+
+Expired deadlines are counted per service and per point where they were
+detected: on arrival, before compute or before/during a downstream call.
+"""
+import contextvars
+import json
+import logging
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+from shared.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+DEADLINES_ENABLED = os.getenv("DEADLINES_ENABLED", "true").lower() == "true"
+# Budget of requests arriving without a deadline header
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "30000"))
+# Long-running paths, such as streams, keep only the per-hop timeouts
+DEADLINE_EXEMPT_PATHS = os.getenv("DEADLINE_EXEMPT_PATHS", "/ingest/stream")
+
+DEADLINE_HEADER = "x-request-deadline-ms"
+_DEADLINE_BYTES = DEADLINE_HEADER.encode()
+
+_service = None
+_expired_counter = None
+# Expired deadlines of this service by detection point
+expired = {}
+
+
+class DeadlineExceeded(HTTPException):
+    """Raised when the deadline of the current request has passed"""
+
+    def __init__(self, point):
+        super().__init__(status_code=504, detail=f"Deadline exceeded in {_service} ({point})")
+        self.point = point
+
+
+class Deadline:
+    """Deadline of one request, as a time.perf_counter() value"""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, budget_ms):
+        self.expires_at = time.perf_counter() + budget_ms / 1000
+
+    def remaining(self):
+        """Seconds left, negative once expired"""
+        return self.expires_at - time.perf_counter()
+
+    def tighten(self, budget_ms):
+        """Shortens the deadline to ``budget_ms`` from now, never extends it"""
+        self.expires_at = min(self.expires_at, time.perf_counter() + budget_ms / 1000)
+
+
+_current_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline():
+    """Deadline of the request being handled, or None"""
+    return _current_deadline.get()
+
+
+def remaining():
+    """Seconds left until the current request's deadline, or None without one"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def record_expired(point):
+    """Counts an expired deadline and returns the exception to raise"""
+    expired[point] = expired.get(point, 0) + 1
+    if _expired_counter is not None:
+        _expired_counter.inc(_service, point)
+    return DeadlineExceeded(point)
+
+
+def check_deadline(point="compute"):
+    """
+    Raises DeadlineExceeded if the current request's deadline has passed
+
+    Does nothing outside of a request with a deadline.
+    """
+    deadline = _current_deadline.get()
+    if deadline is not None and deadline.remaining() <= 0:
+        raise record_expired(point)
+
+
+def deadline_headers(headers=None):
+    """Adds the remaining budget to the headers of an outgoing request"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return headers
+    return {**(headers or {}), DEADLINE_HEADER: str(max(0, int(deadline.remaining() * 1000)))}
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware setting the deadline of every request
+
+    Requests arriving with an already expired deadline get a 504 without
+    reaching the app.
+    """
+
+    def __init__(self, app, default_ms, exempt_paths):
+        self.app = app
+        self.default_ms = default_ms
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        budget_ms = self.default_ms
+        for name, value in scope["headers"]:
+            if name == _DEADLINE_BYTES:
+                try:
+                    parsed = float(value)
+                    if math.isfinite(parsed):
+                        budget_ms = parsed
+                except ValueError:
+                    pass
+                break
+
+        if budget_ms <= 0:
+            rejected = record_expired("arrival")
+            body = json.dumps({"detail": rejected.detail}, separators=(",", ":")).encode()
+            await send({"type": "http.response.start", "status": rejected.status_code,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = _current_deadline.set(Deadline(budget_ms))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_deadline.reset(token)
+
+
+def install_deadlines(app, service, registry=None):
+    """
+    Gives every request of a service a deadline, forwarded downstream by ServiceClient
+
+    Install it after the other middleware, admission control included, so
+    time spent queueing counts against the deadline.
+    """
+    global _service, _expired_counter
+    _service = service
+    if not DEADLINES_ENABLED:
+        logger.info("Request deadlines disabled")
+        return
+    if registry is not None:
+        _expired_counter = Counter("pipeline_deadline_expired_total",
+                                   "Requests whose deadline expired, by where it was detected",
+                                   ("service", "point"))
+        registry.add(_expired_counter)
+    exempt_paths = {path.strip() for path in DEADLINE_EXEMPT_PATHS.split(",") if path.strip()}
+    app.add_middleware(DeadlineMiddleware, default_ms=REQUEST_DEADLINE_MS, exempt_paths=exempt_paths)
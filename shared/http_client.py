@@ -0,0 +1,133 @@
+import logging
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from shared import deadline
+from shared.circuit_breaker import BREAKER_ENABLED, CircuitBreaker
+from shared.metrics import DEBUG_TIMINGS_HEADER, SERVER_TIMING_HEADER, current_timing, phase
+from shared.tracing import propagation_headers
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings shared by every downstream client
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", str(HTTP_POOL_SIZE)))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2.0"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30.0"))
+
+# Errors raised for connection failures and timeouts on a downstream hop, and
+# for calls skipped because the downstream's circuit breaker is open
+RequestError = httpx.RequestError
+
+
+class ServiceClient:
+    """
+    Non-blocking client with a keep-alive connection pool for one downstream service
+
+    The client is created on application startup and closed on shutdown. The
+    per-hop timeout defaults to ``<NAME>_TIMEOUT`` from the environment, e.g.
+    ``INFERENCE_TIMEOUT`` for a client named ``inference``. Calls go through
+    a circuit breaker for the downstream service, configured the same way
+    (see shared.circuit_breaker).
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = None, pool_size: Optional[int] = None):
+        self.name = name
+        if timeout is None:
+            timeout = float(os.getenv(f"{name.upper()}_TIMEOUT", str(HTTP_TIMEOUT)))
+        self.timeout = timeout
+        self.pool_size = pool_size or HTTP_POOL_SIZE
+        self.breaker = CircuitBreaker.from_env(name) if BREAKER_ENABLED else None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Open the connection pool"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=min(HTTP_KEEPALIVE_CONNECTIONS, self.pool_size),
+                                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(self.timeout, connect=min(HTTP_CONNECT_TIMEOUT, self.timeout))
+            )
+            logger.info(f"Opened connection pool for {self.name} (size={self.pool_size}, timeout={self.timeout}s)")
+
+    async def close(self):
+        """Close the connection pool and all idle connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info(f"Closed connection pool for {self.name}")
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """
+        POST to the downstream service, reusing a pooled connection
+
+        The call is timed as the ``downstream`` phase of the current request.
+        When the request asked for debug timings, the downstream service is
+        asked for its own and they are added to the current request's. The
+        trace context of the current request is forwarded with the call, and
+        so is its remaining deadline, which also caps the call's timeout.
+
+        Connection errors, timeouts and 5xx responses count as failures of
+        the downstream service for its circuit breaker.
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed before or during the call
+            CircuitOpenError: If the circuit breaker is open, without calling the service
+        """
+        if self._client is None:
+            # Allows the client to be used when the app is driven without lifespan events
+            await self.start()
+
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise deadline.record_expired("downstream")
+            if "timeout" not in kwargs:
+                kwargs["timeout"] = httpx.Timeout(min(self.timeout, remaining),
+                                                  connect=min(HTTP_CONNECT_TIMEOUT, self.timeout, remaining))
+
+        headers = deadline.deadline_headers(propagation_headers(kwargs.get("headers")))
+        if headers is not None:
+            kwargs["headers"] = headers
+        timing = current_timing()
+        if timing is not None and timing.debug:
+            kwargs["headers"] = {**kwargs.get("headers", {}), DEBUG_TIMINGS_HEADER: "1"}
+        breaker = self.breaker
+        if breaker is not None:
+            breaker.before_call()
+        start = time.perf_counter()
+        try:
+            with phase("downstream"):
+                response = await self._client.post(url, **kwargs)
+        except httpx.TimeoutException:
+            # Out of budget rather than a failing downstream: fail fast instead of falling back
+            if remaining is not None and deadline.remaining() <= 0:
+                if breaker is not None:
+                    breaker.release()
+                raise deadline.record_expired("downstream")
+            if breaker is not None:
+                breaker.record(False, time.perf_counter() - start)
+            raise
+        except httpx.RequestError:
+            if breaker is not None:
+                breaker.record(False, time.perf_counter() - start)
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            breaker.record(response.status_code < 500, time.perf_counter() - start)
+        if timing is not None and timing.debug and SERVER_TIMING_HEADER in response.headers:
+            timing.add_downstream_entries(response.headers[SERVER_TIMING_HEADER])
+        return response
+
+
+def circuit_breakers(*clients):
+    """Circuit breaker state of each client, as reported on a service's /health"""
+    return {client.name: client.breaker.snapshot() for client in clients if client.breaker is not None}
@@ -0,0 +1,212 @@
+"""
+Logging configuration shared by the pipeline services
+
+Records are handed unformatted to a bounded queue and written in batches
+by a background thread, so a request never waits on formatting or I/O. Log
+calls on the request path pass their payload as an argument
+(``logger.info("Received %s", data)``): it is only rendered if the record
+is actually written.
+
+Request logs can be sampled per level with LOG_SAMPLE_RATES, e.g.
+``INFO=0.1``. The decision is made from the trace ID, so the lines of a
+request are kept or dropped together in every service. Records logged
+outside of a request are always kept.
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+# Adds trace_id to every log record
+from shared import tracing  # noqa: F401
+
+# "json" writes one JSON object per line, "text" the classic format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Records waiting to be written beyond this are dropped instead of blocking requests
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Seconds between writes of the queued records
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.1"))
+# Fraction of request logs kept per level, e.g. "DEBUG=0.01,INFO=0.1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# Longer messages, typically rendered payloads, are truncated
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "2000"))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] - %(message)s'
+
+
+def parse_sample_rates(value):
+    """Parses "LEVEL=rate,..." into a {level number: rate} dict"""
+    rates = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        level, _, rate = item.partition("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def _truncate(message):
+    if len(message) > LOG_MAX_MESSAGE_LENGTH:
+        return f"{message[:LOG_MAX_MESSAGE_LENGTH]}... ({len(message)} chars)"
+    return message
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record with the service name and trace ID"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": _truncate(record.getMessage())
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message)
+        return super().formatMessage(record)
+
+
+class RequestLogSampler(logging.Filter):
+    """Keeps a fraction of the records logged during a request, per level"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1.0:
+            return True
+        trace_id = getattr(record, "trace_id", "-")
+        if trace_id == "-":
+            return True
+        return int(trace_id[:8], 16) < rate * 0x100000000
+
+
+class BackgroundLogHandler(logging.Handler):
+    """
+    Queues records as they are and writes them in batches from a daemon thread
+
+    The calling thread only appends the record to a deque: the message and
+    its arguments are rendered by the writer thread, and only for records
+    that passed the level and sampling checks. When the writer falls behind,
+    the oldest queued records are dropped rather than blocking requests.
+    """
+
+    def __init__(self, formatter, stream=None, interval=0.1, queue_size=10000):
+        super().__init__()
+        self.setFormatter(formatter)
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.dropped = 0
+        self._queue = deque(maxlen=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # No handler lock: appending to a deque is thread-safe
+        if not self.filter(record):
+            return False
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(record)
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+    def _write(self):
+        lines = []
+        while self._queue:
+            try:
+                record = self._queue.popleft()
+            except IndexError:
+                break
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+        self._write()
+
+    def close(self):
+        """Writes the records still queued and stops the writer thread"""
+        self._stop.set()
+        self._thread.join()
+        super().close()
+
+
+_handler = None
+
+
+def _close_handler():
+    global _handler
+    if _handler is not None:
+        _handler.close()
+        _handler = None
+
+
+# Write what is still queued when the process exits
+atexit.register(_close_handler)
+
+
+def configure_logging(service, stream=None, sample_rates=None):
+    """
+    Routes every log record of the process through the background writer
+
+    Replaces the handlers of the root logger and of uvicorn's loggers, so
+    access logs are queued and sampled too.
+
+    Args:
+        service (str): Service name added to JSON records
+        stream: Stream to write to (default: stderr)
+        sample_rates (dict): {level number: rate}, overriding LOG_SAMPLE_RATES
+
+    Returns:
+        BackgroundLogHandler: The handler, whose ``dropped`` counts lost records
+    """
+    global _handler
+    _close_handler()
+
+    formatter = JsonFormatter(service) if LOG_FORMAT == "json" else TextFormatter()
+    _handler = BackgroundLogHandler(formatter, stream, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE)
+    _handler.addFilter(RequestLogSampler(sample_rates if sample_rates is not None
+                                         else parse_sample_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(LOG_LEVEL)
+    for name in ("uvicorn", "uvicorn.access", "uvicorn.error"):
+        logging.getLogger(name).handlers[:] = []
+        logging.getLogger(name).propagate = True
+    return _handler
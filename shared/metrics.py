@@ -0,0 +1,280 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Requests carrying this header get a Server-Timing response header with the
+# phase breakdown of this service and of every service downstream of it
+DEBUG_TIMINGS_HEADER = "x-debug-timings"
+SERVER_TIMING_HEADER = "server-timing"
+_DEBUG_HEADER_BYTES = DEBUG_TIMINGS_HEADER.encode()
+_SERVER_TIMING_BYTES = SERVER_TIMING_HEADER.encode()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond stage work to slow downstream hops
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+                for labels, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        # Per-bucket counts are kept non-cumulative and summed up when rendering
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        lines = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.label_names + ('le',), labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Request and phase metrics of one service, rendered in the Prometheus text format
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.requests = Counter("pipeline_requests_total", "Requests handled",
+                                ("service", "endpoint", "method", "status"))
+        self.in_flight = Gauge("pipeline_requests_in_flight", "Requests currently being handled",
+                               ("service", "endpoint"))
+        self.latency = Histogram("pipeline_request_duration_seconds", "Request latency",
+                                 ("service", "endpoint"))
+        self.phases = Histogram("pipeline_phase_duration_seconds",
+                                "Time spent per request phase (parse, compute, downstream, serialize)",
+                                ("service", "endpoint", "phase"))
+        self._metrics = [self.requests, self.in_flight, self.latency, self.phases]
+
+    def add(self, *metrics):
+        """Renders further metrics, e.g. those of admission control, on /metrics"""
+        self._metrics.extend(metrics)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestTiming:
+    """
+    Phase timings of the request being handled
+
+    ``parse`` covers routing, body parsing and validation: everything between
+    the request arriving and the handler's first phase. ``serialize`` covers
+    everything between the end of the handler's last phase and the response
+    being sent.
+    """
+
+    def __init__(self, registry, endpoint, debug):
+        self.registry = registry
+        self.endpoint = endpoint
+        self.debug = debug
+        self.start = time.perf_counter()
+        self.last_mark = None
+        # (name, milliseconds) entries reported in the Server-Timing header
+        self.entries = []
+
+    def record(self, phase, seconds):
+        self.registry.phases.observe(seconds, self.registry.service, self.endpoint, phase)
+        if self.debug:
+            self.entries.append((f"{self.registry.service}.{phase}", seconds * 1000))
+
+    def add_downstream_entries(self, header):
+        """Adds the Server-Timing entries reported by a downstream service"""
+        for item in header.split(","):
+            name, _, duration = item.strip().partition(";dur=")
+            try:
+                self.entries.append((name, float(duration)))
+            except ValueError:
+                continue
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={milliseconds:.3f}" for name, milliseconds in self.entries)
+
+
+_current_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+def current_timing():
+    """Timing of the request being handled, or None outside of a request"""
+    return _current_timing.get()
+
+
+@contextmanager
+def phase(name):
+    """
+    Times a block of a request handler as the given phase
+
+    Does nothing outside of an instrumented request.
+    """
+    timing = _current_timing.get()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    if timing.last_mark is None:
+        if name == "parse":
+            # Handlers that parse their own body extend the framework's parsing time
+            start = timing.start
+        else:
+            timing.record("parse", start - timing.start)
+    try:
+        yield
+    finally:
+        timing.last_mark = time.perf_counter()
+        timing.record(name, timing.last_mark - start)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them per endpoint and phase
+
+    Written against the raw ASGI interface rather than as an ``@app.middleware``
+    function, which wraps every response in an extra streaming layer.
+    """
+
+    def __init__(self, app, registry, routes_app):
+        self.app = app
+        self.registry = registry
+        self.routes_app = routes_app
+        self._endpoints = None
+
+    def _endpoint(self, path):
+        if self._endpoints is None:
+            # Routes are only known once the app is fully defined
+            self._endpoints = {route.path for route in self.routes_app.routes}
+        # Unknown paths share one label to keep the number of series bounded
+        return path if path in self._endpoints else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        endpoint = self._endpoint(scope["path"])
+        debug = any(name == _DEBUG_HEADER_BYTES for name, _ in scope["headers"])
+        timing = RequestTiming(registry, endpoint, debug)
+        token = _current_timing.set(timing)
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if timing.last_mark is not None:
+                    timing.record("serialize", time.perf_counter() - timing.last_mark)
+                if debug:
+                    timing.entries.append((f"{registry.service}.total",
+                                           (time.perf_counter() - timing.start) * 1000))
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (_SERVER_TIMING_BYTES, timing.server_timing().encode())]
+            await send(message)
+
+        registry.in_flight.inc(registry.service, endpoint)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            registry.in_flight.dec(registry.service, endpoint)
+            registry.latency.observe(time.perf_counter() - timing.start, registry.service, endpoint)
+            registry.requests.inc(registry.service, endpoint, scope["method"], str(status[0]))
+            _current_timing.reset(token)
+
+
+def install_metrics(app, service):
+    """
+    Adds request metrics and a Prometheus ``/metrics`` endpoint to a service
+
+    Returns:
+        MetricsRegistry: The service's registry, or None if METRICS_ENABLED is false
+    """
+    if not METRICS_ENABLED:
+        logger.info("Metrics disabled")
+        return None
+
+    registry = MetricsRegistry(service)
+    app.add_middleware(MetricsMiddleware, registry=registry, routes_app=app)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    return registry
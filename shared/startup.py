@@ -0,0 +1,142 @@
+"""
+Startup phases, liveness and readiness of the pipeline services
+
+``/livez`` answers as soon as a service serves HTTP. ``/readyz`` answers
+503 until the service has finished starting up (imports, model load,
+warm-up) and 200 from then on, so orchestrators and the dashboard only
+send traffic to services that can handle it at full speed.
+
+The duration of each startup phase is logged once the service is ready,
+reported by ``/readyz`` and exported as ``pipeline_startup_phase_seconds``.
+The ``imports`` phase runs from the start of the process, interpreter
+start-up included, to the installation of the probes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+def process_start_time():
+    """Wall-clock time the current process started, or now if the OS does not tell"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the parenthesized command name; starttime is field 22 overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class Startup:
+    """
+    Startup phases and readiness of one service
+
+    Phases may run in any thread and a phase entered more than once, e.g. a
+    model load retried with a fallback, accumulates its durations.
+    """
+
+    def __init__(self, service, started_at=None, registry=None):
+        self.service = service
+        self.started_at = started_at if started_at is not None else process_start_time()
+        self.status = STARTING
+        self.error = None
+        self.phases = {"imports": max(0.0, time.time() - self.started_at)}
+        self.ready_at = None
+        self._lock = threading.Lock()
+        self._gauge = None
+        if registry is not None:
+            self._gauge = Gauge("pipeline_startup_phase_seconds", "Duration of each startup phase",
+                                ("service", "phase"))
+            registry.add(self._gauge)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def mark_ready(self):
+        self.ready_at = time.time()
+        self.status = READY
+        if self._gauge is not None:
+            for name, seconds in self.phases.items():
+                self._gauge.set(seconds, self.service, name)
+        breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        logger.info(f"{self.service} ready in {(self.ready_at - self.started_at) * 1000:.0f}ms ({breakdown})")
+
+    def mark_failed(self, error):
+        self.error = error
+        self.status = FAILED
+        logger.error(f"{self.service} failed to start: {error}")
+
+    @property
+    def ready(self):
+        return self.status == READY
+
+    def report(self):
+        with self._lock:
+            phases = {name: seconds * 1000 for name, seconds in self.phases.items()}
+        return {
+            "status": self.status,
+            "service": self.service,
+            "phases_ms": phases,
+            "startup_ms": (self.ready_at - self.started_at) * 1000 if self.ready_at is not None else None,
+            "error": self.error
+        }
+
+
+class _ProbeMiddleware:
+    """Answers the probes before any other middleware, so they stay cheap under load"""
+
+    def __init__(self, app, startup):
+        self.app = app
+        self.startup = startup
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/livez":
+            await self._respond(send, 200, {"status": "alive"})
+        elif scope["type"] == "http" and scope["path"] == "/readyz":
+            await self._respond(send, 200 if self.startup.ready else 503, self.startup.report())
+        else:
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _respond(send, status, content):
+        body = json.dumps(content, separators=(",", ":")).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def install_probes(app, service, registry=None):
+    """
+    Adds ``/livez`` and ``/readyz`` to a service and starts tracking its startup
+
+    Call it once the service's modules are imported, and install it last so
+    the probes bypass admission control and deadlines. Services with nothing
+    to load call ``mark_ready`` on startup; the others time their loading in
+    ``phase`` blocks first.
+
+    Returns:
+        Startup: The startup tracker of the service
+    """
+    startup = Startup(service, registry=registry)
+    app.add_middleware(_ProbeMiddleware, startup=startup)
+    return startup
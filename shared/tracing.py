@@ -0,0 +1,285 @@
+"""
+Trace context propagation and span export for the pipeline services
+
+Every request gets a trace ID, taken from an incoming W3C ``traceparent``
+header or generated at the first service it reaches. ServiceClient forwards
+the context to the next stage, so the spans of the four services share one
+trace ID and form a parent/child chain. The trace ID is also added to every
+log record as ``trace_id``, so log lines can be correlated across services.
+
+Only sampled traces are exported. Finished spans are queued and posted in
+batches to the dashboard's collector by a background thread, off the
+request path.
+"""
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+
+# Fraction of new traces that are exported. Requests arriving with a
+# traceparent header keep the sampling decision of their caller.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+# Dashboard endpoint receiving finished spans (empty disables export)
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "http://0.0.0.0:5000/api/traces/spans")
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "1.0"))
+# Spans waiting for export beyond this are dropped, oldest first
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000"))
+
+TRACEPARENT_HEADER = "traceparent"
+TRACE_ID_HEADER = "x-trace-id"
+_TRACEPARENT_BYTES = TRACEPARENT_HEADER.encode()
+_TRACE_ID_BYTES = TRACE_ID_HEADER.encode()
+
+
+def _new_id(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """
+    One timed unit of work in a trace
+
+    ``start`` and ``end`` are wall-clock timestamps in seconds so spans from
+    different services line up; the duration itself is measured with a
+    monotonic clock.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "sampled", "service", "name",
+                 "start", "end", "attributes", "_started")
+
+    def __init__(self, trace_id, parent_id, sampled, service, name):
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.service = service
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.attributes = {}
+        self._started = time.perf_counter()
+
+    def finish(self):
+        self.end = self.start + (time.perf_counter() - self._started)
+
+    def child(self, name):
+        return Span(self.trace_id, self.span_id, self.sampled, self.service, name)
+
+    def traceparent(self):
+        """traceparent header value making this span the parent of the next hop"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.service,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "attributes": self.attributes
+        }
+
+
+def parse_traceparent(value):
+    """
+    Parses a ``traceparent`` header value
+
+    Returns:
+        tuple: (trace_id, parent_span_id, sampled), or None if the value is malformed
+    """
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_span():
+    """Span of the request being handled, or None outside of a traced request"""
+    return _current_span.get()
+
+
+def current_trace_id():
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+
+def propagation_headers(headers=None):
+    """Adds the current trace context to the headers of an outgoing request"""
+    current = _current_span.get()
+    if current is None:
+        return headers
+    return {**(headers or {}), TRACEPARENT_HEADER: current.traceparent()}
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Records a block of in-process work as a child span of the current span
+
+    Does nothing outside of a traced request.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name)
+    child.attributes.update(attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        _current_span.reset(token)
+        child.finish()
+        if child.sampled and exporter is not None:
+            exporter.add(child)
+
+
+class SpanExporter:
+    """
+    Posts finished spans to the collector in batches from a daemon thread
+
+    Spans are dropped when the collector cannot be reached; tracing must
+    never slow down or fail a request.
+    """
+
+    def __init__(self, url, interval=1.0, queue_size=10000):
+        self.url = url
+        self.interval = interval
+        self._queue = deque(maxlen=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.failed = 0
+
+    def add(self, finished_span):
+        self._queue.append(finished_span)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def _drain(self):
+        spans = []
+        while self._queue:
+            try:
+                spans.append(self._queue.popleft().to_dict())
+            except IndexError:
+                break
+        return spans
+
+    def _run(self):
+        with httpx.Client(timeout=2.0) as client:
+            while True:
+                time.sleep(self.interval)
+                spans = self._drain()
+                if not spans:
+                    continue
+                try:
+                    client.post(self.url, json=spans).raise_for_status()
+                    self.exported += len(spans)
+                except httpx.HTTPError as e:
+                    if self.failed == 0:
+                        logger.warning(f"Could not export spans to {self.url}: {str(e)}")
+                    self.failed += len(spans)
+
+
+exporter = SpanExporter(TRACE_COLLECTOR_URL, TRACE_EXPORT_INTERVAL,
+                        TRACE_EXPORT_QUEUE_SIZE) if TRACING_ENABLED and TRACE_COLLECTOR_URL else None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a span for every request
+
+    The trace ID is returned in an ``X-Trace-Id`` response header so a slow
+    call can be looked up in the dashboard.
+    """
+
+    def __init__(self, app, service, sample_rate):
+        self.app = app
+        self.service = service
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = None
+        for name, value in scope["headers"]:
+            if name == _TRACEPARENT_BYTES:
+                context = parse_traceparent(value.decode("latin-1"))
+                break
+        if context is None:
+            context = (_new_id(128), None, random.random() < self.sample_rate)
+
+        trace_id, parent_id, sampled = context
+        request_span = Span(trace_id, parent_id, sampled, self.service, f"{scope['method']} {scope['path']}")
+        token = _current_span.set(request_span)
+        trace_id_header = (_TRACE_ID_BYTES, trace_id.encode())
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                request_span.attributes["status"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [trace_id_header]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            _current_span.reset(token)
+            request_span.finish()
+            if sampled and exporter is not None:
+                exporter.add(request_span)
+
+
+def install_tracing(app, service):
+    """
+    Opens a span for every request of a service and exports the sampled ones
+
+    Call after the service's other middleware so the span covers them too.
+    """
+    if not TRACING_ENABLED:
+        logger.info("Tracing disabled")
+        return
+    app.add_middleware(TracingMiddleware, service=service, sample_rate=TRACE_SAMPLE_RATE)
+
+
+_default_record_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs):
+    record = _default_record_factory(*args, **kwargs)
+    record.trace_id = current_trace_id() or "-"
+    return record
+
+
+# Every log record carries the trace ID, used as %(trace_id)s in the services' log format
+logging.setLogRecordFactory(_record_factory)
@@ -0,0 +1,198 @@
+import functools
+import json
+import logging
+import os
+
+import numpy as np
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+from pydantic import ValidationError
+
+try:
+    import msgpack
+except ImportError:  # JSON keeps working without the binary format
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+# Format used for batch payloads sent to the next stage: "json" or "msgpack".
+# Receiving stages accept both, and reply in the format the caller accepts.
+INTERNAL_WIRE_FORMAT = os.getenv("INTERNAL_WIRE_FORMAT", "json").lower()
+
+# Key marking an encoded ndarray inside a msgpack payload
+_NDARRAY_KEY = "__ndarray__"
+
+
+def binary_enabled():
+    if INTERNAL_WIRE_FORMAT != "msgpack":
+        return False
+    if msgpack is None:
+        logger.warning("INTERNAL_WIRE_FORMAT=msgpack but msgpack is not installed, using JSON")
+        return False
+    return True
+
+
+def _encode_default(obj):
+    if isinstance(obj, np.ndarray):
+        # Raw little-endian buffer, decoded on the other side without per-element objects
+        array = np.ascontiguousarray(obj, dtype=obj.dtype.newbyteorder("<"))
+        return {_NDARRAY_KEY: [array.dtype.str, list(array.shape), array.tobytes()]}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def _decode_hook(obj):
+    if _NDARRAY_KEY in obj:
+        dtype, shape, buffer = obj[_NDARRAY_KEY]
+        return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape)
+    return obj
+
+
+def encode(payload):
+    """Encodes a payload, keeping NumPy arrays as raw buffers"""
+    return msgpack.packb(payload, default=_encode_default, use_bin_type=True)
+
+
+def decode(body):
+    """
+    Decodes a msgpack payload. Arrays come back as read-only views on the body.
+    """
+    return msgpack.unpackb(body, object_hook=_decode_hook, raw=False)
+
+
+def is_binary(content_type):
+    return bool(content_type) and content_type.split(";")[0].strip() == MSGPACK_CONTENT_TYPE
+
+
+def accepts_binary(request):
+    return msgpack is not None and MSGPACK_CONTENT_TYPE in request.headers.get("accept", "")
+
+
+async def read_batch(request, model_class, nullable=()):
+    """
+    Reads a batch request body in either wire format
+
+    Args:
+        request: The incoming request
+        model_class: Pydantic model of the batch, the shape msgpack bodies are checked against
+        nullable: Required fields that msgpack bodies may send as nil
+
+    Returns:
+        tuple: (data, binary) where data is a validated ``model_class`` instance
+        for JSON bodies, or an object with NumPy array fields for msgpack bodies
+    """
+    body = await request.body()
+    if is_binary(request.headers.get("content-type")):
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="Binary payloads are not supported")
+        try:
+            payload = decode(body)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid msgpack payload: {str(e)}")
+        return BinaryBatch(payload, model_class, nullable), True
+
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        # Malformed JSON, or a body that is not UTF-8
+        raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {str(e)}")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Batch must be a JSON object")
+    try:
+        return model_class(**payload), False
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+
+def respond(content, binary):
+    """Response in msgpack if the caller accepts it, JSON otherwise"""
+    if binary:
+        return Response(content=encode(content), media_type=MSGPACK_CONTENT_TYPE)
+    return JSONResponse(content=to_json_compatible(content))
+
+
+def request_kwargs(payload, binary):
+    """Keyword arguments for ServiceClient.post sending ``payload`` to the next stage"""
+    if binary:
+        return {
+            "content": encode(payload),
+            "headers": {"Content-Type": MSGPACK_CONTENT_TYPE, "Accept": MSGPACK_CONTENT_TYPE}
+        }
+    return {"json": to_json_compatible(payload)}
+
+
+def read_response(response):
+    """Decodes a downstream response in whichever format it was sent"""
+    if is_binary(response.headers.get("content-type")):
+        return decode(response.content)
+    return response.json()
+
+
+def to_json_compatible(payload):
+    """Replaces NumPy arrays by lists so a payload can be sent as JSON, NaN becoming null"""
+    if isinstance(payload, dict):
+        return {key: to_json_compatible(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [to_json_compatible(value) for value in payload]
+    if isinstance(payload, np.ndarray):
+        if payload.dtype.kind == "f" and np.isnan(payload).any():
+            # Missing values and the rows that failed are NaN in arrays, which is not valid JSON
+            return np.where(np.isnan(payload), None, payload).tolist()
+        return payload.tolist()
+    if isinstance(payload, np.generic):
+        return payload.item()
+    return payload
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_fields(model_class):
+    """Required and all field names of a batch model"""
+    schema = model_class.schema()
+    return tuple(schema.get("required", [])), tuple(schema["properties"])
+
+
+class BinaryBatch:
+    """
+    Attribute access to a decoded msgpack batch, like the pydantic batch models
+
+    Only the shape of the batch is checked against ``model_class``: its
+    required fields must be set (or nil, for those in ``nullable``), every
+    field must hold one entry per row, a required ``features`` field must
+    be an array, and arrays must be 2-D and numeric.
+
+    Raises:
+        HTTPException: 422 if the payload does not have the shape of a batch
+    """
+
+    def __init__(self, payload, model_class, nullable=()):
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=422, detail="Batch must be a msgpack map")
+        required, names = _batch_fields(model_class)
+        missing = [name for name in required
+                   if name not in payload or (payload[name] is None and name not in nullable)]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Missing batch fields: {', '.join(missing)}")
+        fields = {name: payload.get(name) for name in names}
+        # Batches to score hold an array; echoed features may be ragged lists
+        if "features" in required and not isinstance(fields["features"], np.ndarray):
+            raise HTTPException(status_code=422, detail="Batch features must be a 2-D numeric array")
+        lengths = set()
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, np.ndarray):
+                if value.ndim != 2 or not np.issubdtype(value.dtype, np.number):
+                    raise HTTPException(status_code=422, detail=f"Batch {name} must be a 2-D numeric array")
+            elif not isinstance(value, list):
+                raise HTTPException(status_code=422, detail=f"Batch {name} must be a list")
+            lengths.add(len(value))
+        if len(lengths) > 1:
+            raise HTTPException(status_code=422, detail="Batch fields must all have the same length")
+        self.__dict__.update(fields)
+
+    def dict(self):
+        return dict(self.__dict__)
@@ -1,10 +1,23 @@
 document.addEventListener('DOMContentLoaded', function() {
-    // Fetch services status on page load
+    // Fetch services status on page load, then follow status changes
     fetchServicesStatus();
+    subscribeServicesStatus();
 
     // Add event listener for refresh button
     document.getElementById('refreshStatus').addEventListener('click', fetchServicesStatus);
 
+    // Load test form, live chart and past results
+    document.getElementById('loadTestForm').addEventListener('submit', function(event) {
+        event.preventDefault();
+        startLoadTest();
+    });
+    document.getElementById('stopLoadTest').addEventListener('click', stopLoadTest);
+    fetchLoadTests();
+
+    // Fetch the slowest recent traces on page load and on refresh
+    fetchTraces();
+    document.getElementById('refreshTraces').addEventListener('click', fetchTraces);
+
     // Add event listener for inference form
     document.getElementById('inferenceForm').addEventListener('submit', function(event) {
         event.preventDefault();
@@ -58,6 +71,23 @@ function fetchServicesStatus() {
         });
 }
 
+/**
+ * Receive status changes from the server as they happen instead of polling
+ */
+function subscribeServicesStatus() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    const source = new EventSource('/api/services/stream');
+    source.onmessage = function(event) {
+        const data = JSON.parse(event.data);
+        displayServicesStatus(data);
+        updateArchitectureDiagram(data);
+    };
+    // EventSource reconnects on its own after an error
+}
+
 /**
  * Display the status of all microservices
  */
@@ -84,9 +114,18 @@ function displayServicesStatus(services) {
                 </div>
                 <div class="card-body">
                     <p class="card-text small">${serviceData.info.description}</p>
-                    <p class="card-text small mb-0">
+                    <p class="card-text small mb-1">
                         <strong>URL:</strong> ${serviceData.info.url}
                     </p>
+                    <p class="card-text small mb-1">
+                        <strong>Check latency:</strong> ${serviceData.health.latency_ms.toFixed(1)} ms
+                    </p>
+                    <p class="card-text small mb-0">
+                        <strong>${isHealthy ? 'Healthy' : 'Unhealthy'} since:</strong>
+                        ${new Date(serviceData.health.last_change * 1000).toLocaleTimeString()}
+                    </p>
+                    ${formatCircuitBreakers(serviceData.health.circuit_breakers)}
+                    ${formatReplicas(serviceData.health.replicas)}
                 </div>
             </div>
         `;
@@ -95,6 +134,52 @@ function displayServicesStatus(services) {
     }
 }
 
+/**
+ * Format the circuit breaker state of each downstream service a service calls
+ */
+function formatCircuitBreakers(breakers) {
+    if (!breakers || Object.keys(breakers).length === 0) {
+        return '';
+    }
+    const badgeClasses = {closed: 'success', half_open: 'warning', open: 'danger'};
+    return Object.entries(breakers).map(([downstream, breaker]) => `
+        <p class="card-text small mb-0 mt-1">
+            <strong>Breaker to ${formatServiceName(downstream)}:</strong>
+            <span class="badge bg-${badgeClasses[breaker.state] || 'secondary'}">${breaker.state.replace('_', '-')}</span>
+            <span class="text-muted">${breaker.window_failures}/${breaker.window_calls} failed, ${breaker.rejected} skipped</span>
+        </p>
+    `).join('');
+}
+
+/**
+ * Format the health and load of each replica of a service, and of its balancer
+ */
+function formatReplicas(stage) {
+    if (!stage || !stage.balanced) {
+        return '';
+    }
+    const badgeClasses = {ready: 'success', starting: 'info', pending: 'secondary', draining: 'warning', unready: 'warning'};
+    const balancer = stage.balancer;
+    const autoscale = stage.autoscale
+        ? `, autoscaling ${stage.min_replicas}-${stage.max_replicas} at ${stage.autoscale.queue_ms.toFixed(0)}/${stage.autoscale.target_queue_ms} ms queued`
+        : '';
+    const rows = stage.replicas.map(replica => `
+        <li>
+            <span class="badge bg-${badgeClasses[replica.status] || 'danger'}">${replica.status}</span>
+            #${replica.index} :${replica.port}
+            <span class="text-muted">${replica.outstanding} in flight, ${replica.requests} served,
+                ${replica.latency_ms.toFixed(1)} ms${replica.restarts ? `, ${replica.restarts} restarts` : ''}</span>
+        </li>
+    `).join('');
+    return `
+        <p class="card-text small mb-0 mt-1">
+            <strong>Replicas (${balancer.policy.replace('_', ' ')}):</strong>
+            <span class="text-muted">${balancer.queued} queued, ${formatMs(balancer.mean_queue_wait_ms)} mean wait${autoscale}</span>
+        </p>
+        <ul class="list-unstyled small mb-0">${rows}</ul>
+    `;
+}
+
 /**
  * Update the architecture diagram based on service status
  */
@@ -159,6 +244,11 @@ function runInference() {
     })
     .then(data => {
         displayInferenceResults(data);
+        // The test request is always traced, show it alongside the slowest ones
+        fetchTraces();
+        if (data.trace_id) {
+            showTrace(data.trace_id);
+        }
     })
     .catch(error => {
         document.getElementById('inferenceResults').innerHTML = `
@@ -215,8 +305,9 @@ function displayInferenceResults(data) {
         resultsHtml += `
             <h5 class="border-bottom pb-2 mt-4">Preprocessing Details</h5>
             <div class="small">
+                ${data.preprocessing_info.mode ? `<div><strong>Mode:</strong> ${data.preprocessing_info.mode}</div>` : `
                 <div><strong>Mean:</strong> ${data.preprocessing_info.mean.toFixed(4)}</div>
-                <div><strong>Std:</strong> ${data.preprocessing_info.std.toFixed(4)}</div>
+                <div><strong>Std:</strong> ${data.preprocessing_info.std.toFixed(4)}</div>`}
                 <div><strong>Missing Values Replaced:</strong> ${data.preprocessing_info.replaced_missing ? 'Yes' : 'No'}</div>
             </div>
         `;
@@ -252,3 +343,350 @@ function displayInferenceResults(data) {
     // Update the results container
     document.getElementById('inferenceResults').innerHTML = resultsHtml;
 }
+
+/**
+ * Fetch the slowest recently collected traces
+ */
+function fetchTraces() {
+    fetch('/api/traces?limit=10')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(traces => {
+            displayTraces(traces);
+        })
+        .catch(error => {
+            document.getElementById('tracesList').innerHTML = `
+                <div class="alert alert-danger">
+                    <i class="fas fa-exclamation-circle me-2"></i>
+                    Error fetching traces: ${error.message}
+                </div>
+            `;
+        });
+}
+
+/**
+ * Display the list of slowest traces, each row opening its waterfall
+ */
+function displayTraces(traces) {
+    const tracesList = document.getElementById('tracesList');
+    if (traces.length === 0) {
+        tracesList.innerHTML = `
+            <div class="alert alert-info">
+                <i class="fas fa-info-circle me-2"></i>No traces collected yet.
+            </div>
+        `;
+        return;
+    }
+
+    let rowsHtml = '';
+    for (const trace of traces) {
+        rowsHtml += `
+            <tr class="cursor-pointer" data-trace-id="${trace.trace_id}">
+                <td><code>${trace.trace_id.slice(0, 12)}</code></td>
+                <td>${trace.root}</td>
+                <td>${new Date(trace.start * 1000).toLocaleTimeString()}</td>
+                <td>${trace.spans}</td>
+                <td class="text-end">${trace.duration_ms.toFixed(2)} ms</td>
+            </tr>
+        `;
+    }
+
+    tracesList.innerHTML = `
+        <table class="table table-sm table-hover small">
+            <thead>
+                <tr><th>Trace</th><th>Root</th><th>Started</th><th>Spans</th><th class="text-end">Duration</th></tr>
+            </thead>
+            <tbody>${rowsHtml}</tbody>
+        </table>
+    `;
+
+    tracesList.querySelectorAll('tr[data-trace-id]').forEach(row => {
+        row.addEventListener('click', () => showTrace(row.dataset.traceId));
+    });
+}
+
+/**
+ * Show the spans of one trace as a waterfall
+ */
+function showTrace(traceId) {
+    fetch(`/api/traces/${traceId}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(trace => {
+            displayWaterfall(trace);
+        })
+        .catch(error => {
+            document.getElementById('traceWaterfall').innerHTML = `
+                <div class="alert alert-warning">
+                    <i class="fas fa-exclamation-triangle me-2"></i>
+                    Trace ${traceId.slice(0, 12)} not available yet: ${error.message}
+                </div>
+            `;
+        });
+}
+
+/**
+ * Draw one bar per span, offset and sized relative to the whole trace
+ */
+function displayWaterfall(trace) {
+    const totalMs = Math.max(trace.duration_ms, 0.001);
+
+    // Indent each span below its parent
+    const depths = {};
+    for (const span of trace.spans) {
+        depths[span.span_id] = span.parent_id in depths ? depths[span.parent_id] + 1 : 0;
+    }
+
+    let barsHtml = '';
+    for (const span of trace.spans) {
+        const offsetMs = (span.start - trace.start) * 1000;
+        const durationMs = (span.end - span.start) * 1000;
+        barsHtml += `
+            <div class="waterfall-row">
+                <div class="waterfall-label small" style="padding-left: ${depths[span.span_id]}rem">
+                    ${formatServiceName(span.service)} <span class="text-muted">${span.name}</span>
+                </div>
+                <div class="waterfall-track">
+                    <div class="waterfall-bar bg-info"
+                         style="left: ${offsetMs / totalMs * 100}%; width: ${Math.max(durationMs / totalMs * 100, 0.5)}%"
+                         title="${durationMs.toFixed(3)} ms"></div>
+                </div>
+                <div class="waterfall-duration small text-end">${durationMs.toFixed(2)} ms</div>
+            </div>
+        `;
+    }
+
+    document.getElementById('traceWaterfall').innerHTML = `
+        <h6 class="border-bottom pb-2 mt-3">
+            Trace <code>${trace.trace_id}</code>
+            <span class="badge bg-secondary ms-2">${trace.duration_ms.toFixed(2)} ms</span>
+        </h6>
+        ${barsHtml}
+    `;
+}
+
+// Live samples of the load test being watched
+let loadTestRunId = null;
+let loadTestPoints = [];
+
+/**
+ * Start a load test with the form values and follow its progress
+ */
+function startLoadTest() {
+    const params = {
+        concurrency: parseInt(document.getElementById('loadConcurrency').value),
+        duration: parseFloat(document.getElementById('loadDuration').value),
+        batch_size: parseInt(document.getElementById('loadBatchSize').value),
+        num_features: parseInt(document.getElementById('loadNumFeatures').value),
+        label: document.getElementById('loadLabel').value || null
+    };
+
+    fetch('/api/load-tests', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(params),
+    })
+    .then(response => response.json().then(data => {
+        if (!response.ok) {
+            throw new Error(data.error || `HTTP error! Status: ${response.status}`);
+        }
+        return data;
+    }))
+    .then(data => {
+        watchLoadTest(data.run_id, data.label);
+    })
+    .catch(error => {
+        document.getElementById('loadTestStatus').innerHTML = `
+            <div class="alert alert-danger">
+                <i class="fas fa-exclamation-circle me-2"></i>
+                Error starting load test: ${error.message}
+            </div>
+        `;
+    });
+}
+
+/**
+ * Stop the load test being watched
+ */
+function stopLoadTest() {
+    if (loadTestRunId) {
+        fetch(`/api/load-tests/${loadTestRunId}/stop`, {method: 'POST'});
+    }
+}
+
+/**
+ * Receive live statistics of a load test until it finishes
+ */
+function watchLoadTest(runId, label) {
+    loadTestRunId = runId;
+    loadTestPoints = [];
+    document.getElementById('startLoadTest').disabled = true;
+    document.getElementById('stopLoadTest').disabled = false;
+
+    const source = new EventSource(`/api/load-tests/${runId}/stream`);
+    source.onmessage = function(event) {
+        const live = JSON.parse(event.data);
+        loadTestPoints.push(live);
+        document.getElementById('loadTestStatus').innerHTML = `
+            <div class="small">
+                <strong>${label}</strong>: ${live.elapsed_s.toFixed(0)}s,
+                ${live.requests} requests, ${live.errors} errors,
+                ${live.throughput_rps.toFixed(1)} req/s,
+                p50 ${formatMs(live.p50_ms)}, p90 ${formatMs(live.p90_ms)}, p99 ${formatMs(live.p99_ms)}
+                <span class="text-muted">(last 5s)</span>
+            </div>
+        `;
+        drawLoadTestChart(loadTestPoints);
+    };
+    source.addEventListener('done', function(event) {
+        source.close();
+        const summary = JSON.parse(event.data);
+        document.getElementById('loadTestStatus').innerHTML = `
+            <div class="alert alert-${summary.state === 'failed' ? 'danger' : 'success'} small mb-0">
+                <strong>${summary.label}</strong> ${summary.state}: ${summary.requests} requests,
+                ${summary.throughput_rps.toFixed(1)} req/s, p50 ${formatMs(summary.p50_ms)},
+                p99 ${formatMs(summary.p99_ms)}, error rate ${(summary.error_rate * 100).toFixed(2)}%
+            </div>
+        `;
+        document.getElementById('startLoadTest').disabled = false;
+        document.getElementById('stopLoadTest').disabled = true;
+        loadTestRunId = null;
+        fetchLoadTests();
+    });
+}
+
+/**
+ * Format a latency in milliseconds, which is null when there were no requests
+ */
+function formatMs(value) {
+    return value === null ? '-' : `${value.toFixed(1)} ms`;
+}
+
+/**
+ * Draw throughput and latency percentiles over time, each scaled to its own axis
+ */
+function drawLoadTestChart(points) {
+    const canvas = document.getElementById('loadTestChart');
+    const width = canvas.width = canvas.clientWidth;
+    const height = canvas.height;
+    const context = canvas.getContext('2d');
+    context.clearRect(0, 0, width, height);
+    if (points.length < 2) {
+        return;
+    }
+
+    const padding = 30;
+    const maxTime = Math.max(points[points.length - 1].elapsed_s, 1);
+    const maxLatency = Math.max(...points.map(p => p.p99_ms || 0), 1);
+    const maxThroughput = Math.max(...points.map(p => p.throughput_rps), 1);
+    const series = [
+        {key: 'throughput_rps', max: maxThroughput, color: '#0dcaf0', name: `req/s (max ${maxThroughput.toFixed(0)})`},
+        {key: 'p50_ms', max: maxLatency, color: '#20c997', name: 'p50'},
+        {key: 'p90_ms', max: maxLatency, color: '#ffc107', name: 'p90'},
+        {key: 'p99_ms', max: maxLatency, color: '#dc3545', name: `p99 (max ${maxLatency.toFixed(0)} ms)`}
+    ];
+
+    series.forEach((line, i) => {
+        context.strokeStyle = line.color;
+        context.lineWidth = 2;
+        context.beginPath();
+        points.forEach((point, j) => {
+            const x = padding + (point.elapsed_s / maxTime) * (width - 2 * padding);
+            const y = height - padding - ((point[line.key] || 0) / line.max) * (height - 2 * padding);
+            if (j === 0) {
+                context.moveTo(x, y);
+            } else {
+                context.lineTo(x, y);
+            }
+        });
+        context.stroke();
+
+        context.fillStyle = line.color;
+        context.font = '12px sans-serif';
+        context.fillText(line.name, padding + i * 150, 15);
+    });
+
+    context.fillStyle = '#adb5bd';
+    context.fillText(`${maxTime.toFixed(0)}s`, width - padding - 10, height - 10);
+}
+
+/**
+ * Fetch the results of past load tests, and follow a test already running
+ */
+function fetchLoadTests() {
+    fetch('/api/load-tests')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            displayLoadTestResults(data.results);
+            if (data.running && !loadTestRunId) {
+                watchLoadTest(data.running.run_id, 'Running load test');
+            }
+        })
+        .catch(error => {
+            document.getElementById('loadTestResults').innerHTML = `
+                <div class="alert alert-danger">
+                    <i class="fas fa-exclamation-circle me-2"></i>
+                    Error fetching load test results: ${error.message}
+                </div>
+            `;
+        });
+}
+
+/**
+ * Display past load test results, newest first, for comparing runs
+ */
+function displayLoadTestResults(results) {
+    if (results.length === 0) {
+        document.getElementById('loadTestResults').innerHTML = `
+            <p class="small text-muted mb-0">No load tests run yet.</p>
+        `;
+        return;
+    }
+
+    let rowsHtml = '';
+    for (const result of results.slice().reverse()) {
+        rowsHtml += `
+            <tr>
+                <td>${result.label}</td>
+                <td>${new Date(result.started_at * 1000).toLocaleString()}</td>
+                <td>${result.concurrency}</td>
+                <td>${result.batch_size}</td>
+                <td class="text-end">${result.throughput_rps.toFixed(1)}</td>
+                <td class="text-end">${result.rows_per_s.toFixed(0)}</td>
+                <td class="text-end">${formatMs(result.p50_ms)}</td>
+                <td class="text-end">${formatMs(result.p90_ms)}</td>
+                <td class="text-end">${formatMs(result.p99_ms)}</td>
+                <td class="text-end">${(result.error_rate * 100).toFixed(2)}%</td>
+            </tr>
+        `;
+    }
+
+    document.getElementById('loadTestResults').innerHTML = `
+        <table class="table table-sm small">
+            <thead>
+                <tr>
+                    <th>Label</th><th>Started</th><th>Concurrency</th><th>Rows</th>
+                    <th class="text-end">req/s</th><th class="text-end">rows/s</th>
+                    <th class="text-end">p50</th><th class="text-end">p90</th><th class="text-end">p99</th>
+                    <th class="text-end">Errors</th>
+                </tr>
+            </thead>
+            <tbody>${rowsHtml}</tbody>
+        </table>
+    `;
+}
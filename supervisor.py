@@ -0,0 +1,740 @@
+"""
+Replicas of the pipeline stages, supervised and load balanced from the dashboard
+
+Each stage runs SERVICE_REPLICAS processes, or e.g. INFERENCE_REPLICAS for
+the inference stage. A stage with a single replica runs it on the stage's
+own port, as before. A stage with several replicas runs them on
+127.0.0.1 from REPLICA_BASE_PORT on, behind a balancer listening on the
+stage's port, so the other stages and clients keep using the same URLs.
+
+The balancer sends each request to a ready replica, in turn
+(``round_robin``) or to the one with the fewest requests in flight
+(``least_outstanding``). A replica handles at most BALANCER_MAX_OUTSTANDING
+requests at once; the others wait in the balancer, which turns them away
+with a 503 once the queue is full or their wait is over. The time spent
+in that queue is what the autoscaler watches: with AUTOSCALE_ENABLED it
+adds a replica while requests wait longer than AUTOSCALE_TARGET_QUEUE_MS,
+and drains and removes one while the replicas are mostly idle.
+
+A monitor thread checks every replica's ``/readyz``. Replicas that are not
+ready get no traffic, replicas that exit are restarted with an increasing
+backoff, and replicas that stop answering altogether are killed and
+restarted.
+"""
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+import uvicorn
+
+from shared.deadline import DEADLINE_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Replicas per stage, overridden per stage by <STAGE>_REPLICAS, e.g. INFERENCE_REPLICAS
+SERVICE_REPLICAS = int(os.environ.get("SERVICE_REPLICAS", "1"))
+
+# How the balancer of a replicated stage picks a replica: "least_outstanding" or "round_robin"
+BALANCER_POLICY = os.environ.get("BALANCER_POLICY", "least_outstanding").lower()
+# Requests in flight per replica. Kept below ADMISSION_MAX_IN_FLIGHT, so the
+# backlog waits in the balancer, where any replica can pick it up
+BALANCER_MAX_OUTSTANDING = int(os.environ.get("BALANCER_MAX_OUTSTANDING", "32"))
+BALANCER_MAX_QUEUE = int(os.environ.get("BALANCER_MAX_QUEUE", "1024"))
+BALANCER_MAX_QUEUE_WAIT_MS = float(os.environ.get("BALANCER_MAX_QUEUE_WAIT_MS", "5000"))
+BALANCER_CONNECT_TIMEOUT = float(os.environ.get("BALANCER_CONNECT_TIMEOUT", "2"))
+
+# Replicas behind a balancer listen from this port on, 100 ports per stage
+REPLICA_BASE_PORT = int(os.environ.get("REPLICA_BASE_PORT", "9000"))
+# Seconds between readiness checks of the replicas
+REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", "2"))
+# Delay before restarting a replica that exited, doubled after each crash shortly after a start
+REPLICA_RESTART_BACKOFF = float(os.environ.get("REPLICA_RESTART_BACKOFF", "1"))
+REPLICA_RESTART_BACKOFF_MAX = float(os.environ.get("REPLICA_RESTART_BACKOFF_MAX", "30"))
+# Consecutive unanswered checks after which a ready replica is considered hung and restarted
+REPLICA_LIVENESS_FAILURES = int(os.environ.get("REPLICA_LIVENESS_FAILURES", "3"))
+# Seconds a replica being removed gets to finish the requests it holds
+REPLICA_DRAIN_TIMEOUT = float(os.environ.get("REPLICA_DRAIN_TIMEOUT", "30"))
+
+# Adds replicas while requests wait in the balancer longer than the target,
+# removes one while the replicas use less than AUTOSCALE_SCALE_DOWN_UTILIZATION
+# of their outstanding requests. Every stage is balanced when enabled.
+AUTOSCALE_ENABLED = os.environ.get("AUTOSCALE_ENABLED", "false").lower() == "true"
+AUTOSCALE_MIN_REPLICAS = int(os.environ.get("AUTOSCALE_MIN_REPLICAS", "1"))
+AUTOSCALE_MAX_REPLICAS = int(os.environ.get("AUTOSCALE_MAX_REPLICAS", "4"))
+AUTOSCALE_TARGET_QUEUE_MS = float(os.environ.get("AUTOSCALE_TARGET_QUEUE_MS", "50"))
+AUTOSCALE_SCALE_DOWN_UTILIZATION = float(os.environ.get("AUTOSCALE_SCALE_DOWN_UTILIZATION", "0.25"))
+AUTOSCALE_INTERVAL = float(os.environ.get("AUTOSCALE_INTERVAL", "10"))
+AUTOSCALE_COOLDOWN = float(os.environ.get("AUTOSCALE_COOLDOWN", "30"))
+
+# Replica states
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+UNREADY = "unready"
+FAILED = "failed"
+CRASHED = "crashed"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+# Weight of the latest request in a replica's moving average latency
+_LATENCY_ALPHA = 0.05
+
+# Headers that apply to a single connection and are not forwarded
+_HOP_BY_HOP = {b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization", b"te",
+               b"trailer", b"trailers", b"transfer-encoding", b"upgrade", b"host"}
+_DEADLINE_BYTES = DEADLINE_HEADER.encode()
+
+
+def replica_count(stage_name):
+    return max(1, int(os.environ.get(f"{stage_name.upper()}_REPLICAS", SERVICE_REPLICAS)))
+
+
+class Replica:
+    """One process of a stage"""
+
+    def __init__(self, stage, index, port):
+        self.stage = stage
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = None
+        self.status = PENDING
+        self.report = None
+        self.restarts = 0
+        self.started_at = None
+        self.ready_at = None
+        self.restart_at = None
+        self.backoff = REPLICA_RESTART_BACKOFF
+        self.failed_checks = 0
+        self.drain_deadline = None
+        # Updated by the balancer
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency = 0.0
+
+    @property
+    def available(self):
+        return self.status == READY
+
+    def start(self):
+        host = "127.0.0.1" if self.stage.balanced else "0.0.0.0"
+        env = {**os.environ, **self.stage.env, **(self.stage.follower_env if self.index else {})}
+        self.process = subprocess.Popen(
+            ["python", "-m", "uvicorn", "main:app", "--host", host, "--port", str(self.port)],
+            cwd=self.stage.directory,
+            env=env
+        )
+        self.started_at = time.monotonic()
+        self.ready_at = None
+        self.report = None
+        self.failed_checks = 0
+        self.status = STARTING
+
+    def snapshot(self):
+        return {
+            "index": self.index,
+            "port": self.port,
+            "pid": self.process.pid if self.process is not None else None,
+            "status": self.status,
+            "restarts": self.restarts,
+            "uptime_s": time.monotonic() - self.started_at if self.started_at is not None else None,
+            "startup_ms": self.report.get("startup_ms") if self.report else None,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": self.latency * 1000
+        }
+
+
+class Stage:
+    """
+    A pipeline stage and its replicas
+
+    Args:
+        name (str): Name of the stage, e.g. ``inference``
+        directory (str): Directory of the stage's ``main:app``
+        port (int): Port the stage is reached on
+        position (int): Position of the stage, which picks its replica port range
+        env (dict): Environment variables of every replica
+        follower_env (dict): Environment variables of every replica but the first
+        pinned_prefixes (tuple): Paths always sent to the first replica, for state it alone holds
+    """
+
+    def __init__(self, name, directory, port, position, env=None, follower_env=None, pinned_prefixes=()):
+        self.name = name
+        self.directory = directory
+        self.port = port
+        self.env = env or {}
+        self.follower_env = follower_env or {}
+        self.pinned_prefixes = tuple(pinned_prefixes)
+        initial = replica_count(name)
+        if AUTOSCALE_ENABLED:
+            self.min_replicas = max(1, AUTOSCALE_MIN_REPLICAS)
+            self.max_replicas = max(self.min_replicas, AUTOSCALE_MAX_REPLICAS)
+            initial = min(max(initial, self.min_replicas), self.max_replicas)
+        else:
+            self.min_replicas = self.max_replicas = initial
+        self.balanced = initial > 1 or AUTOSCALE_ENABLED
+        self._base_port = REPLICA_BASE_PORT + 100 * position
+        self._next_index = 0
+        self.replicas = []
+        for _ in range(initial):
+            self.replicas = self.replicas + [self._new_replica()]
+        self.balancer = Balancer(self) if self.balanced else None
+        # Autoscaler state
+        self.last_scaled = time.monotonic()
+        self.queue_ms = 0.0
+        self.utilization = 0.0
+        self._load_samples = []
+        self._last_dispatched = 0
+        self._last_queue_wait = 0.0
+
+    def _new_replica(self):
+        index = self._next_index
+        self._next_index += 1
+        port = self._base_port + index % 100 if self.balanced or index else self.port
+        return Replica(self, index, port)
+
+    @property
+    def active_replicas(self):
+        return [replica for replica in self.replicas if replica.status not in (DRAINING, STOPPED)]
+
+    def snapshot(self):
+        snapshot = {
+            "balanced": self.balanced,
+            "replicas": [replica.snapshot() for replica in self.replicas],
+            "min_replicas": self.min_replicas,
+            "max_replicas": self.max_replicas
+        }
+        if self.balancer is not None:
+            snapshot["balancer"] = self.balancer.stats()
+        if AUTOSCALE_ENABLED:
+            snapshot["autoscale"] = {"queue_ms": self.queue_ms, "utilization": self.utilization,
+                                     "target_queue_ms": AUTOSCALE_TARGET_QUEUE_MS}
+        return snapshot
+
+
+class NoReplicaAvailable(Exception):
+    """Raised when a request cannot be given a replica"""
+
+
+class Balancer:
+    """
+    ASGI app forwarding the requests of a stage to its replicas
+
+    Runs on the supervisor's event loop; the monitor thread changes replica
+    states and calls ``wake`` from its own thread.
+    """
+
+    def __init__(self, stage, policy=BALANCER_POLICY, max_outstanding=BALANCER_MAX_OUTSTANDING,
+                 max_queue=BALANCER_MAX_QUEUE, max_queue_wait=BALANCER_MAX_QUEUE_WAIT_MS / 1000):
+        if policy not in ("least_outstanding", "round_robin"):
+            raise ValueError(f"Unknown balancer policy: {policy}")
+        self.stage = stage
+        self.policy = policy
+        self.max_outstanding = max_outstanding
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.dispatched = 0
+        self.queue_wait_total = 0.0
+        self.rejected = {"no_replica": 0, "queue_full": 0, "queue_timeout": 0}
+        self.loop = None
+        self.client = None
+        self._queue = deque()
+        self._cursor = 0
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=BALANCER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    def wake(self):
+        """Hands queued requests to replicas that became available, from any thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._dispatch)
+
+    def _pick(self):
+        replicas = self.stage.replicas
+        count = len(replicas)
+        best = None
+        for offset in range(count):
+            replica = replicas[(self._cursor + offset) % count]
+            if not replica.available or replica.outstanding >= self.max_outstanding:
+                continue
+            if self.policy == "round_robin":
+                best = replica
+                break
+            if best is None or replica.outstanding < best.outstanding:
+                best = replica
+        if best is not None:
+            self._cursor = (replicas.index(best) + 1) % count
+            best.outstanding += 1
+        return best
+
+    def _dispatch(self):
+        while self._queue:
+            future, _ = self._queue[0]
+            if future.done():
+                self._queue.popleft()
+                continue
+            replica = self._pick()
+            if replica is None:
+                return
+            self._queue.popleft()
+            future.set_result(replica)
+
+    def _expire(self, entry):
+        future = entry[0]
+        if not future.done():
+            self._queue.remove(entry)
+            self.rejected["queue_timeout"] += 1
+            future.set_exception(NoReplicaAvailable(f"No {self.stage.name} replica freed up in time"))
+
+    async def _acquire(self, max_wait):
+        """
+        Waits for a replica with a free slot, for at most ``max_wait`` seconds
+
+        Returns:
+            tuple: The replica and the seconds spent waiting for it
+        """
+        replica = None if self._queue else self._pick()
+        if replica is not None:
+            self.dispatched += 1
+            return replica, 0.0
+        if len(self._queue) >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise NoReplicaAvailable(f"Too many requests waiting for a {self.stage.name} replica")
+
+        entry = (self.loop.create_future(), time.perf_counter())
+        self._queue.append(entry)
+        timer = self.loop.call_later(max(0.0, min(self.max_queue_wait, max_wait)), self._expire, entry)
+        try:
+            replica = await entry[0]
+        except asyncio.CancelledError:
+            # The client went away; give back a replica handed over in the meantime
+            if entry[0].done() and not entry[0].cancelled() and entry[0].exception() is None:
+                self._release(entry[0].result())
+            elif entry in self._queue:
+                self._queue.remove(entry)
+            raise
+        finally:
+            timer.cancel()
+        waited = time.perf_counter() - entry[1]
+        self.dispatched += 1
+        self.queue_wait_total += waited
+        return replica, waited
+
+    def _pinned(self):
+        replica = self.stage.replicas[0]
+        if not replica.available:
+            self.rejected["no_replica"] += 1
+            raise NoReplicaAvailable(f"{self.stage.name} replica 0 is not ready")
+        replica.outstanding += 1
+        self.dispatched += 1
+        return replica, 0.0
+
+    def _release(self, replica):
+        replica.outstanding -= 1
+        self._dispatch()
+
+    def oldest_wait(self):
+        """Seconds the oldest queued request has been waiting"""
+        try:
+            return time.perf_counter() - self._queue[0][1]
+        except IndexError:
+            return 0.0
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "port": self.stage.port,
+            "queued": len(self._queue),
+            "max_outstanding": self.max_outstanding,
+            "dispatched": self.dispatched,
+            "mean_queue_wait_ms": self.queue_wait_total / self.dispatched * 1000 if self.dispatched else 0.0,
+            "rejected": dict(self.rejected)
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        headers = [(name, value) for name, value in scope["headers"] if name not in _HOP_BY_HOP]
+        budget_ms = None
+        for name, value in headers:
+            if name == _DEADLINE_BYTES:
+                try:
+                    budget_ms = float(value)
+                except ValueError:
+                    pass
+        has_body = any(name in (b"content-length", b"transfer-encoding") for name, _ in scope["headers"])
+        body = _RequestBody(receive) if has_body else None
+        pinned = scope["path"].startswith(self.stage.pinned_prefixes) if self.stage.pinned_prefixes else False
+
+        attempts = len(self.stage.replicas)
+        while True:
+            try:
+                max_wait = self.max_queue_wait if budget_ms is None else budget_ms / 1000
+                replica, waited = self._pinned() if pinned else await self._acquire(max_wait)
+            except NoReplicaAvailable as e:
+                await _respond(send, 503, str(e), retry_after=1)
+                return
+            if budget_ms is not None:
+                # Time spent queued here counts against the request's deadline
+                budget_ms -= waited * 1000
+                headers = [(name, str(int(budget_ms)).encode() if name == _DEADLINE_BYTES else value)
+                           for name, value in headers]
+            start = time.perf_counter()
+            try:
+                try:
+                    response = await self._send(replica, scope, headers, body)
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    replica.errors += 1
+                    # Kept out of the rotation until the monitor sees it ready again
+                    if replica.status == READY:
+                        replica.status = UNREADY
+                    attempts -= 1
+                    if attempts > 0 and not pinned and (body is None or not body.started):
+                        logger.warning(f"Could not reach {self.stage.name} replica {replica.index}, "
+                                       f"retrying on another one")
+                        continue
+                    await _respond(send, 502, f"Could not reach {self.stage.name} replica {replica.index}: {e}")
+                    return
+                except httpx.HTTPError as e:
+                    replica.errors += 1
+                    await _respond(send, 502, f"Error forwarding to {self.stage.name} replica {replica.index}: {e}")
+                    return
+                try:
+                    await self._relay(replica, response, send)
+                except httpx.HTTPError as e:
+                    # The response has started, all that can be done is cutting it short
+                    replica.errors += 1
+                    logger.warning(f"Error relaying the response of {self.stage.name} replica {replica.index}: {e}")
+                    return
+                replica.latency += _LATENCY_ALPHA * (time.perf_counter() - start - replica.latency)
+                return
+            finally:
+                replica.requests += 1
+                self._release(replica)
+
+    async def _send(self, replica, scope, headers, body):
+        path = scope.get("raw_path") or scope["path"].encode()
+        if scope["query_string"]:
+            path += b"?" + scope["query_string"]
+        request = self.client.build_request(
+            scope["method"], replica.url + path.decode("latin-1"), headers=headers,
+            content=body.chunks() if body is not None else None
+        )
+        return await self.client.send(request, stream=True)
+
+    @staticmethod
+    async def _relay(replica, response, send):
+        try:
+            headers = [(name, value) for name, value in response.headers.raw if name.lower() not in _HOP_BY_HOP]
+            headers.append((b"x-pipeline-replica", str(replica.index).encode()))
+            await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
+
+
+class _RequestBody:
+    """Request body streamed to the replica, which cannot be sent again once started"""
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.started = False
+
+    async def chunks(self):
+        self.started = True
+        more_body = True
+        while more_body:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise httpx.ReadError("Client disconnected")
+            more_body = message.get("more_body", False)
+            yield message.get("body", b"")
+
+
+async def _respond(send, status, detail, retry_after=None):
+    body = json.dumps({"detail": detail}, separators=(",", ":")).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class Supervisor:
+    """
+    Starts the replicas of every stage, keeps them running and balances traffic across them
+
+    Args:
+        stages (list): The Stage of every process-backed stage
+    """
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        self.started = False
+        self._changed = threading.Condition()
+        self._stopping = threading.Event()
+        self._monitor = None
+        self._loop = None
+        self._balancer_thread = None
+        self._servers = []
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="replica-check")
+        self._last_autoscale = time.monotonic()
+
+    def start(self):
+        """Starts the first replica of every stage, the balancers and the monitor"""
+        self.started = True
+        for stage in self.stages.values():
+            if stage.balanced:
+                logger.info(f"Starting {stage.name} with {len(stage.replicas)} replicas behind a "
+                            f"{stage.balancer.policy} balancer on port {stage.port}...")
+            else:
+                logger.info(f"Starting {stage.name} on port {stage.port}...")
+            # The other replicas start once the first is ready, so one-time
+            # setup such as generating a missing model file happens once
+            stage.replicas[0].start()
+
+        if any(stage.balanced for stage in self.stages.values()):
+            self._loop = asyncio.new_event_loop()
+            self._balancer_thread = threading.Thread(target=self._run_balancers, name="balancers", daemon=True)
+            self._balancer_thread.start()
+
+        self._monitor = threading.Thread(target=self._run_monitor, name="replica-monitor", daemon=True)
+        self._monitor.start()
+
+    def _run_balancers(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve_balancers())
+
+    async def _serve_balancers(self):
+        balanced = [stage for stage in self.stages.values() if stage.balanced]
+        for stage in balanced:
+            await stage.balancer.open()
+            config = uvicorn.Config(stage.balancer, host="0.0.0.0", port=stage.port, lifespan="off",
+                                    log_config=None, access_log=False, server_header=False,
+                                    date_header=False)
+            self._servers.append((stage, uvicorn.Server(config)))
+        await asyncio.gather(*(self._serve(stage, server) for stage, server in self._servers))
+        for stage in balanced:
+            await stage.balancer.close()
+
+    @staticmethod
+    async def _serve(stage, server):
+        try:
+            await server.serve()
+        except SystemExit:
+            logger.error(f"Balancer of {stage.name} could not start on port {stage.port}")
+
+    def _run_monitor(self):
+        while not self._stopping.is_set():
+            try:
+                self.check()
+                if AUTOSCALE_ENABLED and time.monotonic() - self._last_autoscale >= AUTOSCALE_INTERVAL:
+                    self._last_autoscale = time.monotonic()
+                    for stage in self.stages.values():
+                        self._autoscale(stage)
+            except Exception as e:
+                logger.error(f"Error checking replicas: {str(e)}")
+            starting = any(replica.status in (PENDING, STARTING)
+                           for stage in self.stages.values() for replica in stage.replicas)
+            # Checked often while replicas start up, so they get traffic as soon as they are ready
+            self._stopping.wait(0.1 if starting else REPLICA_CHECK_INTERVAL)
+
+    def check(self):
+        """Checks every replica once, restarting, starting and removing replicas as needed"""
+        replicas = [replica for stage in self.stages.values() for replica in stage.replicas]
+        changed = any(list(self._executor.map(self._check_replica, replicas)))
+
+        for stage in self.stages.values():
+            first = stage.replicas[0]
+            if first.status not in (PENDING, STARTING):
+                for replica in stage.replicas:
+                    if replica.status == PENDING:
+                        replica.start()
+                        changed = True
+            finished = [replica for replica in stage.replicas if replica.status == STOPPED]
+            if finished:
+                stage.replicas = [replica for replica in stage.replicas if replica.status != STOPPED]
+                changed = True
+            if AUTOSCALE_ENABLED:
+                stage._load_samples.append(sum(replica.outstanding for replica in stage.replicas))
+            if changed and stage.balancer is not None:
+                stage.balancer.wake()
+
+        if changed:
+            with self._changed:
+                self._changed.notify_all()
+
+    def _check_replica(self, replica):
+        """Updates the state of one replica, returning whether it changed"""
+        stage = replica.stage
+        previous = replica.status
+        now = time.monotonic()
+        process = replica.process
+        if process is None or self._stopping.is_set():
+            return False
+
+        if process.poll() is not None:
+            if replica.status == DRAINING:
+                logger.info(f"{stage.name} replica {replica.index} removed")
+                replica.status = STOPPED
+            elif replica.status != CRASHED:
+                # A replica that ran for a while starts over from the initial backoff
+                if now - replica.started_at > REPLICA_RESTART_BACKOFF_MAX:
+                    replica.backoff = REPLICA_RESTART_BACKOFF
+                logger.warning(f"{stage.name} replica {replica.index} exited with code {process.returncode}, "
+                               f"restarting in {replica.backoff:g}s")
+                replica.status = CRASHED
+                replica.restart_at = now + replica.backoff
+                replica.backoff = min(replica.backoff * 2, REPLICA_RESTART_BACKOFF_MAX)
+            elif now >= replica.restart_at:
+                replica.restarts += 1
+                replica.start()
+            return replica.status != previous
+
+        if replica.status == DRAINING:
+            if replica.outstanding == 0 or now >= replica.drain_deadline:
+                process.terminate()
+            return False
+
+        try:
+            response = requests.get(f"{replica.url}/readyz", timeout=1)
+            report = response.json()
+        except (requests.RequestException, ValueError):
+            replica.failed_checks += 1
+            if replica.ready_at is not None and replica.failed_checks >= REPLICA_LIVENESS_FAILURES:
+                logger.warning(f"{stage.name} replica {replica.index} stopped answering, killing it")
+                process.kill()
+            elif replica.status == READY:
+                replica.status = UNREADY
+            return replica.status != previous
+
+        replica.failed_checks = 0
+        replica.report = report
+        if response.status_code == 200:
+            if replica.ready_at is None:
+                replica.ready_at = now
+                phases = ", ".join(f"{name}={ms:.0f}ms" for name, ms in report.get("phases_ms", {}).items())
+                logger.info(f"{stage.name} replica {replica.index} ready after {now - replica.started_at:.2f}s "
+                            f"(startup phases: {phases})")
+            elif replica.status != READY:
+                logger.info(f"{stage.name} replica {replica.index} ready again")
+            replica.status = READY
+        elif report.get("status") == "failed":
+            if replica.status != FAILED:
+                logger.error(f"{stage.name} replica {replica.index} failed to start: {report.get('error')}")
+            replica.status = FAILED
+        elif replica.status == READY:
+            logger.warning(f"{stage.name} replica {replica.index} is no longer ready")
+            replica.status = UNREADY
+        return replica.status != previous
+
+    def _autoscale(self, stage):
+        """Adds or removes one replica of a stage from the queueing seen since the last run"""
+        balancer = stage.balancer
+        if balancer is None:
+            return
+        dispatched = balancer.dispatched - stage._last_dispatched
+        queue_wait = balancer.queue_wait_total - stage._last_queue_wait
+        stage._last_dispatched = balancer.dispatched
+        stage._last_queue_wait = balancer.queue_wait_total
+        samples, stage._load_samples = stage._load_samples, []
+
+        active = stage.active_replicas
+        stage.queue_ms = max(queue_wait / dispatched if dispatched else 0.0, balancer.oldest_wait()) * 1000
+        capacity = len(active) * balancer.max_outstanding
+        stage.utilization = sum(samples) / len(samples) / capacity if samples and capacity else 0.0
+        if time.monotonic() - stage.last_scaled < AUTOSCALE_COOLDOWN:
+            return
+
+        if stage.queue_ms > AUTOSCALE_TARGET_QUEUE_MS and len(active) < stage.max_replicas:
+            if any(replica.status in (PENDING, STARTING) for replica in active):
+                # Wait for the replica being added to take its share first
+                return
+            replica = stage._new_replica()
+            logger.info(f"Scaling {stage.name} up to {len(active) + 1} replicas "
+                        f"(queue wait {stage.queue_ms:.0f}ms > {AUTOSCALE_TARGET_QUEUE_MS:g}ms)")
+            replica.start()
+            stage.replicas = stage.replicas + [replica]
+            stage.last_scaled = time.monotonic()
+        elif (stage.queue_ms < AUTOSCALE_TARGET_QUEUE_MS and stage.utilization < AUTOSCALE_SCALE_DOWN_UTILIZATION
+              and len(active) > stage.min_replicas):
+            replica = max(active, key=lambda replica: replica.index)
+            logger.info(f"Scaling {stage.name} down to {len(active) - 1} replicas "
+                        f"(utilization {stage.utilization:.0%}), draining replica {replica.index}")
+            replica.status = DRAINING
+            replica.drain_deadline = time.monotonic() + REPLICA_DRAIN_TIMEOUT
+            stage.last_scaled = time.monotonic()
+        else:
+            return
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_until_ready(self, timeout):
+        """
+        Waits until every replica has started up, crashed or failed, or ``timeout`` passes
+
+        Returns:
+            bool: Whether every replica is ready
+        """
+        deadline = time.monotonic() + timeout
+        start_time = time.perf_counter()
+
+        def settled():
+            return all(replica.status not in (PENDING, STARTING)
+                       for stage in self.stages.values() for replica in stage.replicas)
+
+        with self._changed:
+            self._changed.wait_for(settled, max(0.0, deadline - time.monotonic()))
+        not_ready = [f"{stage.name}[{replica.index}]={replica.status}" for stage in self.stages.values()
+                     for replica in stage.replicas if replica.status != READY]
+        if not_ready:
+            logger.warning(f"Not ready after {time.perf_counter() - start_time:.0f}s: {', '.join(not_ready)}")
+        return not not_ready
+
+    def stop(self):
+        """Stops the monitor, the balancers and every replica"""
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=5)
+        for _, server in self._servers:
+            server.should_exit = True
+        replicas = [replica for stage in self.stages.values() for replica in stage.replicas
+                    if replica.process is not None]
+        for replica in replicas:
+            logger.info(f"Stopping {replica.stage.name} replica {replica.index}...")
+            replica.process.terminate()
+        for replica in replicas:
+            try:
+                replica.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"{replica.stage.name} replica {replica.index} did not terminate gracefully, "
+                               f"killing...")
+                replica.process.kill()
+            replica.status = STOPPED
+        if self._balancer_thread is not None:
+            self._balancer_thread.join(timeout=5)
+
+    def snapshot(self):
+        """Replicas and balancer of every stage, by stage name"""
+        return {name: stage.snapshot() for name, stage in self.stages.items()}